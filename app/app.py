@@ -2,175 +2,985 @@
 import cv2
 import os
 import numpy as np
-from ultralytics import YOLO
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import base64
+import copy
+import hashlib
 import io
+import json
+import logging
+import zipfile
+
+import tracing
+from batching import BatchScheduler
+from blob_store import BlobStore
+from jobs import JobQueue, QueueFullError
+from metrics import REGISTRY, REQUESTS
+from document_pipeline import DocumentPipeline, crop, decode, detect
+from model_registry import ModelRegistry
+from near_duplicates import NearDuplicateIndex, image_hash
+from product_db import KINDS as PRODUCT_KINDS
+from result_cache import ResultCache
+from refinement import EarlyExitPolicy
+from tracing import stage
+
+# Every log line carries the id of the request it belongs to.
+tracing.configure_logging()
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURATION ---
 # IMPORTANT: Update this path to point to your best trained model weights.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, "models", "best.pt")
 
+# Inference backend: 'pytorch' (the .pt weights), 'onnx' (ONNX Runtime) or 'openvino'.
+# The API never exports: make the ONNX/OpenVINO model next to MODEL_PATH beforehand
+# with `python app/backends.py export --backend onnx` (startup fails without it), and
+# check it with `python app/backends.py parity --backend onnx` before switching.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "pytorch")
+MODEL_INT8 = os.environ.get("MODEL_INT8") == "1" # OpenVINO only
+
 # --- ADVANCED CONFIGURATION ---
 CONFIDENCE_THRESHOLD = 0.5 
 CROP_BUFFER = 10
 
+# Initial detections that are confident, convex and isolated skip the second
+# refinement pass. Set to None to always refine.
+REFINEMENT_POLICY = EarlyExitPolicy(min_confidence=0.85, min_solidity=0.9, max_overlap=0.05)
+
+# Downscaled detection: uploads whose long side is more than twice this are
+# scanned and refined at reduced resolution (JPEGs are decoded at 1/2, 1/4 or
+# 1/8 scale); the documents are then cut from the full-resolution image.
+# 0 scans at full resolution.
+DETECTION_MAX_SIDE = int(os.environ.get("DETECTION_MAX_SIDE", 0))
+
+# Number of OCR worker processes used to read several documents in parallel.
+# Each worker keeps its own PaddleOCR instance in memory. 1 = OCR in-process.
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", max(1, min(4, (os.cpu_count() or 1) // 2))))
+
+# Detect text per document, then recognize the lines of all documents of a
+# request together in width-bucketed batches (see receipt_processor.py).
+OCR_BATCH_LINES = os.environ.get("OCR_BATCH_LINES") == "1"
+
+# Classify each document's orientation once from a few of its lines, instead
+# of classifying every text line (falls back per document when unsure).
+OCR_DOCUMENT_ORIENTATION = os.environ.get("OCR_DOCUMENT_ORIENTATION") == "1"
+
+# Rescale each crop so its characters are about this many pixels tall before
+# OCR (e.g. 32). 0 reads crops at the size segmentation produced them.
+OCR_TEXT_HEIGHT = int(os.environ.get("OCR_TEXT_HEIGHT", 0))
+
+# Where crops are kept when a client asks for URLs instead of inline base64 data.
+BLOB_DIR = os.path.join(BASE_DIR, "blobs")
+
+# How models are loaded: 'background' (start serving /healthz right away and load
+# in a thread), 'blocking' (load before serving) or 'lazy' (on first request).
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "background")
+
+# Cross-request YOLO batching: a batch runs when it is full or its oldest crop
+# has waited BATCH_MAX_WAIT_MS.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+
+# CPU threads torch may use in each server process (0 = torch default, all cores).
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", "0"))
+
+# Result cache: in-memory LRU budget, plus an optional SQLite tier that survives
+# restarts (set RESULT_CACHE_DISK_PATH to an empty string to disable it).
+RESULT_CACHE_MEMORY_MB = int(os.environ.get("RESULT_CACHE_MEMORY_MB", 256))
+RESULT_CACHE_DISK_PATH = os.environ.get("RESULT_CACHE_DISK_PATH", os.path.join(BASE_DIR, "cache", "results.sqlite"))
+
+# Near-duplicate reuse: an upload or a document crop whose perceptual hashes
+# differ from a recent one's in at most NEAR_DUPLICATE_RADIUS bits (of 64)
+# reuses that one's result, e.g. a receipt photographed twice. 0 disables it
+# (e.g. 8 to enable). Bounded by entry count and age in seconds.
+NEAR_DUPLICATE_RADIUS = int(os.environ.get("NEAR_DUPLICATE_RADIUS", 0))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.environ.get("NEAR_DUPLICATE_MAX_ENTRIES", 1024))
+NEAR_DUPLICATE_TTL = float(os.environ.get("NEAR_DUPLICATE_TTL", 600))
+
+# Background job pool for /segment/jobs. Submissions beyond the queue size get a 429.
+JOB_WORKERS = 2
+MAX_PENDING_JOBS = 32
+
+# Job state and results, shared by all server workers so a poll can land on any
+# of them. An empty string keeps jobs in each process (only for a single worker).
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join(BASE_DIR, "cache", "jobs.sqlite"))
+
+# Seconds between checks of database/mock_db.json for changes (0 = never reload).
+DB_POLL_INTERVAL = float(os.environ.get("DB_POLL_INTERVAL", 2))
+
+# Streamed /segment responses: one JSON event per line, or server-sent events.
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+# /segment/batch: several images (or a zip of them) per request, run through the
+# staged document pipeline (threads per stage below, bounded queues in between).
+# Detect threads share YOLO forward passes through the batching scheduler.
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 100))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_MB", 512)) * 1024 ** 2 # uncompressed zip contents
+BATCH_WORKERS = {
+    "decode": int(os.environ.get("BATCH_DECODE_WORKERS", 4)),
+    "detect": BATCH_MAX_SIZE,
+    "crop": 2,
+    "ocr": max(1, OCR_WORKERS),
+    "sink": 2, # encoding
+}
+BATCH_QUEUE_SIZE = 8
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+
 # --- FLASK APP INITIALIZATION ---
 app = Flask(__name__)
 CORS(app)
 
-# Initialize Receipt Processor lazily
-processor = None
+# --- MODEL REGISTRY (YOLO + PaddleOCR loaded once, shared by all requests) ---
+
+def synthetic_receipt():
+    """
+    A small receipt-like image used to warm the models up before real traffic.
+    """
+    image = np.full((480, 360, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(["KAM MARKET", "MLEKO 3.2% 75.00", "LEB BEL 30.00", "VKUPNO 105.00"]):
+        cv2.putText(image, line, (20, 60 + i * 50), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    return image
+
+def load_yolo():
+    # Imported here so spawned OCR workers, which re-import this module, don't pull in torch.
+    from backends import load_model
+    # Never export here: every server worker would write the same file at once.
+    return load_model(MODEL_PATH, backend=MODEL_BACKEND, int8=MODEL_INT8, export_if_missing=False)
+
+def warm_up_yolo(yolo):
+    yolo(synthetic_receipt(), conf=CONFIDENCE_THRESHOLD, verbose=False)
+
+def load_processor():
+    from receipt_processor import ReceiptProcessor
+    # Use 'mk' for Macedonian
+    return ReceiptProcessor(lang='mk', ocr_workers=OCR_WORKERS, db_poll_interval=DB_POLL_INTERVAL,
+                            batch_lines=OCR_BATCH_LINES, orient_documents=OCR_DOCUMENT_ORIENTATION,
+                            text_height=OCR_TEXT_HEIGHT)
+
+def warm_up_processor(proc):
+    proc.warm_up(synthetic_receipt())
+
+models = ModelRegistry()
+models.register("yolo", load_yolo, warm_up_yolo)
+models.register("ocr", load_processor, warm_up_processor)
+
+def get_model():
+    return models.get("yolo")
 
 def get_processor():
-    global processor
-    if processor is None:
-        try:
-            from receipt_processor import ReceiptProcessor
-            # Use 'mk' for Macedonian
-            processor = ReceiptProcessor(lang='mk')
-            print("ReceiptProcessor initialized with Macedonian support.")
-        except Exception as e:
-            print(f"Failed to initialize ReceiptProcessor: {e}")
-    return processor
-
-# --- LOAD THE MODEL (Done once when the server starts) ---
-print("Loading YOLO model...")
-try:
-    model = YOLO(MODEL_PATH)
-    print("YOLO model loaded successfully.")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    model = None
+    return models.get("ocr")
+
+# --- APP FACTORY (Done once per server process) ---
+_app_created = False
+
+def configure_threads():
+    """
+    Caps the CPU threads torch uses in this process, so several server workers
+    on one machine don't oversubscribe the cores.
+    """
+    if TORCH_THREADS > 0:
+        import torch
+        torch.set_num_threads(TORCH_THREADS)
+        print(f"Torch limited to {TORCH_THREADS} threads.")
+
+def create_app(preload=None):
+    """
+    Prepares this process to serve requests and returns the Flask app.
+
+    Production servers call this once per worker process (see gunicorn.conf.py,
+    asgi.py and start_server.sh/.bat), so each worker loads the models exactly once.
+
+    Args:
+        preload (str, optional): Overrides MODEL_PRELOAD ('background', 'blocking', 'lazy').
+    """
+    global _app_created
+    if not _app_created:
+        _app_created = True
+        configure_threads()
+        preload = preload or MODEL_PRELOAD
+        if preload != 'lazy':
+            models.load_all(background=(preload == 'background'))
+    return app
+
+# --- YOLO MICRO-BATCHING ---
+# One scheduler thread owns the model; crops from all concurrent requests are
+# grouped into shared forward passes (the ultralytics predictor is not thread-safe).
+yolo_scheduler = BatchScheduler(get_model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
 
 # --- CORE PROCESSING LOGIC (Adapted for API) ---
 
-def refine_and_collect(image_crop, model):
+def encode_document(doc_image, index, response_mode='inline'):
+    """
+    Encodes a document crop (once) and either embeds it or stores it.
+    """
+    _, buffer = cv2.imencode('.jpg', doc_image)
+    doc_data = {
+        "filename": f"doc_{index+1}.jpg",
+        "receipt_data": None
+    }
+    if response_mode == 'url':
+        doc_data["url"] = blob_url(blob_store.put(buffer.tobytes()))
+    else:
+        doc_data["data"] = base64.b64encode(buffer).decode('utf-8')
+    return doc_data
+
+
+def ocr_fields(receipt_info, response_mode='inline'):
+    """
+    The per-document OCR fields of a response, with debug step images moved
+    to the blob store in URL mode.
+    """
+    if response_mode == 'url':
+        for step in receipt_info.get("processing_steps", []):
+            step["url"] = blob_url(blob_store.put(base64.b64decode(step.pop("image"))))
+    return {"receipt_data": receipt_info,
+            # Flattened fields for convenience
+            "extracted_text": receipt_info.get("raw_text", ""),
+            "matches": receipt_info.get("matches", {"vendor": None, "items_found": []})}
+
+
+def read_receipts(proc, images, debug_steps=False):
+    """
+    proc.iter_process_images with the crop near-duplicate index in front: a
+    document that nearly matches one read recently (with the same OCR
+    settings and database) reuses its OCR and match result.
+
+    Yields:
+        tuple: (index, receipt_info), in completion order.
+    """
+    if crop_index is None:
+        yield from proc.iter_process_images(images, do_ocr=True, debug_steps=debug_steps)
+        return
+    tag = (proc.products.snapshot.cache_key, OCR_BATCH_LINES, OCR_DOCUMENT_ORIENTATION, OCR_TEXT_HEIGHT,
+           debug_steps)
+    with stage("near_duplicate"):
+        hashes = [image_hash(image) for image in images]
+    pending = []
+    for i, image_hashes in enumerate(hashes):
+        hit = crop_index.get(image_hashes, tag=tag)
+        if hit is None:
+            pending.append(i)
+            continue
+        receipt_info, distance = hit
+        # Copies: responses are modified afterwards (e.g. blob URLs for debug steps).
+        yield i, {**copy.deepcopy(receipt_info), "near_duplicate": {"distance": distance}}
+    if pending:
+        todo = [images[i] for i in pending]
+        for j, receipt_info in proc.iter_process_images(todo, do_ocr=True, debug_steps=debug_steps):
+            crop_index.put(hashes[pending[j]], copy.deepcopy(receipt_info), tag=tag)
+            yield pending[j], receipt_info
+
+
+def upload_events(image_bytes, mode='segment', response_mode='inline', debug_steps=False, reuse=None):
+    """
+    Runs the full pipeline (decode, segment, refine, encode, optional OCR) on an
+    upload and yields events as results become ready:
+
+        progress  after the initial scan and refinement, with the document count
+        document  one per crop, as soon as it is encoded (receipt_data is None)
+        ocr       one per document as its OCR finishes (in completion order)
+        done      at the end; carries status and any top-level fields
+        error     instead of everything else if the upload is not an image
+
+    Args:
+        image_bytes (bytes): The raw uploaded image file.
+        mode (str): 'segment' or 'ocr'.
+        response_mode (str): 'inline' embeds each crop as base64 in `data`;
+            'url' stores it in the blob store and returns its `url` instead.
+        debug_steps (bool): Include the OCR processing step images.
+        reuse (callable, optional): Called with the decoded detection image. A
+            response it returns (e.g. of a near-duplicate upload) is replayed
+            instead of running the rest of the pipeline.
     """
-    Recursively analyzes an image crop and returns a list of final, verified document images.
+    # Decode the image from the request (at reduced resolution for large uploads)
+    try:
+        with stage("decode"):
+            detection_image, source, factor = decode(image_bytes, DETECTION_MAX_SIDE)
+    except ValueError as e:
+        yield {"event": "error", "status": "error", "message": str(e), "http_status": 400}
+        return
+    reused = reuse(detection_image) if reuse is not None else None
+    if reused is not None:
+        yield from result_events(reused)
+        return
+
+    # Perform the initial scan and refine every detection.
+    # Crops at the same depth are batched into a single forward pass, shared
+    # with any other requests in flight through the scheduler.
+    logger.info("New request: performing initial scan on the uploaded image...")
+    roots, refinement_stats = detect(detection_image, factor, yolo_scheduler, conf=CONFIDENCE_THRESHOLD,
+                                     crop_buffer=CROP_BUFFER, policy=REFINEMENT_POLICY)
+    logger.info(f"Refinement: {refinement_stats.forward_passes} forward passes, "
+                f"{refinement_stats.skipped_passes} skipped.")
+
+    # Cut the final, verified documents from the full-resolution image
+    with stage("crop_encode"):
+        all_final_docs = crop(roots, source, detection_image.shape)
+    yield {"event": "progress", "stage": "scan", "documents": len(all_final_docs),
+           "refinement": refinement_stats.to_dict()}
+    if not all_final_docs:
+        yield {"event": "done", "status": "success", "message": "No documents detected"}
+        return
+
+    # Encode each document (once) and either embed it or store it
+    for i, doc_image in enumerate(all_final_docs):
+        with stage("crop_encode"):
+            doc_data = encode_document(doc_image, i, response_mode)
+        yield {"event": "document", "index": i, "document": doc_data}
+
+    # Run the Receipt Processor on all documents at once (spread over the OCR pool)
+    done = {"event": "done", "status": "success"}
+    if mode == 'ocr':
+        proc = get_processor()
+        if proc:
+            logger.info(f"Processing {len(all_final_docs)} receipts with OCR...")
+            for i, receipt_info in read_receipts(proc, all_final_docs, debug_steps):
+                yield {"event": "ocr", "index": i, **ocr_fields(receipt_info, response_mode)}
+            done["db_version"] = proc.db_version
     
+    logger.info(f"Request complete. Returned {len(all_final_docs)} documents.")
+    yield done
+
+
+def apply_event(result, event):
+    """
+    Folds one upload event into the (initially empty) response dict.
+    """
+    kind = event["event"]
+    if kind == "progress":
+        result["documents"] = [None] * event["documents"]
+        result["refinement"] = event["refinement"]
+    elif kind == "document":
+        result["documents"][event["index"]] = event["document"]
+    elif kind == "ocr":
+        result["documents"][event["index"]].update(
+            {key: event[key] for key in ("receipt_data", "extracted_text", "matches")})
+    else:
+        result.update({key: value for key, value in event.items() if key != "event"})
+    return result
+
+
+def result_events(result):
+    """
+    Replays a finished response dict (e.g. from the result cache) as events.
+    """
+    documents = result.get("documents", [])
+    yield {"event": "progress", "stage": "scan", "documents": len(documents), "refinement": result.get("refinement")}
+    for i, doc in enumerate(documents):
+        document = {key: value for key, value in doc.items() if key not in ("extracted_text", "matches")}
+        yield {"event": "document", "index": i, "document": {**document, "receipt_data": None}}
+    for i, doc in enumerate(documents):
+        if doc.get("receipt_data"):
+            yield {"event": "ocr", "index": i,
+                   **{key: doc.get(key) for key in ("receipt_data", "extracted_text", "matches")}}
+    yield {"event": "done", **{key: value for key, value in result.items() if key not in ("documents", "refinement")}}
+
+
+def process_upload(image_bytes, mode='segment', response_mode='inline', debug_steps=False):
+    """
+    Runs the full pipeline on an upload and returns the complete response.
+
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    result = {}
+    for event in upload_events(image_bytes, mode, response_mode, debug_steps):
+        apply_event(result, event)
+    return result, result.pop("http_status", 200)
+
+
+def blob_url(key):
+    return f"/blobs/{key}"
+
+
+_model_fingerprint = None
+
+def model_fingerprint():
+    """
+    Hash of the model weights plus the backend, computed once per process.
+    """
+    global _model_fingerprint
+    if _model_fingerprint is None:
+        digest = hashlib.sha256(f"{MODEL_BACKEND}:{MODEL_INT8}:".encode())
+        if os.path.isfile(MODEL_PATH):
+            with open(MODEL_PATH, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        _model_fingerprint = digest.hexdigest()[:16]
+    return _model_fingerprint
+
+
+def cache_settings(mode='segment', response_mode='inline', debug_steps=False):
+    """
+    Everything besides the image bytes that can change the response.
+    """
+    db_version = None
+    if mode == 'ocr':
+        proc = get_processor()
+        # Version and content hash, so an edit or a reload invalidates OCR results.
+        db_version = proc.products.snapshot.cache_key if proc else None
+    policy = REFINEMENT_POLICY and (REFINEMENT_POLICY.min_confidence, REFINEMENT_POLICY.min_solidity,
+                                    REFINEMENT_POLICY.max_overlap)
+    return [model_fingerprint(), CONFIDENCE_THRESHOLD, CROP_BUFFER, DETECTION_MAX_SIDE, policy, mode,
+            response_mode, debug_steps, db_version,
+            mode == 'ocr' and (OCR_BATCH_LINES, OCR_DOCUMENT_ORIENTATION, OCR_TEXT_HEIGHT)]
+
+
+def cache_key(image_bytes, **options):
+    """
+    Builds the result cache key: everything that can change the response for these bytes.
+    """
+    parts = [hashlib.sha256(image_bytes).hexdigest()] + cache_settings(**options)
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _blobs_present(result):
+    # URL-mode responses point into the blob store, which may have been pruned since.
+    urls = [doc.get("url") for doc in result.get("documents", [])]
+    for doc in result.get("documents", []):
+        urls.extend(step.get("url") for step in (doc.get("receipt_data") or {}).get("processing_steps", []))
+    return all(blob_store.path(url.rsplit('/', 1)[-1]) for url in urls if url)
+
+
+def near_duplicate_result(detection_image, **options):
+    """
+    Looks for a recent upload with the same options whose image is a near
+    duplicate of this (decoded) one (see near_duplicates.py).
+
+    Returns:
+        tuple: (its cached response or None, the upload's hashes)
+    """
+    with stage("near_duplicate"):
+        hashes = image_hash(detection_image)
+        hit = upload_index.get(hashes, tag=repr(cache_settings(**options)))
+    if hit is None:
+        return None, hashes
+    key, distance = hit
+    # A probe, not a lookup of this upload: the cache's hit/miss counts stay as they are.
+    result = result_cache.peek(key)
+    if result is None or not _blobs_present(result):
+        return None, hashes
+    logger.info(f"Near-duplicate upload (distance {distance}), reusing its result.")
+    return {**result, "cached": True, "near_duplicate": {"distance": distance}}, hashes
+
+
+def remember_result(key, result, hashes, **options):
+    """
+    Stores a successful response in the result cache and, with its hashes, in
+    the near-duplicate index.
+    """
+    result_cache.put(key, result)
+    if hashes is not None:
+        upload_index.put(hashes, key, tag=repr(cache_settings(**options)))
+
+
+def cached_upload_events(image_bytes, **options):
+    """
+    upload_events with the result cache in front of it. Hits are replayed as
+    events, and so are near-duplicate hits, found once the upload is decoded.
+    Only new, successful responses are cached, once the last event is out.
+    """
+    key = cache_key(image_bytes, **options)
+    result = result_cache.get(key)
+    if result is not None:
+        if _blobs_present(result):
+            logger.info("Result cache hit.")
+            yield from result_events({**result, "cached": True})
+            return
+        result_cache.discard(key)
+
+    hashes = None
+
+    def reuse(detection_image):
+        nonlocal hashes
+        reused, hashes = near_duplicate_result(detection_image, **options)
+        return reused
+
+    result = {}
+    for event in upload_events(image_bytes, reuse=reuse if upload_index is not None else None, **options):
+        apply_event(result, event)
+        yield event
+    if "http_status" not in result and "near_duplicate" not in result:
+        remember_result(key, result, hashes, **options)
+
+
+def cached_process_upload(image_bytes, **options):
+    """
+    process_upload with the result cache in front of it.
+    """
+    result = {}
+    for event in cached_upload_events(image_bytes, **options):
+        apply_event(result, event)
+    return result, result.pop("http_status", 200)
+
+
+# --- BATCH PIPELINE ---
+
+def batch_pipeline(mode='segment', response_mode='inline', debug_steps=False):
+    """
+    The document pipeline for a /segment/batch request: the same steps as
+    upload_events, each on its own threads. Its sink builds each image's
+    /segment-style result. Near duplicates of recent uploads skip the stages
+    after decoding; every item gets its upload's `hashes`.
+    """
+    proc = get_processor() if mode == 'ocr' else None
+
+    def reuse(item):
+        reused, item["hashes"] = near_duplicate_result(item["detection"], mode=mode, response_mode=response_mode,
+                                                       debug_steps=debug_steps)
+        return reused
+
+    def ocr(images):
+        results = [None] * len(images)
+        for i, receipt_info in read_receipts(proc, images, debug_steps):
+            results[i] = receipt_info
+        return results
+
+    def respond(item):
+        documents = [encode_document(image, i, response_mode) for i, image in enumerate(item["documents"])]
+        result = {"status": "success", "documents": documents, "refinement": item["refinement"]}
+        if not documents:
+            result["message"] = "No documents detected"
+        if proc is not None:
+            for doc_data, receipt_info in zip(documents, item["ocr"]):
+                doc_data.update(ocr_fields(receipt_info, response_mode))
+            result["db_version"] = proc.db_version
+        return result
+
+    return DocumentPipeline(yolo_scheduler, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER,
+                            policy=REFINEMENT_POLICY, max_side=DETECTION_MAX_SIDE,
+                            ocr=ocr if proc is not None else None, sink=respond,
+                            reuse=reuse if upload_index is not None else None, workers=BATCH_WORKERS, queue_size=BATCH_QUEUE_SIZE)
+
+
+def unique_name(name, taken):
+    """
+    Makes repeated file names in a batch distinct: 'a.jpg', 'a.jpg (2)', ...
+    """
+    candidate, n = name, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{name} ({n})"
+    return candidate
+
+
+def process_batch(entries, mode='segment', response_mode='inline', debug_steps=False):
+    """
+    Runs every image of a batch through the document pipeline; images already
+    in the result cache (or near duplicates of recent ones) skip it.
+
     Args:
-        image_crop (np.ndarray): The cropped image segment to analyze.
-        model (YOLO): The loaded YOLO segmentation model.
+        entries (list): (file name, callable returning the bytes) pairs. Files
+            are only read when the pipeline is ready for them.
 
     Returns:
-        list: A list of NumPy arrays, where each array is a final cropped document.
+        dict: File name -> result, in upload order.
     """
-    final_documents = []
-    if image_crop.size == 0:
-        return final_documents
+    options = {"mode": mode, "response_mode": response_mode, "debug_steps": debug_steps}
+    results = {}
+    named = []
+    for name, read in entries:
+        name = unique_name(name, results)
+        results[name] = None
+        named.append((name, read))
+    keys = {}
 
-    # Run the model on the specific crop
-    results = model(image_crop, conf=CONFIDENCE_THRESHOLD, verbose=False)
-    masks = results[0].masks
-    
-    # CASE 1: Composite Document Found (more than 1 mask)
-    if masks and len(masks) > 1:
-        print(f"  - Composite document detected, splitting into {len(masks)} pieces...")
-        for polygon in masks.xy:
-            x, y, w, h = cv2.boundingRect(np.array(polygon, dtype=np.int32))
-            sub_crop = image_crop[
-                max(0, y - CROP_BUFFER): y + h + CROP_BUFFER,
-                max(0, x - CROP_BUFFER): x + w + CROP_BUFFER
-            ]
-            # Recursively refine the new, smaller piece and add its results
-            final_documents.extend(refine_and_collect(sub_crop, model))
-            
-    # CASE 2: Single or No Document Found (Base case)
-    else:
-        # This crop is considered a final, single document
-        print("  - Verified as a single document.")
-        final_documents.append(image_crop)
-        
-    return final_documents
+    def inputs():
+        for name, read in named:
+            try:
+                image_bytes = read()
+            except (OSError, zipfile.BadZipFile) as e:
+                results[name] = {"status": "error", "message": f"Could not read file: {e}"}
+                continue
+            key = cache_key(image_bytes, **options)
+            cached = result_cache.get(key)
+            if cached is not None:
+                if _blobs_present(cached):
+                    results[name] = {**cached, "cached": True}
+                    continue
+                result_cache.discard(key)
+            keys[name] = key
+            yield name, image_bytes
 
+    for name, item, error in batch_pipeline(**options).run(inputs()):
+        results[name] = item["output"] if error is None else {"status": "error", "message": str(error)}
+        status = 200 if error is None else 400 if isinstance(error, ValueError) else 500
+        REQUESTS.inc(mode=mode, status=status)
+        if error is None and not item.get("reused"):
+            remember_result(keys[name], results[name], item.get("hashes"), **options)
+    return results
 
-# --- API ENDPOINT ---
 
-@app.route('/segment', methods=['POST'])
-def segment_document():
+def stream_format():
     """
-    API endpoint to receive an image, segment it, and return the documents.
+    Returns 'ndjson' or 'sse' if the client asked for a streamed response
+    (through the `stream` form field or the Accept header), else None.
+    """
+    fmt = request.form.get('stream', '').lower()
+    if fmt in STREAM_FORMATS:
+        return fmt
+    for fmt, mimetype in STREAM_FORMATS.items():
+        if request.accept_mimetypes.best == mimetype:
+            return fmt
+    return None
+
+
+def stream_response(events, fmt, mode='segment', timings=False):
+    """
+    Sends events to the client as they are produced, as NDJSON lines or
+    server-sent events. A failure mid-stream becomes a final error event.
+    With timings, the final event carries the request's stage timings.
+    """
+    def encode(event):
+        with stage("serialization"):
+            data = json.dumps(event)
+        return f"event: {event['event']}\ndata: {data}\n\n" if fmt == 'sse' else data + "\n"
+
+    # The body is generated after the view returns, outside the request's trace.
+    trace = tracing.current_trace()
+
+    def generate():
+        with tracing.use_trace(trace):
+            try:
+                for event in events:
+                    if event["event"] in ("done", "error"):
+                        REQUESTS.inc(mode=mode, status=event.get("http_status", 200))
+                        if timings:
+                            event = {**event, "timings": trace.to_dict()}
+                    yield encode(event)
+            except Exception as e:
+                logger.exception("Streamed request failed")
+                REQUESTS.inc(mode=mode, status=500)
+                yield encode({"event": "error", "status": "error", "message": str(e), "http_status": 500})
+
+    response = Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the whole stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def read_upload():
+    """
+    Validates the multipart upload of the current request.
+
+    Returns:
+        tuple: (image bytes, options, None) on success, or (None, None, error response).
+               options holds the keyword arguments for process_upload.
     """
-    if model is None:
-        return jsonify({"status": "error", "message": "Model is not loaded"}), 500
+    if get_model() is None:
+        return None, None, (jsonify({"status": "error", "message": "Model is not loaded"}), 500)
 
-    # 1. Check if an image file is in the request
     if 'file' not in request.files:
-        return jsonify({"status": "error", "message": "No file part in the request"}), 400
+        return None, None, (jsonify({"status": "error", "message": "No file part in the request"}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"status": "error", "message": "No selected file"}), 400
+        return None, None, (jsonify({"status": "error", "message": "No selected file"}), 400)
+
+    options = {
+        "mode": request.form.get('mode', 'segment'), # 'segment' or 'ocr'
+        "response_mode": request.form.get('response', 'inline'), # 'inline' or 'url'
+        "debug_steps": form_flag('debug_steps'),
+    }
+    return file.read(), options, None
+
+
+def read_batch_upload():
+    """
+    Validates the multipart upload of a /segment/batch request: any number of
+    image files (in `files` or `file` parts) and zip archives of images.
+
+    Returns:
+        tuple: (entries, options, None) on success, or (None, None, error response).
+               entries are (file name, callable returning the bytes) pairs; zip
+               members are named by their path inside the archive.
+    """
+    if get_model() is None:
+        return None, None, (jsonify({"status": "error", "message": "Model is not loaded"}), 500)
+
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return None, None, (jsonify({"status": "error", "message": "No files in the request"}), 400)
+
+    entries = []
+    for file in files:
+        if not file.filename.lower().endswith('.zip'):
+            entries.append((file.filename, file.read))
+            continue
+        try:
+            archive = zipfile.ZipFile(file.stream)
+        except zipfile.BadZipFile:
+            return None, None, (jsonify({"status": "error",
+                                         "message": f"'{file.filename}' is not a valid zip archive"}), 400)
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                   and not info.filename.startswith('__MACOSX/')]
+        # Checked against the sizes in the archive's directory, before anything is extracted.
+        if sum(info.file_size for info in members) > BATCH_MAX_BYTES:
+            return None, None, (jsonify({"status": "error", "message":
+                                         f"'{file.filename}' is larger than {BATCH_MAX_BYTES // 1024 ** 2} MB "
+                                         "uncompressed"}), 413)
+        entries.extend((info.filename, lambda info=info, archive=archive: archive.read(info))
+                       for info in members)
+
+    if not entries:
+        return None, None, (jsonify({"status": "error", "message": "No images in the request"}), 400)
+    if len(entries) > BATCH_MAX_FILES:
+        return None, None, (jsonify({"status": "error",
+                                     "message": f"At most {BATCH_MAX_FILES} images per batch"}), 413)
+
+    options = {
+        "mode": request.form.get('mode', 'segment'), # 'segment' or 'ocr'
+        "response_mode": request.form.get('response', 'inline'), # 'inline' or 'url'
+        "debug_steps": form_flag('debug_steps'),
+    }
+    return entries, options, None
+
+
+def form_flag(name):
+    return request.form.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+# --- BLOB STORE ---
+# Crops returned by reference (response=url) are stored once, keyed by content hash.
+blob_store = BlobStore(BLOB_DIR)
+
+
+# --- RESULT CACHE ---
+# Re-uploads of the same photo (same model, thresholds, mode and DB) are answered from here.
+result_cache = ResultCache(memory_max_bytes=RESULT_CACHE_MEMORY_MB * 1024 ** 2,
+                           disk_path=RESULT_CACHE_DISK_PATH or None)
+
+# --- NEAR-DUPLICATE INDEXES ---
+# Re-photographed uploads point to their earlier result cache key; document
+# crops keep their OCR results. None when NEAR_DUPLICATE_RADIUS is 0.
+upload_index = crop_index = None
+if NEAR_DUPLICATE_RADIUS > 0:
+    upload_index = NearDuplicateIndex(NEAR_DUPLICATE_RADIUS, NEAR_DUPLICATE_MAX_ENTRIES, NEAR_DUPLICATE_TTL)
+    crop_index = NearDuplicateIndex(NEAR_DUPLICATE_RADIUS, NEAR_DUPLICATE_MAX_ENTRIES, NEAR_DUPLICATE_TTL)
+
+
+# --- BACKGROUND JOBS ---
+# OCR requests can take seconds; the job API runs them on a bounded worker pool.
+def run_job(image_bytes, request_id=None, timings=False, **options):
+    # Job threads get a trace of their own, under the id of the submitting request.
+    with tracing.trace_request(request_id) as trace:
+        result, status_code = cached_process_upload(image_bytes, **options)
+        REQUESTS.inc(mode=options.get("mode"), status=status_code)
+        if timings:
+            result = {**result, "timings": trace.to_dict()}
+    return result, status_code
+
+job_queue = JobQueue(run_job, num_workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS,
+                     store_path=JOB_STORE_PATH or None)
+
+
+# --- REQUEST TRACING ---
+# Each request gets an id (the client's X-Request-ID, or a new one) that shows
+# up in the logs and in the response headers.
+
+@app.before_request
+def begin_trace():
+    trace, token = tracing.start_trace(request.headers.get('X-Request-ID'))
+    request.environ['app.trace_token'] = token
+
+@app.after_request
+def add_request_id(response):
+    request_id = tracing.current_request_id()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.teardown_request
+def finish_trace(exc):
+    token = request.environ.pop('app.trace_token', None)
+    if token is not None:
+        tracing.end_trace(token)
+
+
+# --- API ENDPOINTS ---
+
+@app.route('/segment', methods=['POST'])
+def segment_document():
+    """
+    API endpoint to receive an image, segment it, and return the documents.
+
+    With `stream=ndjson` or `stream=sse` (or the matching Accept header), each
+    document is sent as soon as it is ready instead of in one response.
+    """
+    image_bytes, options, error = read_upload()
+    if error:
+        return error
+
+    timings = form_flag('timings')
+    fmt = stream_format()
+    if fmt:
+        return stream_response(cached_upload_events(image_bytes, **options), fmt,
+                               mode=options["mode"], timings=timings)
 
     try:
-        # 2. Read and decode the image from the request
-        image_bytes = file.read()
-        image_np_array = np.frombuffer(image_bytes, np.uint8)
-        original_image = cv2.imdecode(image_np_array, cv2.IMREAD_COLOR)
-
-        if original_image is None:
-            return jsonify({"status": "error", "message": "Could not decode image"}), 400
-
-        print("\n--- New Request Received ---")
-        print("Performing initial scan on the uploaded image...")
-        
-        # 3. Perform the initial scan
-        initial_results = model(original_image, conf=CONFIDENCE_THRESHOLD, verbose=False)
-        if initial_results[0].masks is None:
-            return jsonify({"status": "success", "documents": [], "message": "No documents detected"})
-
-        # 4. Get processing mode
-        mode = request.form.get('mode', 'segment') # 'segment' or 'ocr'
-        do_ocr = (mode == 'ocr')
-
-        # 5. Refine each initially found document
-        all_final_docs = []
-        for polygon in initial_results[0].masks.xy:
-            x, y, w, h = cv2.boundingRect(np.array(polygon, dtype=np.int32))
-            initial_crop = original_image[
-                max(0, y - CROP_BUFFER): y + h + CROP_BUFFER,
-                max(0, x - CROP_BUFFER): x + w + CROP_BUFFER
-            ]
-            
-            # This function will handle the recursive splitting
-            all_final_docs.extend(refine_and_collect(initial_crop, model))
-
-        # 6. Process each document (Encode + Receipt Processing)
-        processed_documents = []
-        for i, doc_image in enumerate(all_final_docs):
-            # Encode image
-            _, buffer = cv2.imencode('.jpg', doc_image)
-            encoded_string = base64.b64encode(buffer).decode('utf-8')
-            
-            doc_data = {
-                "filename": f"doc_{i+1}.jpg",
-                "data": encoded_string,
-                "receipt_data": None
-            }
-            
-            # Run Receipt Processor
-            if do_ocr:
-                proc = get_processor()
-                if proc:
-                    print(f"Processing receipt for document {i+1} with OCR...")
-                    receipt_info = proc.process_image(doc_image, do_ocr=True)
-                    doc_data["receipt_data"] = receipt_info
-                    # Add flattened fields for convenience
-                    doc_data["extracted_text"] = receipt_info.get("raw_text", "")
-                    doc_data["matches"] = receipt_info.get("matches", {"vendor": None, "items_found": []})
-            
-            processed_documents.append(doc_data)
-        
-        print(f"Request complete. Returning {len(processed_documents)} documents.")
-        return jsonify({"status": "success", "documents": processed_documents})
+        result, status_code = cached_process_upload(image_bytes, **options)
+        REQUESTS.inc(mode=options["mode"], status=status_code)
+        if timings:
+            result = {**result, "timings": tracing.current_trace().to_dict()}
+        with stage("serialization"):
+            response = jsonify(result)
+        return response, status_code
 
     except Exception as e:
+        logger.exception("Request failed")
+        REQUESTS.inc(mode=options["mode"], status=500)
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# --- RUN THE FLASK APP ---
+
+@app.route('/segment/batch', methods=['POST'])
+def segment_batch():
+    """
+    Segments several images in one request (multiple files and/or zip archives)
+    and returns one /segment-style result per image, keyed by file name.
+
+    Decoding, detection, cropping and OCR of different images overlap; see
+    batch_pipeline.
+    """
+    entries, options, error = read_batch_upload()
+    if error:
+        return error
+
+    try:
+        results = process_batch(entries, **options)
+    except Exception as e:
+        logger.exception("Batch request failed")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    response = {"status": "success", "files": len(results), "results": results}
+    if form_flag('timings'):
+        response["timings"] = tracing.current_trace().to_dict()
+    with stage("serialization"):
+        response = jsonify(response)
+    return response
+
+
+@app.route('/segment/jobs', methods=['POST'])
+def submit_segment_job():
+    """
+    Queues an image for background processing and returns a job id immediately.
+    """
+    image_bytes, options, error = read_upload()
+    if error:
+        return error
+
+    try:
+        job_id = job_queue.submit(image_bytes, request_id=tracing.current_request_id(),
+                                  timings=form_flag('timings'), **options)
+    except QueueFullError as e:
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    return jsonify({"status": "queued", "job_id": job_id, "status_url": f"/segment/jobs/{job_id}"}), 202
+
+
+@app.route('/segment/jobs/<job_id>', methods=['GET'])
+def get_segment_job(job_id):
+    """
+    Returns the status of a queued job, and its result once it has finished.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown or expired job id"}), 404
+    return jsonify(job)
+
+@app.route('/blobs/<key>', methods=['GET'])
+def get_blob(key):
+    """
+    Serves a stored crop. Blobs are immutable, so the key is a strong ETag;
+    conditional and Range requests are handled by send_file.
+    """
+    path = blob_store.path(key)
+    if path is None:
+        return jsonify({"status": "error", "message": "Unknown blob"}), 404
+    response = send_file(path, mimetype='image/jpeg', conditional=True, etag=key, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness: the process is up. Includes the model load state for convenience.
+    """
+    return jsonify({"status": "ok", **models.status()})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness: 200 once every model is loaded and warmed up, 503 before that.
+    """
+    status = models.status()
+    if status["ready"]:
+        return jsonify({"status": "ready", **status}), 200
+    failed = any(m["state"] == "failed" for m in status["models"].values())
+    return jsonify({"status": "failed" if failed else "loading", **status}), 503
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Runtime statistics: YOLO batching (queue depth, batch sizes, wait times),
+    result cache hits/misses, near-duplicate reuse and job queue.
+    """
+    return jsonify({
+        "batching": yolo_scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "near_duplicates": upload_index and {"uploads": upload_index.stats(), "crops": crop_index.stats()},
+        "jobs": {"pending": job_queue.pending()},
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, request counts, YOLO
+    forward passes and OCR calls for this server process.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/db', methods=['GET'])
+def get_database():
+    """
+    Returns the version and size of the product database used for matching.
+    """
+    proc = get_processor()
+    if proc is None:
+        return jsonify({"status": "error", "message": "OCR is not available"}), 503
+    snapshot = proc.products.snapshot
+    return jsonify({"version": snapshot.version, "content_hash": snapshot.content_hash,
+                    **{kind: len(snapshot.db[kind]) for kind in PRODUCT_KINDS}})
+
+@app.route('/db/<kind>', methods=['POST'])
+def update_database(kind):
+    """
+    Adds and/or removes vendors or items without a full rebuild.
+    Body: {"add": [...], "remove": [...]}. Returns the new database version.
+    """
+    if kind not in PRODUCT_KINDS:
+        return jsonify({"status": "error", "message": f"Unknown kind '{kind}'"}), 404
+    body = request.get_json(silent=True) or {}
+    add, remove = body.get("add", []), body.get("remove", [])
+    if not all(isinstance(names, list) and all(isinstance(n, str) for n in names) for names in (add, remove)):
+        return jsonify({"status": "error", "message": "'add' and 'remove' must be lists of strings"}), 400
+
+    proc = get_processor()
+    if proc is None:
+        return jsonify({"status": "error", "message": "OCR is not available"}), 503
+    version = proc.products.update(kind, add=add, remove=remove)
+    return jsonify({"status": "success", "version": version, kind: len(proc.db[kind])})
+
+# --- RUN THE FLASK APP (development server) ---
+# For production use start_server.sh / start_server.bat instead.
 if __name__ == '__main__':
-    # Use host='0.0.0.0' to make the server accessible from other devices on your network
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Use host='0.0.0.0' to make the server accessible from other devices on your network.
+    # The reloader is disabled because it would load every model a second time.
+    create_app().run(host='0.0.0.0', port=5000, debug=os.environ.get("FLASK_DEBUG") == "1",
+                     use_reloader=False, threaded=True)
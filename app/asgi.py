@@ -0,0 +1,15 @@
+# asgi.py
+"""
+Async front end for the API. Run from the app/ folder:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 2
+
+The ASGI server receives each upload asynchronously and only hands the request
+to the Flask app (on a thread pool) once the whole body has arrived, so slow
+clients don't hold an inference slot while they upload.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+application = WsgiToAsgi(create_app())
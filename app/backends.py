@@ -0,0 +1,195 @@
+# backends.py
+"""
+Inference backends for the segmentation model.
+
+The PyTorch `.pt` weights can be exported to ONNX (run by ONNX Runtime) or to
+OpenVINO IR (optionally INT8-quantized, calibrated on the validation split).
+Ultralytics loads every format through the same YOLO class, so the rest of the
+pipeline does not care which backend is in use.
+
+Usage (from the repository root):
+    python app/backends.py export --backend onnx
+    python app/backends.py export --backend openvino --int8
+    python app/backends.py parity --backend onnx
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WEIGHTS = os.path.join(BASE_DIR, "models", "best.pt")
+DEFAULT_TEST_IMAGES = os.path.join(BASE_DIR, "..", "test_images")
+CALIBRATION_IMAGES = os.path.join(BASE_DIR, "..", "training", "dataset", "valid", "images")
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+IMAGE_SIZE = 640
+
+# Parity thresholds: the exported model must find the same number of documents
+# and its masks must overlap the PyTorch masks at least this much.
+MIN_MASK_IOU = 0.9
+
+
+def model_path_for(weights, backend, int8=False):
+    """
+    Returns where ultralytics writes (and where we load) the exported model.
+    """
+    stem, _ = os.path.splitext(weights)
+    if backend == 'pytorch':
+        return weights
+    if backend == 'onnx':
+        return stem + ".onnx"
+    if backend == 'openvino':
+        return stem + ("_int8" if int8 else "") + "_openvino_model"
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def _calibration_yaml():
+    # The dataset's data.yaml uses Roboflow-relative paths, so point a temporary
+    # config straight at the validation images.
+    images = os.path.abspath(CALIBRATION_IMAGES)
+    f = tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False)
+    f.write(f"train: {images}\nval: {images}\nnc: 1\nnames: ['document']\n")
+    f.close()
+    return f.name
+
+
+def export_model(weights=DEFAULT_WEIGHTS, backend='onnx', int8=False, imgsz=IMAGE_SIZE):
+    """
+    Exports the `.pt` weights to the given backend and returns the exported path.
+
+    Models are exported with a dynamic batch dimension so the refinement engine
+    and the micro-batching scheduler can still send several crops per pass.
+    """
+    from ultralytics import YOLO
+
+    if backend == 'pytorch':
+        return weights
+    model = YOLO(weights)
+    if backend == 'onnx':
+        path = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    elif backend == 'openvino':
+        kwargs = {"int8": True, "data": _calibration_yaml()} if int8 else {}
+        path = model.export(format='openvino', imgsz=imgsz, dynamic=True, **kwargs)
+    else:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    print(f"Exported {weights} to {path}")
+    return path
+
+
+def load_model(weights=DEFAULT_WEIGHTS, backend='pytorch', int8=False, export_if_missing=True):
+    """
+    Loads the segmentation model for the selected backend.
+
+    Args:
+        weights (str): Path to the `.pt` weights the exports are derived from.
+        backend (str): 'pytorch', 'onnx' or 'openvino'.
+        int8 (bool): Use the INT8 OpenVINO model.
+        export_if_missing (bool): Export from the `.pt` weights if needed.
+    """
+    from ultralytics import YOLO
+
+    path = model_path_for(weights, backend, int8)
+    if not os.path.exists(path):
+        if not export_if_missing:
+            int8_flag = " --int8" if int8 else ""
+            raise FileNotFoundError(f"No {backend} model at '{path}'; export it first with "
+                                    f"`python app/backends.py export --backend {backend}{int8_flag}`")
+        path = export_model(weights, backend, int8)
+    print(f"Loading {backend} model from: {path}")
+    return YOLO(path, task='segment')
+
+
+# --- PARITY CHECK ---
+
+def _mask_image(polygon, shape):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    if len(polygon):
+        cv2.fillPoly(mask, [np.array(polygon, dtype=np.int32)], 1)
+    return mask
+
+
+def _mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def compare_masks(reference_polygons, candidate_polygons, shape):
+    """
+    Greedily pairs masks by IoU and returns the IoU of every reference mask
+    (0.0 for a reference mask that has no counterpart).
+    """
+    reference = [_mask_image(p, shape) for p in reference_polygons]
+    candidates = [_mask_image(p, shape) for p in candidate_polygons]
+    ious = []
+    for ref in reference:
+        if not candidates:
+            ious.append(0.0)
+            continue
+        scores = [_mask_iou(ref, cand) for cand in candidates]
+        best = int(np.argmax(scores))
+        ious.append(scores[best])
+        candidates.pop(best)
+    return ious
+
+
+def check_parity(weights=DEFAULT_WEIGHTS, backend='onnx', int8=False, images_dir=DEFAULT_TEST_IMAGES,
+                 conf=0.5, min_iou=MIN_MASK_IOU):
+    """
+    Runs the PyTorch model and the exported model on every test image and
+    compares the document count and the mask IoU.
+
+    Returns:
+        bool: True if every image matches within the thresholds.
+    """
+    reference_model = load_model(weights, 'pytorch')
+    candidate_model = load_model(weights, backend, int8)
+
+    passed = True
+    timings = {"pytorch": 0.0, backend: 0.0}
+    for name in sorted(os.listdir(images_dir)):
+        if not name.lower().endswith(('.png', '.jpg', '.jpeg')):
+            continue
+        image = cv2.imread(os.path.join(images_dir, name))
+        if image is None:
+            continue
+
+        start = time.perf_counter()
+        reference = reference_model(image, conf=conf, verbose=False)[0]
+        timings["pytorch"] += time.perf_counter() - start
+        start = time.perf_counter()
+        candidate = candidate_model(image, conf=conf, verbose=False)[0]
+        timings[backend] += time.perf_counter() - start
+
+        reference_polygons = reference.masks.xy if reference.masks is not None else []
+        candidate_polygons = candidate.masks.xy if candidate.masks is not None else []
+        ious = compare_masks(reference_polygons, candidate_polygons, image.shape)
+        same_count = len(reference_polygons) == len(candidate_polygons)
+        ok = same_count and all(iou >= min_iou for iou in ious)
+        passed = passed and ok
+
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: documents {len(reference_polygons)} vs {len(candidate_polygons)}, "
+              f"mask IoU {', '.join(f'{iou:.3f}' for iou in ious) or '-'}")
+
+    print("Total inference time: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+    print("Parity check passed." if passed else "Parity check FAILED.")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the segmentation model and check backend parity.")
+    parser.add_argument('command', choices=['export', 'parity'])
+    parser.add_argument('--weights', default=DEFAULT_WEIGHTS)
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx')
+    parser.add_argument('--int8', action='store_true', help="INT8 OpenVINO model calibrated on training/dataset/valid")
+    parser.add_argument('--images', default=DEFAULT_TEST_IMAGES)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_model(args.weights, args.backend, args.int8)
+    else:
+        sys.exit(0 if check_parity(args.weights, args.backend, args.int8, args.images) else 1)
@@ -0,0 +1,181 @@
+# batching.py
+"""
+Cross-request dynamic micro-batching for the YOLO model.
+
+A single scheduler thread owns the model. Any request thread can hand it crops;
+the scheduler groups whatever is waiting into one batch, up to a maximum batch
+size or until the oldest crop has waited long enough, runs one forward pass and
+resolves each caller's future. Concurrent requests therefore share forward
+passes instead of queueing on the torch thread pool one image at a time.
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import YOLO_FORWARD_PASSES, YOLO_IMAGES
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 10
+
+# Queued by close() to stop the scheduler thread.
+_STOP = object()
+
+
+class _Item:
+    __slots__ = ('image', 'conf', 'future', 'enqueued_at')
+
+    def __init__(self, image, conf):
+        self.image = image
+        self.conf = conf
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    Owns a model and batches submissions from any thread.
+
+    Calling the scheduler like a model (`scheduler(images, conf=...)`) submits
+    every image and waits for all results, so it can be passed anywhere the
+    refinement engine expects a YOLO model.
+    """
+
+    def __init__(self, model_getter, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        """
+        Args:
+            model_getter (callable): Returns the loaded model (or None if it failed
+                to load). Called from the scheduler thread.
+        """
+        self.model_getter = model_getter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        # Items taken off the queue that could not join the current batch
+        # because they use a different confidence threshold.
+        self._carry = collections.deque()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._images = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._inference_total = 0.0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image, conf=0.5):
+        """
+        Queues one image. Returns a Future resolving to its ultralytics Results.
+        """
+        self._ensure_started()
+        item = _Item(image, conf)
+        self._queue.put(item)
+        return item.future
+
+    def __call__(self, images, conf=0.5, verbose=False):
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        futures = [self.submit(image, conf) for image in images]
+        return [future.result() for future in futures]
+
+    def _next_item(self, timeout=None):
+        if self._carry:
+            return self._carry.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self._next_item()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        skipped = []
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 and self._queue.empty() and not self._carry:
+                break
+            try:
+                item = self._next_item(timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch first; the thread stops on the next one.
+                skipped.append(item)
+                break
+            if item.conf == first.conf:
+                batch.append(item)
+            else:
+                skipped.append(item)
+        self._carry.extend(skipped)
+        return batch
+
+    def close(self):
+        """
+        Stops the scheduler thread once the crops already queued are done.
+        Submitting again starts a new one.
+        """
+        with self._start_lock:
+            if self._thread is not None:
+                self._queue.put(_STOP)
+                self._thread.join()
+                self._thread = None
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                model = self.model_getter()
+                if model is None:
+                    raise RuntimeError("Model is not loaded")
+                results = model([item.image for item in batch], conf=batch[0].conf, verbose=False)
+                YOLO_FORWARD_PASSES.inc()
+                YOLO_IMAGES.inc(len(batch))
+                for item, result in zip(batch, results):
+                    item.future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+            finished = time.perf_counter()
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._images += len(batch)
+                self._inference_total += finished - started
+                for item in batch:
+                    wait = started - item.enqueued_at
+                    self._wait_total += wait
+                    self._wait_max = max(self._wait_max, wait)
+
+    def stats(self):
+        """
+        Returns queue depth, a batch-size histogram and wait/inference times.
+        """
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize() + len(self._carry),
+                "batches": batches,
+                "images": self._images,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "avg_batch_size": round(self._images / batches, 2) if batches else 0,
+                "avg_wait_ms": round(1000 * self._wait_total / self._images, 2) if self._images else 0,
+                "max_wait_ms": round(1000 * self._wait_max, 2),
+                "avg_inference_ms": round(1000 * self._inference_total / batches, 2) if batches else 0,
+            }
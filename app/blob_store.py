@@ -0,0 +1,104 @@
+# blob_store.py
+"""
+Content-addressed local store for encoded document crops.
+
+Every blob is saved once under the SHA-256 of its bytes, so the same crop
+uploaded twice (or referenced by both a document and a debug step) takes no
+extra space. The key doubles as a strong ETag when the blob is served.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+# Oldest blobs are deleted once the store grows past this size.
+MAX_STORE_BYTES = 2 * 1024 ** 3
+
+# How many writes happen between two size checks.
+PRUNE_EVERY = 100
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    def __init__(self, root, max_bytes=MAX_STORE_BYTES, prune_every=PRUNE_EVERY):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small.
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data):
+        """
+        Stores a blob and returns its key. Existing blobs are not rewritten.
+        """
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if os.path.exists(path):
+            # Touch so pruning treats it as recently used.
+            os.utime(path)
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % self.prune_every == 0
+        if should_prune:
+            self.prune()
+        return key
+
+    def path(self, key):
+        """
+        Returns the file path of a stored blob, or None for unknown/invalid keys.
+        """
+        if not _KEY_PATTERN.match(key):
+            return None
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def prune(self):
+        """
+        Deletes the least recently used blobs until the store fits max_bytes.
+        """
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not _KEY_PATTERN.match(name):
+                    continue
+                full_path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, full_path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, full_path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(full_path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        logger.info(f"Blob store pruned to {total} bytes.")
@@ -0,0 +1,193 @@
+# document_pipeline.py
+"""
+The document pipeline shared by the API and the batch extractor:
+
+    decode -> detect (initial scan + refinement) -> crop -> [ocr] -> [sink]
+
+decode(), detect() and crop() are the steps for one image (/segment runs them
+in the request thread). DocumentPipeline runs them as stages of pipeline.py,
+each on its own threads with bounded queues in between, so decoding and
+cropping of some images overlap with inference on others, and yields results
+lazily as each input leaves the last stage.
+"""
+import os
+
+from batching import BatchScheduler
+from pipeline import Stage, run_pipeline
+from refinement import (CONFIDENCE_THRESHOLD, CROP_BUFFER, RefinementStats, collect_leaves,
+                        decode_for_detection, scan_images)
+
+# --- DEFAULT CONFIGURATION ---
+# Threads per stage. Detect threads mostly wait on the batching scheduler, so
+# there are as many as images that can share a forward pass. OpenCV and the
+# models release the GIL, which is why threads are enough for every stage.
+WORKERS = {"decode": 4, "detect": 8, "crop": 2, "ocr": 1, "sink": 2}
+QUEUE_SIZE = 8
+
+
+class UndecodableImage(ValueError):
+    """Raised when the input data is not an image that OpenCV can decode."""
+
+
+# --- SINGLE IMAGE STEPS ---
+
+def decode(data, max_side=0):
+    """
+    Decodes an image for detection (see refinement.decode_for_detection).
+
+    Args:
+        data (bytes or str): The encoded image, or the path of an image file.
+
+    Returns:
+        tuple: (detection image, SourceImage, factor)
+
+    Raises:
+        UndecodableImage: If the data is not an image.
+    """
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, 'rb') as f:
+            data = f.read()
+    detection_image, source, factor = decode_for_detection(data, max_side)
+    if detection_image is None:
+        raise UndecodableImage("Could not decode image")
+    return detection_image, source, factor
+
+
+def detect(detection_image, factor, model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER, policy=None):
+    """
+    Performs the initial scan and refines every detection.
+
+    Args:
+        factor (float): How many times smaller the detection image is than the
+            original; crop_buffer (in original pixels) is scaled down by it.
+
+    Returns:
+        tuple: (roots, RefinementStats). roots is None if the initial scan
+               found nothing, else the refinement trees, one per detection.
+    """
+    if factor > 1:
+        crop_buffer = max(1, round(crop_buffer / factor))
+    refinement_stats = RefinementStats()
+    roots = scan_images([detection_image], model, conf=conf, crop_buffer=crop_buffer,
+                        policy=policy, stats=refinement_stats)[0]
+    return roots, refinement_stats
+
+
+def crop(roots, source, detection_shape):
+    """
+    Cuts every final document out of the full-resolution image (which is only
+    decoded now). Each leaf's `image` is replaced by its full-resolution crop.
+
+    Returns:
+        list: The final document images, depth-first.
+    """
+    leaves = collect_leaves(roots) if roots else []
+    for leaf in leaves:
+        leaf.image = source.crop(leaf.box, detection_shape)
+    return [leaf.image for leaf in leaves]
+
+
+# --- STAGED PIPELINE ---
+
+class DocumentPipeline:
+    """
+    Runs many images through decode, detect, crop and optional OCR and sink
+    stages concurrently.
+
+    Each input becomes an item dict that gains fields stage by stage:
+
+        key          the input's key
+        roots        refinement trees (None if nothing was detected)
+        refinement   forward pass counts (RefinementStats.to_dict())
+        documents    final document images, full resolution
+        ocr          one OCR result per document (with an ocr callable)
+        output       what the sink returned (with a sink callable)
+        reused       True if the reuse callable supplied the output
+    """
+
+    def __init__(self, model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER, policy=None, max_side=0,
+                 ocr=None, sink=None, reuse=None, workers=None, queue_size=QUEUE_SIZE):
+        """
+        Args:
+            model: A YOLO model, or a BatchScheduler. A plain model is wrapped
+                in a scheduler of its own, so concurrent detect threads share
+                forward passes and never call it at the same time.
+            max_side (int): Downscaled detection target (0 = full resolution).
+            ocr (callable, optional): Takes a list of document images and
+                returns one OCR result per image.
+            sink (callable, optional): Called with each finished item on the
+                sink threads, e.g. to encode or save its documents.
+            reuse (callable, optional): Called with each item once it is
+                decoded. If it returns an output (e.g. the cached result of a
+                near-duplicate image), the item skips the remaining stages.
+            workers (dict, optional): Threads per stage, overriding WORKERS.
+        """
+        self.workers = {**WORKERS, **(workers or {})}
+        self._own_scheduler = not isinstance(model, BatchScheduler)
+        self.model = (BatchScheduler(lambda: model, max_batch_size=self.workers["detect"])
+                      if self._own_scheduler else model)
+        self.conf = conf
+        self.crop_buffer = crop_buffer
+        self.policy = policy
+        self.max_side = max_side
+        self.ocr = ocr
+        self.sink = sink
+        self.reuse = reuse
+        self.queue_size = queue_size
+
+    def _decode(self, item):
+        item["detection"], item["source"], item["factor"] = decode(item.pop("input"), self.max_side)
+        output = self.reuse(item) if self.reuse is not None else None
+        if output is not None:
+            del item["detection"], item["source"]
+            item.update(output=output, reused=True)
+        return item
+
+    def _detect(self, item):
+        roots, refinement_stats = detect(item["detection"], item["factor"], self.model, self.conf,
+                                         self.crop_buffer, self.policy)
+        item.update(roots=roots, refinement=refinement_stats.to_dict())
+        return item
+
+    def _crop(self, item):
+        item["documents"] = crop(item["roots"], item.pop("source"), item.pop("detection").shape)
+        return item
+
+    def _ocr(self, item):
+        item["ocr"] = self.ocr(item["documents"]) if item["documents"] else []
+        return item
+
+    def _sink(self, item):
+        item["output"] = self.sink(item)
+        return item
+
+    @staticmethod
+    def _reused(item):
+        return item.get("reused", False)
+
+    def stages(self):
+        stages = [Stage("decode", self._decode, self.workers["decode"]),
+                  Stage("detect", self._detect, self.workers["detect"], skip=self._reused),
+                  Stage("crop", self._crop, self.workers["crop"], skip=self._reused)]
+        if self.ocr is not None:
+            stages.append(Stage("ocr_documents", self._ocr, self.workers["ocr"], skip=self._reused))
+        if self.sink is not None:
+            stages.append(Stage("sink", self._sink, self.workers["sink"], skip=self._reused))
+        return stages
+
+    def run(self, inputs):
+        """
+        Args:
+            inputs (iterable): (key, image bytes or file path) pairs, read lazily.
+
+        Yields:
+            tuple: (key, item, error) per input, in completion order. error is
+                   the exception that stopped the item (e.g. UndecodableImage for
+                   data that isn't an image), or None.
+        """
+        items = ((key, {"key": key, "input": data}) for key, data in inputs)
+        try:
+            yield from run_pipeline(items, self.stages(), queue_size=self.queue_size)
+        finally:
+            if self._own_scheduler:
+                self.model.close()
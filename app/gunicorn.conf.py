@@ -0,0 +1,44 @@
+# gunicorn.conf.py
+"""
+Production server settings. Run from the app/ folder:
+
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Every worker process imports the app and loads its own copy of the models once
+through create_app(); MODEL_PRELOAD controls whether that happens at worker start
+('background'/'blocking') or on first request ('lazy'). Values can be overridden
+with environment variables.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# Each worker holds a YOLO model (and a PaddleOCR instance) in memory.
+workers = int(os.environ.get("WEB_WORKERS", 2))
+
+# /segment/jobs finds a job on any worker through the shared JOB_STORE_PATH file;
+# with the store disabled, a poll can reach a worker that doesn't know the job.
+if workers > 1 and os.environ.get("JOB_STORE_PATH") == "":
+    raise RuntimeError("JOB_STORE_PATH is empty, so jobs stay in one process: set WEB_WORKERS=1 "
+                       "or give the workers a shared JOB_STORE_PATH")
+
+# Threads per worker handle uploads/downloads; inference itself is serialized per worker.
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+
+# OCR requests on large photos can take a while.
+timeout = int(os.environ.get("WEB_TIMEOUT", 120))
+
+# Models are loaded after the fork, in every worker, which keeps torch and the
+# OCR process pool fork-safe.
+preload_app = False
+
+
+def post_fork(server, worker):
+    # Split the cores between the workers before torch is imported in this process.
+    per_worker = max(1, multiprocessing.cpu_count() // workers)
+    threads_per_worker = os.environ.get("TORCH_THREADS") or str(per_worker)
+    os.environ["TORCH_THREADS"] = threads_per_worker
+    os.environ.setdefault("OMP_NUM_THREADS", threads_per_worker)
+    server.log.info(f"Worker {worker.pid}: torch limited to {threads_per_worker} threads")
@@ -0,0 +1,236 @@
+# jobs.py
+"""
+Job queue for long-running segmentation/OCR requests.
+
+A submitted job goes into a bounded queue and is picked up by a small pool of
+background worker threads. Clients poll for the result by job id. When the
+queue is full, submission fails fast so the API can answer with 429 instead of
+tying up a request worker. No external broker is needed.
+
+Jobs run in the process that accepted them, but their state and results can be
+kept in a SQLite file shared by all server processes, so a poll that lands on
+another worker still finds the job. Each process keeps a heartbeat on the jobs
+it holds; queued or running jobs whose process died stop getting one and are
+marked as failed.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+NUM_WORKERS = 2
+MAX_PENDING_JOBS = 32
+
+# Finished jobs are kept around this long (seconds) so clients can fetch them.
+RESULT_TTL = 600
+
+# With a shared store: how often a process refreshes its unfinished jobs, and
+# how long a job may go without that before its process is taken for dead.
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue:
+    """
+    Runs `handler(*args, **kwargs)` for every submitted job on a bounded worker pool.
+
+    The handler must return a `(result_dict, http_status)` tuple, the same
+    shape the synchronous endpoint returns.
+    """
+
+    def __init__(self, handler, num_workers=NUM_WORKERS, max_pending=MAX_PENDING_JOBS,
+                 result_ttl=RESULT_TTL, store_path=None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 stale_after=STALE_AFTER):
+        """
+        Args:
+            store_path (str, optional): SQLite file holding job state and
+                results, shared by every process that opens it. None keeps
+                jobs in this process only (a single server worker).
+            heartbeat_interval (float): Seconds between heartbeats on this
+                process's unfinished jobs in the store.
+            stale_after (float): Unfinished jobs in the store without a
+                heartbeat for this long are marked as failed.
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        # Ids of the queued and running jobs of this process.
+        self._live = set()
+        self._lock = threading.Lock()
+        self._workers = []
+
+        self._db = None
+        if store_path:
+            os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+            # Other processes write to the same file; wait for their locks instead of failing.
+            self._db = sqlite3.connect(store_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT NOT NULL, finished_at REAL, "
+                "owner_pid INTEGER, heartbeat REAL)"
+            )
+            # Stores created before heartbeats; their unfinished jobs count as stale.
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner_pid", "INTEGER"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+            self._db.commit()
+
+    def _ensure_workers(self):
+        # Workers are started on first use so importing the app stays cheap.
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            if self._db is not None:
+                threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, *args, **kwargs):
+        """
+        Queues a job and returns its id immediately.
+
+        Raises:
+            QueueFullError: If `max_pending` jobs are already waiting.
+        """
+        self._ensure_workers()
+        self._prune()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "http_status": None,
+        }
+        with self._lock:
+            self._save(job)
+            self._live.add(job_id)
+        try:
+            self._queue.put_nowait((job, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._live.discard(job_id)
+                self._delete(job_id)
+            raise QueueFullError(f"Job queue is full ({self._queue.maxsize} pending jobs)")
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns a snapshot of the job, or None if the id is unknown or expired.
+        """
+        self._prune()
+        with self._lock:
+            return self._load(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    # The store (callers hold self._lock): the SQLite file if there is one, else self._jobs.
+
+    def _save(self, job):
+        if self._db is None:
+            self._jobs[job["job_id"]] = dict(job)
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, job, finished_at, owner_pid, heartbeat) VALUES (?, ?, ?, ?, ?)",
+            (job["job_id"], json.dumps(job), job["finished_at"], os.getpid(), time.time())
+        )
+        self._db.commit()
+
+    def _load(self, job_id):
+        if self._db is None:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+        row = self._db.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _delete(self, job_id):
+        if self._db is None:
+            self._jobs.pop(job_id, None)
+            return
+        self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        self._db.commit()
+
+    def _prune(self):
+        now = time.time()
+        cutoff = now - self.result_ttl
+        with self._lock:
+            if self._db is not None:
+                self._fail_stale(now)
+                self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+                self._db.commit()
+                return
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _fail_stale(self, now):
+        # Callers hold self._lock.
+        rows = self._db.execute(
+            "SELECT job, owner_pid FROM jobs WHERE finished_at IS NULL AND COALESCE(heartbeat, 0) < ?",
+            (now - self.stale_after,)
+        ).fetchall()
+        for row, owner_pid in rows:
+            job = json.loads(row)
+            logger.warning(f"Job {job['job_id']} was {job['status']} in process {owner_pid}, which stopped")
+            result = {"status": "error", "message": "The server process running this job stopped"}
+            job.update(status="failed", result=result, http_status=500, finished_at=now)
+            self._save(job)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                if self._live:
+                    job_ids = list(self._live)
+                    self._db.execute(f"UPDATE jobs SET heartbeat = ? WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+                                     (time.time(), *job_ids))
+                    self._db.commit()
+
+    def _work(self):
+        while True:
+            job, args, kwargs = self._queue.get()
+            job_id = job["job_id"]
+            with self._lock:
+                job.update(status="running", started_at=time.time())
+                self._save(job)
+            try:
+                result, http_status = self.handler(*args, **kwargs)
+                status = "done" if http_status < 400 else "failed"
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                result, http_status, status = {"status": "error", "message": str(e)}, 500, "failed"
+            job.update(status=status, result=result, http_status=http_status, finished_at=time.time())
+            with self._lock:
+                try:
+                    self._save(job)
+                except (TypeError, ValueError) as e:
+                    # A result that can't be stored must not leave the job "running" forever.
+                    logger.exception(f"Job {job_id}: could not store the result")
+                    job.update(status="failed", result={"status": "error", "message": str(e)}, http_status=500)
+                    self._save(job)
+                self._live.discard(job_id)
+            self._queue.task_done()
@@ -0,0 +1,177 @@
+# matcher.py
+"""
+Indexed fuzzy matching of receipt lines against large product catalogs.
+
+The catalog is normalized once and indexed by character trigrams. For each
+query only the catalog entries sharing the most trigrams with it are kept as
+candidates and scored with WRatio. Small catalogs skip the shortlist: all lines
+of a receipt are scored against the whole catalog in one batched
+`process.cdist` call.
+
+Indexes are never modified in place. Adding or removing entries returns a new
+index that shares the untouched postings with the old one, so lookups already
+running against the old index are unaffected.
+"""
+import collections
+import copy
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# --- DEFAULT CONFIGURATION ---
+NGRAM = 3
+
+# Number of catalog entries kept per query after trigram blocking.
+MAX_CANDIDATES = 256
+
+# Trigrams found in more than this fraction of the catalog carry little signal
+# and are ignored when shortlisting (unless the query has nothing else).
+MAX_GRAM_FRACTION = 0.1
+
+# Removed entries are only masked out; once more than this fraction of the
+# index is dead, the next removal rebuilds it from scratch.
+COMPACT_FRACTION = 0.25
+
+
+def ngrams(text, n=NGRAM):
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+class FuzzyIndex:
+    def __init__(self, choices, normalize=None, ngram=NGRAM, max_candidates=MAX_CANDIDATES):
+        """
+        Args:
+            choices (list): Original catalog strings; matches return these.
+            normalize (callable, optional): Applied to every choice once, and
+                expected to match how queries were normalized.
+        """
+        self.source = choices
+        self.choices = list(choices)
+        self.normalize = normalize
+        self.normalized = [normalize(c) if normalize else c for c in self.choices]
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+        # False for entries removed since the index was built.
+        self._alive = np.ones(len(self.choices), dtype=bool)
+        self._dead = 0
+
+        self._postings = {}
+        if len(self.choices) > max_candidates:
+            self._postings = self._build_postings(self.normalized)
+
+    def _build_postings(self, normalized, start=0):
+        postings = collections.defaultdict(list)
+        for i, text in enumerate(normalized, start):
+            for gram in ngrams(text, self.ngram):
+                postings[gram].append(i)
+        return {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.choices) - self._dead
+
+    def _rebuilt(self, source):
+        return FuzzyIndex(source, normalize=self.normalize, ngram=self.ngram, max_candidates=self.max_candidates)
+
+    def with_added(self, new_choices):
+        """
+        Returns a new index that also contains new_choices.
+
+        Only the postings of the new entries' n-grams are copied; small catalogs
+        (scored without postings) are simply rebuilt.
+        """
+        new_choices = list(new_choices)
+        source = list(self.source) + new_choices
+        if not self._postings:
+            return self._rebuilt(source)
+
+        index = copy.copy(self)
+        index.source = source
+        index.choices = self.choices + new_choices
+        new_normalized = [self.normalize(c) if self.normalize else c for c in new_choices]
+        index.normalized = self.normalized + new_normalized
+        index._alive = np.concatenate([self._alive, np.ones(len(new_choices), dtype=bool)])
+        index._postings = dict(self._postings)
+        for gram, ids in self._build_postings(new_normalized, start=len(self.choices)).items():
+            old = self._postings.get(gram)
+            index._postings[gram] = ids if old is None else np.concatenate([old, ids])
+        return index
+
+    def without(self, removed):
+        """
+        Returns a new index without the given choices.
+
+        Removed entries are masked out of the postings rather than deleted;
+        the index is rebuilt once too much of it is dead.
+        """
+        removed = set(removed)
+        source = [c for c in self.source if c not in removed]
+        if len(source) == len(self.source):
+            return self
+        mask = np.fromiter((c not in removed for c in self.choices), dtype=bool, count=len(self.choices))
+        alive = self._alive & mask
+        dead = len(self.choices) - int(alive.sum())
+        if not self._postings or dead > COMPACT_FRACTION * len(self.choices):
+            return self._rebuilt(source)
+
+        index = copy.copy(self)
+        index.source = source
+        index._alive = alive
+        index._dead = dead
+        return index
+
+    def candidates(self, query):
+        """
+        Returns the ids of the catalog entries sharing the most n-grams with query.
+        """
+        if not self._postings:
+            return np.arange(len(self.choices), dtype=np.int32)
+        lists = [self._postings[g] for g in ngrams(query, self.ngram) if g in self._postings]
+        if not lists:
+            return np.empty(0, dtype=np.int32)
+        common = max(self.max_candidates, MAX_GRAM_FRACTION * len(self.choices))
+        rare = [ids for ids in lists if len(ids) <= common]
+        lists = rare or lists
+        ids, counts = np.unique(np.concatenate(lists), return_counts=True)
+        if self._dead:
+            alive = self._alive[ids]
+            ids, counts = ids[alive], counts[alive]
+        if len(ids) > self.max_candidates:
+            top = np.argpartition(counts, -self.max_candidates)[-self.max_candidates:]
+            ids = ids[top]
+        return ids
+
+    def match_many(self, queries, score_cutoff=0, scorer=fuzz.WRatio):
+        """
+        Finds the best catalog entry for every query.
+
+        Returns:
+            list: For each query, None or a (choice, score, index) tuple like
+                  process.extractOne returns.
+        """
+        if not queries or not len(self):
+            return [None] * len(queries)
+
+        if not self._postings:
+            # Small catalog: score every line against everything in one batch.
+            scores = process.cdist(queries, self.normalized, scorer=scorer, score_cutoff=score_cutoff,
+                                   dtype=np.float64, workers=-1)
+            matches = []
+            for row in scores:
+                best = int(np.argmax(row))
+                matches.append(self._match(best, float(row[best]), score_cutoff))
+            return matches
+
+        matches = []
+        for query in queries:
+            # Candidates are scored in catalog order so ties resolve like a full scan.
+            ids = np.sort(self.candidates(query))
+            res = process.extractOne(query, [self.normalized[i] for i in ids], scorer=scorer,
+                                     score_cutoff=score_cutoff) if len(ids) else None
+            matches.append(self._match(int(ids[res[2]]), res[1], score_cutoff) if res else None)
+        return matches
+
+    def _match(self, index, score, score_cutoff):
+        if score <= 0 or score < score_cutoff:
+            return None
+        return (self.choices[index], score, index)
@@ -0,0 +1,118 @@
+# model_registry.py
+"""
+Thread-safe registry for the heavy models used by the API.
+
+Models are registered with a loader and an optional warm-up function. They can
+be loaded eagerly at startup, in a background thread, or on first use; either
+way each model is built exactly once, even when several requests ask for it at
+the same time. Load and warm-up timings are kept for the health endpoints.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class _Entry:
+    def __init__(self, loader, warmup):
+        self.loader = loader
+        self.warmup = warmup
+        self.lock = threading.Lock()
+        self.state = PENDING
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._entries = {}
+        self._started_at = time.time()
+
+    def register(self, name, loader, warmup=None):
+        """
+        Args:
+            name (str): Key used with get().
+            loader (callable): Builds and returns the model.
+            warmup (callable, optional): Called with the loaded model to run a
+                first inference, so the first real request doesn't pay for it.
+        """
+        self._entries[name] = _Entry(loader, warmup)
+
+    def get(self, name):
+        """
+        Returns the model, loading it first if needed. Blocks while another
+        thread is loading it. Returns None if loading failed.
+        """
+        entry = self._entries[name]
+        if entry.state == READY:
+            return entry.value
+        self._load(name, entry)
+        return entry.value
+
+    def _load(self, name, entry):
+        with entry.lock:
+            if entry.state in (READY, FAILED):
+                return
+
+            entry.state = LOADING
+            logger.info(f"Loading model '{name}'...")
+            try:
+                start = time.perf_counter()
+                value = entry.loader()
+                entry.load_seconds = round(time.perf_counter() - start, 3)
+
+                if entry.warmup is not None:
+                    start = time.perf_counter()
+                    entry.warmup(value)
+                    entry.warmup_seconds = round(time.perf_counter() - start, 3)
+
+                entry.value = value
+                entry.state = READY
+                logger.info(f"Model '{name}' ready (load {entry.load_seconds}s, warm-up {entry.warmup_seconds}s).")
+            except Exception as e:
+                entry.error = str(e)
+                entry.state = FAILED
+                logger.error(f"Failed to load model '{name}': {e}")
+
+    def load_all(self, background=False):
+        """
+        Loads every registered model, one after another.
+
+        Args:
+            background (bool): Load in a daemon thread and return immediately.
+        """
+        def run():
+            for name, entry in self._entries.items():
+                self._load(name, entry)
+
+        if background:
+            threading.Thread(target=run, name="model-loader", daemon=True).start()
+        else:
+            run()
+
+    @property
+    def ready(self):
+        return all(entry.state == READY for entry in self._entries.values())
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.time() - self._started_at, 1),
+            "models": {name: entry.to_dict() for name, entry in self._entries.items()},
+        }
@@ -0,0 +1,216 @@
+# near_duplicates.py
+"""
+Near-duplicate image lookup with perceptual hashes.
+
+A receipt photographed twice a few seconds apart gives different bytes (so the
+result cache misses) but almost the same picture. Every image is reduced to two
+64-bit perceptual hashes: pHash (low DCT frequencies of a 32x32 grayscale copy)
+and dHash (brightness gradients of a 9x8 copy). Two images are near duplicates
+when both hashes differ in at most `radius` bits.
+
+Hashes are indexed in a BK-tree, so a lookup only visits the part of the index
+within the radius instead of comparing against every entry. The index is
+bounded by entry count (least recently used go first) and entry age.
+"""
+import collections
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+RADIUS = 8
+MAX_ENTRIES = 1024
+TTL_SECONDS = 600
+
+
+# --- PERCEPTUAL HASHES ---
+
+def _gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def _bits(flags):
+    return int.from_bytes(np.packbits(flags.ravel()).tobytes(), 'big')
+
+
+def phash(image):
+    """
+    64-bit pHash: the 8x8 lowest DCT frequencies of a 32x32 grayscale copy,
+    each compared to their median.
+    """
+    small = cv2.resize(_gray(image), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return _bits(low > np.median(low))
+
+
+def dhash(image):
+    """
+    64-bit dHash: whether each pixel of a 9x8 grayscale copy is brighter than
+    its right neighbour.
+    """
+    small = cv2.resize(_gray(image), (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits(small[:, 1:] > small[:, :-1])
+
+
+def image_hash(image):
+    """
+    Returns:
+        tuple: (pHash, dHash) of the image.
+    """
+    return phash(image), dhash(image)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# --- BK-TREE ---
+
+class BKTree:
+    """
+    Metric tree over integers under Hamming distance. Every child of a node
+    sits at a distinct distance from it, so a search for radius r only
+    descends into children at distance d - r .. d + r (triangle inequality).
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, radius):
+        """
+        Returns:
+            list: (distance, item) for every value within radius.
+        """
+        found = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node_value, item, children = pending.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    pending.append(child)
+        return found
+
+
+# --- INDEX ---
+
+class NearDuplicateIndex:
+    """
+    Maps images to values (e.g. results) and finds them again from a near
+    duplicate image. Thread-safe.
+
+    Entries carry a tag (e.g. the settings their result was computed with); a
+    lookup only matches entries with the same tag.
+    """
+
+    def __init__(self, radius=RADIUS, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        """
+        Args:
+            radius (int): Bits (of 64) in which both hashes may differ.
+            max_entries (int): Entries kept; the least recently used go first.
+            ttl_seconds (float): Entries older than this are not returned.
+        """
+        self.radius = radius
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        # id -> (hashes, tag, value, stored at), least recently used first
+        self._entries = collections.OrderedDict()
+        self._tree = BKTree()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def get(self, hashes, tag=None):
+        """
+        Finds the closest live entry within the radius.
+
+        Args:
+            hashes (tuple): image_hash() of the image to look up.
+
+        Returns:
+            tuple: (value, distance), or None on a miss.
+        """
+        p, d = hashes
+        now = time.monotonic()
+        with self._lock:
+            best = None
+            for distance, entry_id in self._tree.search(p, self.radius):
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                (_, entry_d), entry_tag, value, stored_at = entry
+                if now - stored_at > self.ttl:
+                    del self._entries[entry_id]
+                    self._counters["expired"] += 1
+                    continue
+                if entry_tag != tag:
+                    continue
+                distance = max(distance, hamming(d, entry_d))
+                if distance <= self.radius and (best is None or distance < best[0]):
+                    best = (distance, entry_id, value)
+            if best is None:
+                self._counters["misses"] += 1
+                return None
+            distance, entry_id, value = best
+            self._entries.move_to_end(entry_id)
+            self._counters["hits"] += 1
+            return value, distance
+
+    def put(self, hashes, value, tag=None):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (hashes, tag, value, time.monotonic())
+            self._tree.add(hashes[0], entry_id)
+            self._counters["stores"] += 1
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            entry_id, (_, _, _, stored_at) = next(iter(self._entries.items()))
+            if now - stored_at > self.ttl:
+                self._counters["expired"] += 1
+            elif len(self._entries) > self.max_entries:
+                self._counters["evictions"] += 1
+            else:
+                break
+            del self._entries[entry_id]
+        # BK-trees can't delete; rebuild once most of the tree is dead entries.
+        if self._tree.size > 2 * len(self._entries) + 64:
+            self._tree = BKTree()
+            for entry_id, (hashes, _, _, _) in self._entries.items():
+                self._tree.add(hashes[0], entry_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **{name: self._counters[name] for name in ("hits", "misses", "stores", "evictions", "expired")},
+                "hit_rate": round(self._counters["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "radius": self.radius,
+            }
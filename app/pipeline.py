@@ -0,0 +1,170 @@
+# pipeline.py
+"""
+A staged, concurrent pipeline.
+
+Each stage runs its function on its own worker threads (or processes) and the
+stages are connected by bounded queues: a slow stage holds back the ones before
+it instead of letting work pile up in memory, and CPU-heavy steps (decode,
+encode) overlap with model inference on other items.
+
+Items travel as (key, value) pairs. If a stage raises on an item, the item is
+marked as failed; later stages pass it through untouched and it comes out of the
+pipeline with its error, so one bad input does not stop the others.
+"""
+import contextvars
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from tracing import stage
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+QUEUE_SIZE = 8
+
+# How often blocked workers check whether the consumer has gone away.
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Args:
+        name (str): Stage name, used for thread names and stage timings.
+        fn (callable): Called with an item's value; returns the new value.
+        workers (int): Threads running fn concurrently.
+        processes (bool): Run fn in a pool of `workers` processes instead, for
+            CPU-bound Python code that holds the GIL. fn must be a module-level
+            function and its input and output picklable.
+        skip (callable, optional): Items whose value it returns True for pass
+            through the stage untouched and untimed, like failed items.
+    """
+
+    def __init__(self, name, fn, workers=1, processes=False, skip=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.skip = skip
+
+
+class _Item:
+    __slots__ = ('key', 'value', 'error')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.error = None
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def run_pipeline(items, stages, queue_size=QUEUE_SIZE):
+    """
+    Feeds items through the stages and yields results as they come out of the
+    last stage, in completion order.
+
+    Worker threads run in a copy of the caller's context, so their logs and
+    stage timings belong to the caller's request. Closing the generator early
+    stops the workers.
+
+    Args:
+        items (iterable): (key, value) pairs. Read lazily, at most queue_size
+            ahead of the first stage.
+        stages (list): Stage objects, in order.
+        queue_size (int): Capacity of each queue between stages.
+
+    Yields:
+        tuple: (key, value, error). error is the exception that failed the
+               item (value is then its last good value), or None.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    feed_errors = []
+
+    def feed():
+        try:
+            for key, value in items:
+                if not _put(queues[0], _Item(key, value), stop):
+                    return
+        except Exception as e:
+            logger.exception("Pipeline input failed")
+            feed_errors.append(e)
+        _put(queues[0], _DONE, stop)
+
+    def work(index, state, pool):
+        spec, inbox, outbox = stages[index], queues[index], queues[index + 1]
+        while True:
+            item = _get(inbox, stop)
+            if item is _DONE:
+                # Let the stage's other workers see the end too; the last one forwards it.
+                _put(inbox, _DONE, stop)
+                with state["lock"]:
+                    state["running"] -= 1
+                    last = state["running"] == 0
+                if last:
+                    _put(outbox, _DONE, stop)
+                return
+            if item.error is None and not (spec.skip and spec.skip(item.value)):
+                try:
+                    with stage(spec.name):
+                        if pool is not None:
+                            item.value = pool.submit(spec.fn, item.value).result()
+                        else:
+                            item.value = spec.fn(item.value)
+                except Exception as e:
+                    logger.warning(f"Stage '{spec.name}' failed on {item.key!r}: {e}")
+                    item.error = e
+            if not _put(outbox, item, stop):
+                return
+
+    context = contextvars.copy_context()
+    threads = [threading.Thread(target=context.copy().run, args=(feed,), name="pipeline-feed", daemon=True)]
+    pools = []
+    for index, spec in enumerate(stages):
+        state = {"lock": threading.Lock(), "running": spec.workers}
+        pool = None
+        if spec.processes:
+            pool = ProcessPoolExecutor(max_workers=spec.workers, mp_context=multiprocessing.get_context('spawn'))
+            pools.append(pool)
+        for n in range(spec.workers):
+            threads.append(threading.Thread(target=context.copy().run, args=(work, index, state, pool),
+                                            name=f"pipeline-{spec.name}-{n}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            yield item.key, item.value, item.error
+        if feed_errors:
+            raise feed_errors[0]
+    finally:
+        stop.set()
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,225 @@
+# product_db.py
+"""
+Versioned, hot-reloadable product database (vendors and items).
+
+Readers take the current DBSnapshot (the catalog lists, their fuzzy match
+indexes and a version number) and use it for a whole request. A watcher thread
+polls the JSON file; when it changes, a new snapshot is built in that thread and
+swapped in with a single assignment, so in-flight requests keep matching
+against the snapshot they started with and never wait for a rebuild.
+
+add() and remove() update the indexes incrementally, bump the version and write
+the file back, so edits survive a restart. Edits hold a lock on the file's
+.lock sibling and first load changes other server processes wrote, so two
+workers editing at once don't lose each other's entries. The version is only
+ever taken from the file (1 if it has none), so every process reports the same
+version for the same content; a hand edit keeps it and only changes the
+content hash.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the server runs as a single process (waitress), the thread lock is enough.
+    fcntl = None
+
+from matcher import FuzzyIndex
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+KINDS = ('vendors', 'items')
+POLL_INTERVAL = 2.0
+
+
+class DBSnapshot:
+    """
+    One immutable version of the database. Never modify it; edits go through
+    ProductDB and produce a new snapshot.
+    """
+
+    def __init__(self, version, content_hash, db, indexes):
+        self.version = version
+        self.content_hash = content_hash
+        self.db = db
+        self.indexes = indexes
+
+    @property
+    def cache_key(self):
+        # The version alone is not enough: an edited file without a "version"
+        # field restarts counting at 1 after a restart.
+        return f"{self.version}:{self.content_hash}"
+
+
+class ProductDB:
+    def __init__(self, path, normalize=None, poll_interval=None):
+        """
+        Args:
+            path (str): JSON file with 'vendors' and 'items' lists.
+            normalize (callable, optional): Text normalization for the indexes.
+            poll_interval (float, optional): Seconds between checks of the file.
+                None or 0 disables watching; reload() can still be called.
+        """
+        self.path = path
+        self.normalize = normalize
+        self.poll_interval = poll_interval
+        # Serializes rebuilds and edits; readers never take it.
+        self._write_lock = threading.Lock()
+        self._file_state = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = DBSnapshot(0, None, {kind: [] for kind in KINDS},
+                                    {kind: FuzzyIndex([], normalize=normalize) for kind in KINDS})
+        self.reload()
+        if poll_interval:
+            self.start_watching()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        # Every write replaces the file, so the inode changes even within one mtime tick.
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def reload(self):
+        """
+        Rebuilds the snapshot if the file content changed.
+
+        A file that fails to load is logged and the previous snapshot stays in
+        use. Returns True if a new snapshot was swapped in.
+        """
+        with self._write_lock:
+            return self._reload()
+
+    def _reload(self):
+        # Callers hold self._write_lock.
+        self._file_state = self._stat()
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            data = json.loads(raw.decode('utf-8'))
+        except Exception as e:
+            logger.error(f"Failed to load product database: {e}")
+            return False
+
+        content_hash = hashlib.sha256(raw).hexdigest()[:16]
+        old = self._snapshot
+        if content_hash == old.content_hash:
+            return False
+
+        db = dict(data)
+        for kind in KINDS:
+            db[kind] = list(data.get(kind, []))
+        indexes = {kind: FuzzyIndex(db[kind], normalize=self.normalize) for kind in KINDS}
+        # Never bumped here: other processes load the same file and must
+        # agree on its version. Only update() writes a new one.
+        version = int(data.get('version', 1))
+        db['version'] = version
+        self._snapshot = DBSnapshot(version, content_hash, db, indexes)
+        logger.info(f"Product database v{version} loaded: "
+                    + ", ".join(f"{len(db[kind])} {kind}" for kind in KINDS))
+        return True
+
+    def add(self, kind, names):
+        return self.update(kind, add=names)
+
+    def remove(self, kind, names):
+        return self.update(kind, remove=names)
+
+    def update(self, kind, add=(), remove=()):
+        """
+        Removes and then adds entries of one kind as a single new version.
+        Entries already present are not added twice.
+
+        Returns:
+            int: The database version after the update.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind '{kind}', expected one of {KINDS}")
+        with self._write_lock, self._file_lock():
+            # Another server process may have edited the file since our last poll.
+            if self._stat() != self._file_state:
+                self._reload()
+            old = self._snapshot
+            index = old.indexes[kind]
+            if remove:
+                index = index.without(remove)
+            present = set(index.source)
+            new = [name for name in dict.fromkeys(add) if name not in present]
+            if new:
+                index = index.with_added(new)
+            if index is old.indexes[kind]:
+                return old.version
+
+            version = old.version + 1
+            db = {**old.db, kind: index.source, 'version': version}
+            raw = self._write(db)
+            self._snapshot = DBSnapshot(version, hashlib.sha256(raw).hexdigest()[:16], db,
+                                        {**old.indexes, kind: index})
+            logger.info(f"Product database v{version}: {len(index.source)} {kind}")
+            return version
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """
+        Holds an exclusive lock shared with every process editing the same file.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, db):
+        raw = json.dumps(db, ensure_ascii=False, indent=2).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        # Our own write must not trigger a full rebuild in the watcher.
+        self._file_state = self._stat()
+        return raw
+
+    # --- FILE WATCHER ---
+
+    def start_watching(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="product-db-watcher", daemon=True)
+            self._thread.start()
+
+    def stop_watching(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            if self._stat() != self._file_state:
+                self.reload()
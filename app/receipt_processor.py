@@ -1,128 +1,733 @@
 import cv2
 import re
-import json
 import logging
 import os
 import base64
+import itertools
+import multiprocessing
+import threading
+import time
 import numpy as np
-from rapidfuzz import process, fuzz
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
+
+import tracing
+from metrics import OCR_CALLS
+from product_db import ProductDB
+from tracing import stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- LINE GROUPING ---
+# Two OCR blocks are on the same line when their vertical spans overlap by at
+# least this fraction of the shorter block's height.
+LINE_MIN_OVERLAP = 0.5
+
+# --- TILED OCR ---
+# Crops taller than TILE_MIN_ASPECT times their width (long receipt rolls) are
+# read in horizontal bands TILE_BAND_ASPECT times the width tall, so PaddleOCR
+# doesn't shrink the text and memory doesn't grow with the receipt's length.
+# Neighbouring bands overlap by TILE_OVERLAP of a band, which must be taller
+# than a line of text. 0 disables tiling.
+TILE_MIN_ASPECT = 3.0
+TILE_BAND_ASPECT = 1.5
+TILE_OVERLAP = 0.2
+
+
+def ocr_bands(height, width, min_aspect=TILE_MIN_ASPECT, band_aspect=TILE_BAND_ASPECT, overlap=TILE_OVERLAP):
+    """
+    Splits a crop into the horizontal bands it is read in.
+
+    Returns:
+        list: (top, bottom, keep_top, keep_bottom) per band. Every text block is
+              kept from exactly one band: the one whose keep range contains its
+              vertical center. Keep ranges meet in the middle of each overlap,
+              so a line that appears in two bands (or is cut off at a band's
+              edge) is only read once, from the band that holds it whole.
+    """
+    if not min_aspect or height <= min_aspect * width:
+        return [(0, height, 0, height)]
+    band = max(1, int(band_aspect * width))
+    step = max(1, band - int(overlap * band))
+    spans = []
+    top = 0
+    while True:
+        # The last band is moved up to full height rather than left as a sliver.
+        top = min(top, max(0, height - band))
+        spans.append((top, min(height, top + band)))
+        if top + band >= height:
+            break
+        top += step
+
+    bands = []
+    for i, (top, bottom) in enumerate(spans):
+        keep_top = 0 if i == 0 else (top + spans[i - 1][1]) / 2
+        keep_bottom = height if i == len(spans) - 1 else (spans[i + 1][0] + bottom) / 2
+        bands.append((top, bottom, keep_top, keep_bottom))
+    return bands
+
+
+# --- BATCHED RECOGNITION ---
+# With batch_lines, PaddleOCR only detects text per document (and band); the
+# line crops of every document in the call are then recognized together,
+# sorted by width, so a recognizer batch pads lines of similar length instead
+# of holding a handful of lines from one receipt. A batch holds up to
+# REC_BATCH_SIZE lines whose widths (at recognizer height) differ by at most
+# REC_MAX_PADDING times.
+REC_BATCH_SIZE = 32
+REC_MAX_PADDING = 2.0
+# Lines recognized with less confidence are dropped, as PaddleOCR drops them
+# from its own det+rec results.
+REC_DROP_SCORE = 0.5
+
+
+def crop_text_line(image, box):
+    """
+    Cuts a detected text line out of an image and straightens it the way
+    PaddleOCR does before recognition: the box is warped to a rectangle, and a
+    line much taller than wide is turned on its side.
+    """
+    points = np.asarray(box, dtype=np.float32)
+    width = max(1, int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3]))))
+    height = max(1, int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2]))))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    line = cv2.warpPerspective(image, cv2.getPerspectiveTransform(points, target), (width, height),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if height / width >= 1.5:
+        line = np.rot90(line)
+    return line
+
+
+def rec_batches(ratios, batch_size=REC_BATCH_SIZE, max_padding=REC_MAX_PADDING):
+    """
+    Buckets text lines by width for recognition.
+
+    Args:
+        ratios (list): Width/height ratio of each line crop.
+
+    Returns:
+        list: Lists of line indexes, one per recognizer batch, narrowest first.
+    """
+    batches = []
+    batch = []
+    for index in sorted(range(len(ratios)), key=ratios.__getitem__):
+        if batch and (len(batch) == batch_size or ratios[index] > max_padding * ratios[batch[0]]):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# --- DOCUMENT ORIENTATION ---
+# With orient_documents, the angle classifier runs once per document instead
+# of on every text line: on up to ORIENTATION_SAMPLE_LINES of its widest
+# lines. PaddleOCR's classifier only tells 0 from 180 degrees (lines much
+# taller than wide are already turned by crop_text_line). A document whose
+# votes agree with at least ORIENTATION_MIN_CONFIDENCE (mean classifier score,
+# disagreeing lines counting as 0) is turned once and recognized without the
+# classifier; otherwise its lines fall back to per-line classification.
+ORIENTATION_SAMPLE_LINES = 5
+ORIENTATION_MIN_CONFIDENCE = 0.9
+
+
+def flip_box(box, shape):
+    """
+    Maps a box to the document turned by 180 degrees.
+    """
+    height, width = shape[:2]
+    return [[width - x, height - y] for x, y in box]
+
+
+# --- TEXT HEIGHT SCALING ---
+# With text_height set, each crop is rescaled before OCR so its characters are
+# about that many pixels tall: big photos of receipts get cheaper to read and
+# tiny text gets enough pixels. The character height is estimated from the
+# crop's glyphs (connected components of its ink), on a copy no larger than
+# TEXT_ESTIMATE_MAX_SIDE. Crops within TEXT_SCALE_TOLERANCE of the target are
+# left alone, and the scale is clamped to TEXT_SCALE_RANGE.
+TEXT_HEIGHT = 32
+TEXT_SCALE_TOLERANCE = 1.25
+TEXT_SCALE_RANGE = (0.25, 3.0)
+TEXT_ESTIMATE_MAX_SIDE = 1600
+# The estimate needs this many glyphs; otherwise the crop isn't scaled.
+TEXT_MIN_GLYPHS = 10
+
+
+def estimate_text_height(gray):
+    """
+    Estimates the character height of a document.
+
+    Ink is found with a local (adaptive) threshold, so uneven lighting and
+    skewed lines don't matter, and every connected blob of ink shaped like a
+    glyph votes with its height. Votes are weighted by height: background
+    texture left inside the crop (wood grain, paper creases) breaks into many
+    small blobs that would otherwise outvote the text.
+
+    Returns:
+        float: The estimated height in pixels, or None if fewer than
+               TEXT_MIN_GLYPHS glyphs were found.
+    """
+    factor = max(gray.shape) / TEXT_ESTIMATE_MAX_SIDE
+    if factor > 1:
+        size = (max(1, round(gray.shape[1] / factor)), max(1, round(gray.shape[0] / factor)))
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    factor = max(factor, 1.0)
+
+    block = max(15, 2 * (max(gray.shape) // 40) + 1)
+    ink = cv2.adaptiveThreshold(gray, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, 10)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    glyphs = ((heights >= 4) & (heights <= gray.shape[0] // 4) & (widths <= 3 * heights)
+              & (stats[1:, cv2.CC_STAT_AREA] >= 0.15 * widths * heights))
+    heights = np.sort(heights[glyphs])
+    if len(heights) < TEXT_MIN_GLYPHS:
+        return None
+    # Height-weighted median
+    cumulative = np.cumsum(heights)
+    return round(float(heights[np.searchsorted(cumulative, cumulative[-1] / 2)]) * factor, 1)
+
+
+def scale_for_text(image, target=TEXT_HEIGHT, gray=None):
+    """
+    Rescales a crop so its characters are about `target` pixels tall.
+
+    Returns:
+        tuple: (image, scaling) where scaling holds the estimated
+               `text_height` (None if unknown) and the `scale` applied.
+    """
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    text_height = estimate_text_height(gray)
+    scale = 1.0
+    if text_height:
+        scale = min(max(target / text_height, TEXT_SCALE_RANGE[0]), TEXT_SCALE_RANGE[1])
+        if 1 / TEXT_SCALE_TOLERANCE <= scale <= TEXT_SCALE_TOLERANCE:
+            scale = 1.0
+    if scale != 1.0:
+        size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    return image, {"text_height": text_height, "scale": round(scale, 3)}
+
+
+# --- OCR WORKER POOL ---
+# Each worker process holds its own warm ReceiptProcessor (and PaddleOCR instance).
+# Workers only read text; matching runs in the parent against its product DB,
+# so a reloaded database takes effect without restarting the pool.
+_worker_processor = None
+
+# Stages that each time one PaddleOCR call.
+OCR_STAGES = ("ocr", "ocr_detect", "ocr_orientation", "ocr_recognize")
+
+def _init_worker(lang, ocr_threads, batch_lines, orient_documents, text_height):
+    global _worker_processor
+    tracing.configure_logging()
+    _worker_processor = ReceiptProcessor(db_path=None, lang=lang, ocr_workers=1, ocr_threads=ocr_threads,
+                                         batch_lines=batch_lines, orient_documents=orient_documents,
+                                         text_height=text_height)
+    _worker_processor._init_ocr()
+
+def _warm_up_worker(image):
+    _worker_processor.ocr.ocr(image, cls=True)
+    return os.getpid()
+
+def _process_shared_images(specs, do_ocr, debug_steps, request_id=None):
+    """
+    Runs process_batch in a worker on images passed through shared memory.
+
+    Args:
+        specs (list): (shared memory name, shape, dtype) per image.
+
+    Returns:
+        dict: The unmatched `results`, in order, plus the worker's stage
+              timings as (seconds, count) in `_stages` (and its OCR call count
+              in `_ocr_calls`) for the caller to record. The worker logs under
+              the caller's request id.
+    """
+    segments = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    try:
+        images = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (_, shape, dtype) in zip(segments, specs)]
+        with tracing.trace_request(request_id) as trace:
+            results = _worker_processor.process_batch(images, do_ocr=do_ocr, debug_steps=debug_steps, match=False)
+        del images
+        return {"results": results,
+                "_stages": {name: (seconds, count) for name, (seconds, count) in trace.stages.items()},
+                "_ocr_calls": sum(count for name, (_, count) in trace.stages.items() if name in OCR_STAGES)}
+    finally:
+        for shm in segments:
+            shm.close()
+
 class ReceiptProcessor:
-    def __init__(self, db_path='database/mock_db.json', lang='mk'):
+    def __init__(self, db_path='database/mock_db.json', lang='mk', ocr_workers=1, ocr_threads=None,
+                 db_poll_interval=None, batch_lines=False, orient_documents=False, text_height=0):
         """
         Initializes the ReceiptProcessor (OCR models loaded lazily).
+
+        ocr_workers > 1 lets process_images() spread documents over a process pool.
+        ocr_threads caps the CPU threads each PaddleOCR instance uses.
+        db_poll_interval (seconds) enables hot reloading of the product database.
+        batch_lines recognizes the text lines of all documents in a call together
+        (see BATCHED RECOGNITION).
+        orient_documents classifies each document's orientation once instead of
+        every line's (see DOCUMENT ORIENTATION).
+        text_height > 0 rescales each crop to that text line height before OCR
+        (see TEXT HEIGHT SCALING).
         """
         self.lang = lang
         self.ocr = None
+        self.ocr_workers = ocr_workers
+        self.ocr_threads = ocr_threads
+        self.batch_lines = batch_lines
+        self.orient_documents = orient_documents
+        self.text_height = text_height
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        # PaddleOCR predictors are not safe to call from several threads at once.
+        self._ocr_lock = threading.Lock()
         self.db_path = db_path
-        self.db = {'vendors': [], 'items': []}
-        self._load_db()
-
-    def _load_db(self):
-        try:
+        self.products = None
+        if db_path:
             base_dir = os.path.dirname(os.path.abspath(__file__))
-            full_db_path = os.path.join(base_dir, self.db_path)
-            with open(full_db_path, 'r', encoding='utf-8') as f:
-                self.db = json.load(f)
-            logger.info("Mock database loaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to load mock database: {e}")
+            self.products = ProductDB(os.path.join(base_dir, db_path), normalize=self.clean_text,
+                                      poll_interval=db_poll_interval)
+
+    @property
+    def db(self):
+        return self.products.snapshot.db
+
+    @property
+    def db_version(self):
+        """
+        Version of the product database currently used for matching.
+        """
+        return self.products.version if self.products else None
 
     def _init_ocr(self):
-        if self.ocr is None:
-            from paddleocr import PaddleOCR
-            logger.info(f"Initializing PaddleOCR with lang='{self.lang}'...")
-            self.ocr = PaddleOCR(use_angle_cls=True, lang=self.lang, show_log=False)
+        if self.ocr is not None:
+            return
+        # Concurrent first requests must not build two PaddleOCR instances.
+        with self._init_lock:
+            if self.ocr is None:
+                from paddleocr import PaddleOCR
+                logger.info(f"Initializing PaddleOCR with lang='{self.lang}'...")
+                kwargs = {"cpu_threads": self.ocr_threads} if self.ocr_threads else {}
+                if self.batch_lines or self.orient_documents:
+                    # Otherwise the recognizer splits our batches into its default of 6.
+                    kwargs.update(rec_batch_num=REC_BATCH_SIZE, cls_batch_num=REC_BATCH_SIZE)
+                self.ocr = PaddleOCR(use_angle_cls=True, lang=self.lang, show_log=False, **kwargs)
+
+    def warm_up(self, image):
+        """
+        Loads the OCR models and runs one inference so the first request is fast.
+        With a worker pool, every worker process is started and warmed up.
+        """
+        if self.ocr_workers <= 1:
+            self._init_ocr()
+            with self._ocr_lock:
+                self.ocr.ocr(image, cls=True)
+            return
+        pool = self._get_pool()
+        # Submitting one task per worker while none is idle makes the pool spawn all of them.
+        futures = [pool.submit(_warm_up_worker, image) for _ in range(self.ocr_workers)]
+        pids = {future.result() for future in futures}
+        logger.info(f"OCR pool warmed up ({len(pids)} worker processes).")
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Split the cores between workers so they don't oversubscribe the CPU.
+                threads = self.ocr_threads or max(1, (os.cpu_count() or 1) // self.ocr_workers)
+                logger.info(f"Starting OCR pool with {self.ocr_workers} workers ({threads} threads each)...")
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.ocr_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.lang, threads, self.batch_lines, self.orient_documents, self.text_height)
+                )
+            return self._pool
+
+    def close(self):
+        """
+        Shuts down the OCR worker pool, if one was started.
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def process_images(self, images, do_ocr=True, debug_steps=True):
+        """
+        Processes several receipt images, in parallel when ocr_workers > 1.
+        Results are returned in input order.
+        """
+        results = [None] * len(images)
+        for index, result in self.iter_process_images(images, do_ocr=do_ocr, debug_steps=debug_steps):
+            results[index] = result
+        return results
+
+    def iter_process_images(self, images, do_ocr=True, debug_steps=True):
+        """
+        Like process_images, but yields (index, result) pairs as soon as each
+        document is done, in completion order.
+
+        Images are handed to the workers through shared memory rather than
+        pickled. With batch_lines, each worker gets an even share of the
+        documents and recognizes their lines together.
+        """
+        if not do_ocr or self.ocr_workers <= 1 or len(images) <= 1:
+            if self.batch_lines:
+                yield from enumerate(self.process_batch(images, do_ocr=do_ocr, debug_steps=debug_steps))
+                return
+            for index, image in enumerate(images):
+                yield index, self.process_image(image, do_ocr=do_ocr, debug_steps=debug_steps)
+            return
+
+        if self.batch_lines:
+            groups = [list(range(first, len(images), self.ocr_workers))
+                      for first in range(min(self.ocr_workers, len(images)))]
+        else:
+            groups = [[index] for index in range(len(images))]
+        pool = self._get_pool()
+        segments = []
+        futures = []
+        try:
+            for group in groups:
+                specs = []
+                for index in group:
+                    image = np.ascontiguousarray(images[index])
+                    shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+                    segments.append(shm)
+                    np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+                    specs.append((shm.name, image.shape, image.dtype.str))
+                futures.append(pool.submit(_process_shared_images, specs, do_ocr, debug_steps,
+                                           tracing.current_request_id()))
+            indexes = dict(zip(futures, groups))
+            for future in as_completed(futures):
+                output = future.result()
+                OCR_CALLS.inc(output["_ocr_calls"])
+                for name, (seconds, count) in output["_stages"].items():
+                    tracing.record(name, seconds, count)
+                for index, result in zip(indexes[future], output["results"]):
+                    yield index, self.match_lines(result)
+        finally:
+            # Workers may still be reading if one of them failed early.
+            wait(futures)
+            for shm in segments:
+                shm.close()
+                shm.unlink()
 
-    def process_image(self, image, do_ocr=True):
+    def process_image(self, image, do_ocr=True, debug_steps=True, match=True):
         """
         Processes a receipt image. If do_ocr is False, it skips OCR.
+        If debug_steps is False, no intermediate images are encoded.
+        If match is False, the result keeps its processed_lines for a later
+        match_lines() call instead of being matched against the database.
+        """
+        return self.process_batch([image], do_ocr=do_ocr, debug_steps=debug_steps, match=match)[0]
+
+    def process_batch(self, images, do_ocr=True, debug_steps=True, match=True):
+        """
+        Processes several receipt images in this process (see process_image).
+        With batch_lines, their text lines are recognized together.
         """
         if not do_ocr:
-            return {"status": "skipped", "message": "OCR disabled"}
+            return [{"status": "skipped", "message": "OCR disabled"} for _ in images]
 
         self._init_ocr()
-        processing_steps = []
-        
-        # Step 0: Original
-        processing_steps.append({"name": "Original", "image": self._img_to_base64(image)})
-        
-        # Step 1: Preprocessing
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        processing_steps.append({"name": "Grayscale", "image": self._img_to_base64(gray)})
-        
-        # Step 2: OCR with Bounding Boxes
+        all_steps = []
+        scalings = []
+        scaled_images = []
+        for image in images:
+            processing_steps = []
+            gray = None
+            if debug_steps:
+                with stage("debug_steps"):
+                    # Step 0: Original
+                    processing_steps.append({"name": "Original", "image": self._img_to_base64(image)})
+
+                    # Step 1: Preprocessing
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                    processing_steps.append({"name": "Grayscale", "image": self._img_to_base64(gray)})
+            all_steps.append(processing_steps)
+
+            # Step 1b: Rescale to the target text height
+            scaling = None
+            if self.text_height:
+                with stage("text_scaling"):
+                    image, scaling = scale_for_text(image, self.text_height, gray)
+            scalings.append(scaling)
+            scaled_images.append(image)
+        images = scaled_images
+
+        # Step 2: OCR with Bounding Boxes (band by band on long receipts)
         logger.info("Starting OCR processing...")
-        ocr_result = self.ocr.ocr(image, cls=True)
-        
-        lines_with_boxes = []
-        if ocr_result and ocr_result[0]:
-            for line in ocr_result[0]:
-                box = line[0]  # [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
-                text = line[1][0]
-                confidence = line[1][1]
-                lines_with_boxes.append({"box": box, "text": text, "conf": confidence})
-
-        # Step 3: Vertical Alignment (Group by Y-coordinate proximity)
-        grouped_lines = self._group_lines_by_y(lines_with_boxes)
-        
-        # Step 4: Normalization and Cleaning
-        processed_lines = []
-        for line_text in grouped_lines:
-            cleaned = self.clean_text(line_text)
-            processed_lines.append({
-                "original": line_text,
-                "cleaned": cleaned
-            })
-
-        # Step 5: Fuzzy Matching
-        matches = self.check_database(processed_lines)
-        
-        raw_text_full = "\n".join(grouped_lines)
-        
-        return {
-            "raw_text": raw_text_full,
-            "matches": matches,
-            "processing_steps": processing_steps,
-            "text_segments": self._generate_segments(raw_text_full, matches)
-        }
+        if self.batch_lines:
+            all_blocks, orientations, ocr_seconds = self._read_blocks_batched(images)
+        elif self.orient_documents:
+            # Detection and recognition run separately, one document at a time.
+            all_blocks, orientations, ocr_seconds = [], [], []
+            for image in images:
+                (blocks,), (orientation,), (seconds,) = self._read_blocks_batched([image])
+                all_blocks.append(blocks)
+                orientations.append(orientation)
+                ocr_seconds.append(seconds)
+        else:
+            all_blocks, ocr_seconds = [], []
+            for image in images:
+                started = time.perf_counter()
+                all_blocks.append(self._read_blocks(image))
+                ocr_seconds.append(time.perf_counter() - started)
+            orientations = [None] * len(images)
+
+        results = []
+        for lines_with_boxes, processing_steps, orientation, scaling, seconds in zip(
+                all_blocks, all_steps, orientations, scalings, ocr_seconds):
+            # Step 3: Vertical Alignment (Group by Y-coordinate proximity)
+            with stage("line_grouping"):
+                grouped_lines = self._group_lines_by_y(lines_with_boxes)
+
+            # Step 4: Normalization and Cleaning
+            processed_lines = []
+            with stage("cleaning"):
+                for line_text in grouped_lines:
+                    cleaned = self.clean_text(line_text)
+                    processed_lines.append({
+                        "original": line_text,
+                        "cleaned": cleaned
+                    })
 
-    def _group_lines_by_y(self, boxes, threshold=15):
+            result = {
+                "raw_text": "\n".join(grouped_lines),
+                "processed_lines": processed_lines,
+                "processing_steps": processing_steps
+            }
+            if orientation is not None:
+                result["orientation"] = orientation
+            if scaling is not None:
+                result["scaling"] = {**scaling, "ocr_ms": round(1000 * seconds, 2)}
+            results.append(self.match_lines(result) if match else result)
+        return results
+
+    def _ocr_bands(self, image, detect_only=False):
+        """
+        Runs OCR on the image, or on each of its bands (see ocr_bands).
+
+        Returns:
+            list: (box in image coordinates, OCR entry) per text block kept.
+                  With detect_only, PaddleOCR only detects text and the entry
+                  is the box itself.
+        """
+        bands = ocr_bands(image.shape[0], image.shape[1])
+        kept = []
+        for top, bottom, keep_top, keep_bottom in bands:
+            # A band is a view of the crop; PaddleOCR only ever holds one band.
+            if detect_only:
+                with stage("ocr_detect"), self._ocr_lock:
+                    ocr_result = self.ocr.ocr(image[top:bottom], det=True, rec=False, cls=False)
+            else:
+                with stage("ocr"), self._ocr_lock:
+                    ocr_result = self.ocr.ocr(image[top:bottom], cls=True)
+            OCR_CALLS.inc()
+
+            if not ocr_result or not ocr_result[0]:
+                continue
+            for entry in ocr_result[0]:
+                box = entry if detect_only else entry[0]  # [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
+                if top:
+                    box = [[x, y + top] for x, y in box]
+                ys = [y for _, y in box]
+                if keep_top <= (min(ys) + max(ys)) / 2 < keep_bottom:
+                    kept.append((box, entry))
+        if len(bands) > 1:
+            logger.info(f"Read a {image.shape[1]}x{image.shape[0]} crop in {len(bands)} bands.")
+        return kept
+
+    def _read_blocks(self, image):
+        """
+        Runs OCR on the image (band by band on long receipts) and returns the
+        text blocks in image coordinates.
+        """
+        return [{"box": box, "text": entry[1][0], "conf": entry[1][1]} for box, entry in self._ocr_bands(image)]
+
+    def _read_blocks_batched(self, images):
+        """
+        Detects the text lines of every image, then recognizes the lines of all
+        images together in width-bucketed batches (see rec_batches).
+
+        Returns:
+            tuple: (blocks, orientations, seconds). The text blocks of each
+                   image, in image coordinates (of the turned image, if it was
+                   upside down); each image's orientation (see _orient), or
+                   None per image without orient_documents; and each image's
+                   OCR time, with shared calls split by line.
+        """
+        lines = []
+        seconds = [0.0] * len(images)
+        for index, image in enumerate(images):
+            started = time.perf_counter()
+            for box, _ in self._ocr_bands(image, detect_only=True):
+                lines.append((index, box, crop_text_line(image, box)))
+            seconds[index] += time.perf_counter() - started
+
+        # Per line: whether its recognition still classifies its angle.
+        classify = [True] * len(lines)
+        orientations = [None] * len(images)
+        if self.orient_documents:
+            started = time.perf_counter()
+            orientations = self._orient(lines, len(images))
+            elapsed = time.perf_counter() - started
+            for index, _, _ in lines:
+                seconds[index] += elapsed / len(lines)
+            for i, (index, box, crop) in enumerate(lines):
+                orientation = orientations[index]
+                classify[i] = orientation["per_line_cls"]
+                if orientation["angle"] == 180:
+                    lines[i] = (index, flip_box(box, images[index].shape), np.rot90(crop, 2))
+
+        texts = [None] * len(lines)
+        ratios = [crop.shape[1] / crop.shape[0] for _, _, crop in lines]
+        batch_count = 0
+        for cls in (False, True):
+            group = [i for i in range(len(lines)) if classify[i] == cls]
+            for batch in rec_batches([ratios[i] for i in group]):
+                batch = [group[i] for i in batch]
+                started = time.perf_counter()
+                with stage("ocr_recognize"), self._ocr_lock:
+                    ocr_result = self.ocr.ocr([[lines[i][2] for i in batch]], det=False, cls=cls)
+                elapsed = time.perf_counter() - started
+                for i in batch:
+                    seconds[lines[i][0]] += elapsed / len(batch)
+                OCR_CALLS.inc()
+                batch_count += 1
+                for i, text in zip(batch, ocr_result[0]):
+                    texts[i] = text
+
+        blocks = [[] for _ in images]
+        for (index, box, _), (text, conf) in zip(lines, texts):
+            if conf >= REC_DROP_SCORE:
+                blocks[index].append({"box": box, "text": text, "conf": conf})
+        if lines:
+            logger.info(f"Recognized {len(lines)} lines of {len(images)} document(s) in {batch_count} batches.")
+        return blocks, orientations, seconds
+
+    def _orient(self, lines, document_count):
+        """
+        Classifies the orientation of each document from a few of its lines,
+        all in one classifier call.
+
+        Args:
+            lines (list): (document index, box, line crop) per detected line.
+
+        Returns:
+            list: Per document, a dict with the `angle` to turn it by (0 or
+                  180), the vote `confidence`, whether its lines fall back to
+                  `per_line_cls`, and `cls_ms_saved`: the classifier time saved
+                  against classifying every line (negative for a fallback,
+                  which pays for the samples on top).
+        """
+        by_document = [[] for _ in range(document_count)]
+        for i, (index, _, _) in enumerate(lines):
+            by_document[index].append(i)
+        samples = [sorted(indexes, key=lambda i: -lines[i][2].shape[1])[:ORIENTATION_SAMPLE_LINES]
+                   for indexes in by_document]
+        sampled = [i for indexes in samples for i in indexes]
+
+        labels = {}
+        seconds_per_line = 0.0
+        if sampled:
+            started = time.perf_counter()
+            # The classifier alone: ocr(det=False, rec=False, cls=True) would also
+            # run the recognizer over the samples (PaddleOCR 2.x).
+            with stage("ocr_orientation"), self._ocr_lock:
+                _, cls_result, _ = self.ocr.text_classifier([lines[i][2] for i in sampled])
+            seconds_per_line = (time.perf_counter() - started) / len(sampled)
+            OCR_CALLS.inc()
+            labels = dict(zip(sampled, cls_result))
+
+        orientations = []
+        for indexes, sample in zip(by_document, samples):
+            votes = [labels[i] for i in sample]
+            flipped = sum(label == '180' for label, _ in votes)
+            angle = 180 if 2 * flipped > len(votes) else 0
+            agreeing = sum(score for label, score in votes if (label == '180') == (angle == 180))
+            confidence = agreeing / len(votes) if votes else 0.0
+            confident = confidence >= ORIENTATION_MIN_CONFIDENCE
+            saved_lines = len(indexes) - len(sample) if confident else -len(sample)
+            orientations.append({"angle": angle if confident else 0, "confidence": round(confidence, 3),
+                                 "per_line_cls": not confident,
+                                 "cls_ms_saved": round(1000 * saved_lines * seconds_per_line, 2)})
+        return orientations
+
+    def match_lines(self, result):
+        """
+        Step 5: Fuzzy Matching. Completes a process_image(match=False) result
+        using the current product database snapshot.
+        """
+        if "processed_lines" not in result:
+            return result
+        snapshot = self.products.snapshot
+        with stage("fuzzy_matching"):
+            matches = self.check_database(result.pop("processed_lines"), snapshot=snapshot)
+        result["matches"] = matches
+        result["text_segments"] = self._generate_segments(result["raw_text"], matches)
+        result["db_version"] = snapshot.version
+        return result
+
+    def _group_lines_by_y(self, boxes, min_overlap=LINE_MIN_OVERLAP):
         """
         Groups OCR blocks that are on the same horizontal line.
+
+        Blocks are swept top to bottom by their vertical center. A block joins
+        the current line when its full Y span overlaps the line's running mean
+        span by at least `min_overlap` of the shorter height, so slightly
+        rotated boxes still group and long receipts stay O(n log n).
         """
         if not boxes:
             return []
-            
-        # Sort by top Y coordinate
-        boxes.sort(key=lambda x: x['box'][0][1])
-        
-        grouped_lines = []
-        current_line = [boxes[0]]
-        
-        for i in range(1, len(boxes)):
-            # Calculate average Y of current line
-            avg_y = sum([b['box'][0][1] for b in current_line]) / len(current_line)
-            curr_y = boxes[i]['box'][0][1]
-            
-            if abs(curr_y - avg_y) < threshold:
-                current_line.append(boxes[i])
-            else:
-                # Sort current line by X coordinate
-                current_line.sort(key=lambda x: x['box'][0][0])
-                grouped_lines.append(" ".join([b['text'] for b in current_line]))
-                current_line = [boxes[i]]
-        
-        # Last line
-        current_line.sort(key=lambda x: x['box'][0][0])
-        grouped_lines.append(" ".join([b['text'] for b in current_line]))
-        
-        return grouped_lines
 
-    def clean_text(self, text):
+        # (n, 4, 2) corner coordinates; fromiter avoids building nested arrays
+        corners = itertools.chain.from_iterable(itertools.chain.from_iterable(b['box'] for b in boxes))
+        points = np.fromiter(corners, dtype=np.float32, count=8 * len(boxes)).reshape(-1, 4, 2)
+        tops = points[:, :, 1].min(axis=1)
+        bottoms = points[:, :, 1].max(axis=1)
+        lefts = points[:, :, 0].min(axis=1)
+        order = np.argsort((tops + bottoms) / 2, kind='stable')
+
+        # Line of each block in sweep order
+        sweep_lines = []
+        line_id = -1
+        top_sum = bottom_sum = 0.0
+        count = 0
+        for top, bottom in zip(tops[order].tolist(), bottoms[order].tolist()):
+            if count:
+                # Running centroid of the current line's span
+                line_top, line_bottom = top_sum / count, bottom_sum / count
+                overlap = min(bottom, line_bottom) - max(top, line_top)
+                shorter = min(bottom - top, line_bottom - line_top)
+                if overlap > 0 and overlap >= min_overlap * shorter:
+                    sweep_lines.append(line_id)
+                    top_sum += top
+                    bottom_sum += bottom
+                    count += 1
+                    continue
+            line_id += 1
+            sweep_lines.append(line_id)
+            top_sum, bottom_sum, count = top, bottom, 1
+        line_ids = np.empty(len(boxes), dtype=np.int64)
+        line_ids[order] = sweep_lines
+
+        # Lines top to bottom, blocks left to right within a line
+        ordered = np.lexsort((lefts, line_ids))
+        texts = [boxes[i]['text'] for i in ordered.tolist()]
+        breaks = (np.flatnonzero(np.diff(line_ids[ordered])) + 1).tolist()
+        return [" ".join(texts[a:b]) for a, b in zip([0] + breaks, breaks + [len(texts)])]
+
+    @staticmethod
+    def clean_text(text):
         """
         Step 2: The Cleaner (Normalization)
         """
@@ -136,36 +741,37 @@ class ReceiptProcessor:
         text = re.sub(r'[*#%\-+=:;]', ' ', text)
         return " ".join(text.split())
 
-    def check_database(self, processed_lines, threshold=85):
+    def check_database(self, processed_lines, threshold=85, snapshot=None):
         """
         Step 3: Fuzzy Matching with RapidFuzz
+
+        All lines are scored at once against pre-normalized, trigram-indexed
+        vendor and item lists from one database snapshot (the current one by
+        default), so a reload mid-request cannot mix two versions.
         """
         found_data = {"vendor": None, "items_found": []}
+        snapshot = snapshot or self.products.snapshot
+
+        lines = [line for line in processed_lines if line['cleaned'] and len(line['cleaned']) >= 3]
+        queries = [line['cleaned'] for line in lines]
+        vendor_matches = snapshot.indexes['vendors'].match_many(queries, score_cutoff=threshold)
+        item_matches = snapshot.indexes['items'].match_many(queries, score_cutoff=threshold)
         
-        vendor_choices = self.db.get('vendors', [])
-        item_choices = self.db.get('items', [])
-        
-        for line in processed_lines:
-            cleaned = line['cleaned']
-            if not cleaned or len(cleaned) < 3: continue
-            
+        for line, vendor_res, item_res in zip(lines, vendor_matches, item_matches):
             # Vendor check
-            if not found_data['vendor']:
-                res = process.extractOne(cleaned, vendor_choices, scorer=fuzz.WRatio)
-                if res and res[1] >= threshold:
-                    found_data['vendor'] = {
-                        "name": res[0],
-                        "confidence": res[1],
-                        "original_text": line['original']
-                    }
-                    continue
+            if not found_data['vendor'] and vendor_res:
+                found_data['vendor'] = {
+                    "name": vendor_res[0],
+                    "confidence": vendor_res[1],
+                    "original_text": line['original']
+                }
+                continue
 
             # Item check
-            res = process.extractOne(cleaned, item_choices, scorer=fuzz.WRatio)
-            if res and res[1] >= threshold:
+            if item_res:
                 found_data['items_found'].append({
-                    "name": res[0],
-                    "confidence": res[1],
+                    "name": item_res[0],
+                    "confidence": item_res[1],
                     "original_text": line['original']
                 })
                 
@@ -0,0 +1,389 @@
+# refinement.py
+"""
+Breadth-first document refinement shared by the API and the batch extractor.
+
+Instead of calling the model once per crop recursively, every crop that sits at
+the same recursion depth is sent through YOLO as one letterboxed batch and the
+results are fanned back out to the crops they came from. The outcome is a small
+tree per initial detection whose leaves are the final, verified documents.
+"""
+import logging
+import math
+import threading
+
+import cv2
+import numpy as np
+
+from tracing import stage
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+CONFIDENCE_THRESHOLD = 0.5
+CROP_BUFFER = 10
+
+# Maximum number of crops sent to the model in a single forward pass.
+MAX_BATCH_SIZE = 16
+
+# Safety net against a crop that keeps splitting into itself.
+MAX_DEPTH = 8
+
+# --- EARLY EXIT DEFAULTS ---
+# An initial detection that is confident, convex and isolated is accepted as a
+# single document without a second forward pass.
+EARLY_EXIT_MIN_CONFIDENCE = 0.85
+EARLY_EXIT_MIN_SOLIDITY = 0.9
+EARLY_EXIT_MAX_OVERLAP = 0.05
+
+
+class DocumentNode:
+    """
+    A crop in the refinement tree. A node without children is a final document.
+    """
+
+    def __init__(self, image, depth=0, verified=False, box=None):
+        self.image = image
+        self.depth = depth
+        self.children = []
+        # Set when the crop is accepted without running the model on it again.
+        self.verified = verified
+        # (x1, y1, x2, y2) of the crop in the scanned image, so the document can
+        # be cut again from a higher resolution copy (see SourceImage).
+        self.box = box if box is not None else (0, 0, image.shape[1], image.shape[0])
+
+    @property
+    def is_leaf(self):
+        return not self.children
+
+
+class RefinementStats:
+    """
+    Counts how many crops went through the model and how many were skipped.
+    """
+
+    def __init__(self):
+        self.forward_passes = 0
+        self.skipped_passes = 0
+
+    def to_dict(self):
+        return {"forward_passes": self.forward_passes, "skipped_passes": self.skipped_passes}
+
+
+class EarlyExitPolicy:
+    """
+    Decides from the initial scan whether a detection needs a refinement pass.
+
+    A detection is accepted as-is when its box confidence is high, its mask is
+    close to convex (area / convex hull area) and its crop rectangle barely
+    overlaps any other detection. Anything else is refined as usual.
+    """
+
+    def __init__(self, min_confidence=EARLY_EXIT_MIN_CONFIDENCE,
+                 min_solidity=EARLY_EXIT_MIN_SOLIDITY, max_overlap=EARLY_EXIT_MAX_OVERLAP):
+        self.min_confidence = min_confidence
+        self.min_solidity = min_solidity
+        self.max_overlap = max_overlap
+
+    def needs_refinement(self, index, polygons, confidences, crop_buffer=CROP_BUFFER):
+        """
+        Args:
+            index (int): Index of the detection to decide on.
+            polygons (list): All mask polygons (`masks.xy`) of the initial scan.
+            confidences (list): Box confidence for each polygon.
+
+        Returns:
+            bool: True if the crop should go through the model again.
+        """
+        if confidences[index] < self.min_confidence:
+            return True
+
+        polygon = np.array(polygons[index], dtype=np.float32)
+        if len(polygon) < 3:
+            return True
+        hull_area = cv2.contourArea(cv2.convexHull(polygon))
+        if hull_area <= 0 or cv2.contourArea(polygon) / hull_area < self.min_solidity:
+            return True
+
+        x, y, w, h = cv2.boundingRect(polygon.astype(np.int32))
+        x1, y1 = x - crop_buffer, y - crop_buffer
+        x2, y2 = x + w + crop_buffer, y + h + crop_buffer
+        crop_area = (x2 - x1) * (y2 - y1)
+        for other_index, other in enumerate(polygons):
+            if other_index == index or len(other) == 0:
+                continue
+            ox, oy, ow, oh = cv2.boundingRect(np.array(other, dtype=np.int32))
+            overlap_w = min(x2, ox + ow) - max(x1, ox)
+            overlap_h = min(y2, oy + oh) - max(y1, oy)
+            if overlap_w > 0 and overlap_h > 0 and overlap_w * overlap_h / crop_area > self.max_overlap:
+                return True
+
+        return False
+
+
+def crop_box(shape, polygon, crop_buffer=CROP_BUFFER):
+    """
+    The bounding rectangle (x1, y1, x2, y2) of a mask polygon plus a buffer,
+    clipped to an image of the given shape.
+    """
+    x, y, w, h = cv2.boundingRect(np.array(polygon, dtype=np.int32))
+    return (max(0, x - crop_buffer), max(0, y - crop_buffer),
+            min(shape[1], x + w + crop_buffer), min(shape[0], y + h + crop_buffer))
+
+
+def crop_polygon(image, polygon, crop_buffer=CROP_BUFFER):
+    """
+    Crops the bounding rectangle of a mask polygon (plus a buffer) from an image.
+    """
+    x1, y1, x2, y2 = crop_box(image.shape, polygon, crop_buffer)
+    return image[y1:y2, x1:x2]
+
+
+def predict_batch(model, images, conf=CONFIDENCE_THRESHOLD, batch_size=MAX_BATCH_SIZE):
+    """
+    Runs the model over a list of images in chunks of at most `batch_size`.
+
+    Returns:
+        list: One ultralytics Results object per input image, in input order.
+    """
+    results = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        results.extend(model(chunk, conf=conf, verbose=False))
+    return results
+
+
+def refine_nodes(nodes, model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER,
+                 batch_size=MAX_BATCH_SIZE, max_depth=MAX_DEPTH, stats=None):
+    """
+    Refines a list of crops level by level until every crop is verified.
+
+    A crop in which the model finds more than one mask is a composite document
+    and gets split into one child per mask; the children form the next level.
+    A crop with one or no masks is a final document.
+
+    Args:
+        nodes (list): DocumentNode roots to refine. They are modified in place.
+            Roots that are already `verified` are not sent to the model.
+        model (YOLO): The loaded YOLO segmentation model.
+        stats (RefinementStats, optional): Collects forward pass counts.
+
+    Returns:
+        list: The same roots, with their children filled in.
+    """
+    frontier = [node for node in nodes if node.image.size > 0 and not node.verified]
+    level = 0
+    while frontier:
+        level += 1
+        with stage(f"refine_level_{level}"):
+            results = predict_batch(model, [node.image for node in frontier], conf, batch_size)
+            if stats is not None:
+                stats.forward_passes += len(frontier)
+
+            next_frontier = []
+            for node, result in zip(frontier, results):
+                masks = result.masks
+                if not masks or len(masks) <= 1 or node.depth >= max_depth:
+                    continue
+
+                logger.info(f"Composite document detected, splitting into {len(masks)} pieces.")
+                ox, oy = node.box[:2]
+                for polygon in masks.xy:
+                    x1, y1, x2, y2 = crop_box(node.image.shape, polygon, crop_buffer)
+                    child = DocumentNode(node.image[y1:y2, x1:x2], node.depth + 1,
+                                         box=(ox + x1, oy + y1, ox + x2, oy + y2))
+                    node.children.append(child)
+                    if child.image.size > 0:
+                        next_frontier.append(child)
+        frontier = next_frontier
+
+    return nodes
+
+
+def scan_images(images, model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER,
+                batch_size=MAX_BATCH_SIZE, max_depth=MAX_DEPTH, policy=None, stats=None):
+    """
+    Performs the initial scan on full images and refines every detection.
+
+    All initial detections of all images share the same refinement batches.
+
+    Args:
+        policy (EarlyExitPolicy, optional): When given, detections it accepts
+            are not sent through the model a second time.
+        stats (RefinementStats, optional): Collects forward pass counts.
+
+    Returns:
+        list: For each input image, either None (nothing detected in the initial
+              scan) or the list of DocumentNode roots, one per initial mask.
+    """
+    images = list(images)
+    with stage("initial_scan"):
+        initial_results = predict_batch(model, images, conf, batch_size)
+    if stats is not None:
+        stats.forward_passes += len(images)
+
+    per_image_roots = []
+    all_roots = []
+    for image, result in zip(images, initial_results):
+        if result.masks is None:
+            per_image_roots.append(None)
+            continue
+
+        polygons = result.masks.xy
+        if policy is not None:
+            confidences = result.boxes.conf.tolist() if result.boxes is not None else [0.0] * len(polygons)
+
+        roots = []
+        for index, polygon in enumerate(polygons):
+            x1, y1, x2, y2 = box = crop_box(image.shape, polygon, crop_buffer)
+            root = DocumentNode(image[y1:y2, x1:x2], box=box)
+            if policy is not None and not policy.needs_refinement(index, polygons, confidences, crop_buffer):
+                root.verified = True
+                if stats is not None:
+                    stats.skipped_passes += 1
+            roots.append(root)
+        per_image_roots.append(roots)
+        all_roots.extend(roots)
+
+    refine_nodes(all_roots, model, conf, crop_buffer, batch_size, max_depth, stats)
+    return per_image_roots
+
+
+def collect_leaves(nodes):
+    """
+    Flattens refinement trees into their final document nodes, depth-first,
+    i.e. in the same order the recursive refinement used to produce them.
+    """
+    leaves = []
+    for node in nodes:
+        if node.image.size == 0:
+            continue
+        if node.is_leaf:
+            leaves.append(node)
+        else:
+            leaves.extend(collect_leaves(node.children))
+    return leaves
+
+
+def collect_documents(nodes):
+    """
+    The final document images of refinement trees (see collect_leaves).
+    """
+    return [node.image for node in collect_leaves(nodes)]
+
+
+# --- DOWNSCALED DETECTION ---
+# YOLO letterboxes its input to 640px, so a 12MP photo can be scanned and
+# refined at a fraction of its size. JPEGs are decoded directly at 1/2, 1/4 or
+# 1/8 scale by libjpeg; the full-resolution image is only decoded when the
+# final documents are cut out of it.
+
+REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# JPEG start-of-frame markers, which carry the image size.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(data):
+    """
+    Reads (width, height) from a JPEG or PNG header without decoding the image.
+    Returns None for other formats or a malformed header.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def reduction_factor(size, max_side):
+    """
+    The largest JPEG reduction (1, 2, 4 or 8) that keeps the long side of an
+    image of the given (width, height) at or above max_side.
+    """
+    long_side = max(size)
+    for factor in (8, 4, 2):
+        if long_side // factor >= max_side:
+            return factor
+    return 1
+
+
+class SourceImage:
+    """
+    The full-resolution upload behind a (possibly downscaled) detection image.
+    It is decoded on first use and documents are cut from it by mapping their
+    boxes from detection coordinates.
+    """
+
+    def __init__(self, data=None, image=None):
+        self._data = data
+        self._image = image
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    self._image = cv2.imdecode(np.frombuffer(self._data, np.uint8), cv2.IMREAD_COLOR)
+                    self._data = None
+        return self._image
+
+    def crop(self, box, detection_shape):
+        """
+        Cuts a box given in the coordinates of the detection image (of shape
+        detection_shape) from the full-resolution image.
+        """
+        image = self.image
+        if image.shape[:2] == tuple(detection_shape[:2]):
+            x1, y1, x2, y2 = box
+            return image[y1:y2, x1:x2]
+        sx = image.shape[1] / detection_shape[1]
+        sy = image.shape[0] / detection_shape[0]
+        x1, y1 = max(0, int(box[0] * sx)), max(0, int(box[1] * sy))
+        x2, y2 = min(image.shape[1], math.ceil(box[2] * sx)), min(image.shape[0], math.ceil(box[3] * sy))
+        return image[y1:y2, x1:x2]
+
+
+def decode_for_detection(data, max_side=0):
+    """
+    Decodes an upload for the YOLO scan.
+
+    Args:
+        data (bytes): The encoded image.
+        max_side (int): Target long side of the detection image. JPEGs larger
+            than twice that are decoded at reduced resolution; other formats
+            are decoded in full and resized. 0 scans at full resolution.
+
+    Returns:
+        tuple: (detection image, SourceImage, factor). The detection image is
+               None if the data can't be decoded; factor is roughly how many
+               times smaller it is than the original.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    size = image_size(data) if max_side else None
+    factor = reduction_factor(size, max_side) if size else 1
+    if factor > 1:
+        image = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[factor])
+        if image is not None:
+            return image, SourceImage(data=data), factor
+
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, None, 1
+    source = SourceImage(image=image)
+    if max_side and max(image.shape[:2]) > 2 * max_side:
+        scale = max_side / max(image.shape[:2])
+        detection = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return detection, source, max(image.shape[:2]) / max(detection.shape[:2])
+    return image, source, 1
@@ -0,0 +1,162 @@
+# result_cache.py
+"""
+Two-tier cache for finished API responses, keyed by content hash.
+
+The memory tier is an LRU bounded by the total size of the cached responses.
+The optional disk tier is a SQLite file that survives restarts; entries found
+there are promoted back into memory. Values are JSON-serializable dicts.
+"""
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- DEFAULT CONFIGURATION ---
+MEMORY_MAX_BYTES = 256 * 1024 ** 2
+DISK_MAX_BYTES = 2 * 1024 ** 3
+# A full disk tier is pruned down to this fraction of its budget, so pruning
+# runs once per few puts rather than on every one.
+DISK_PRUNE_TO = 0.9
+# Every server process writes to the same file; the size total kept here is
+# re-read from it after this many puts to account for the others.
+DISK_RESYNC_PUTS = 256
+
+
+class ResultCache:
+    def __init__(self, memory_max_bytes=MEMORY_MAX_BYTES, disk_path=None, disk_max_bytes=DISK_MAX_BYTES):
+        """
+        Args:
+            memory_max_bytes (int): Budget for the in-memory LRU.
+            disk_path (str, optional): SQLite file for the persistent tier.
+                None keeps the cache in memory only.
+            disk_max_bytes (int): Budget for the persistent tier.
+        """
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+        self._db = None
+        self._disk_bytes = 0
+        self._disk_puts = 0
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            # Shared by all server processes: wait for their writes instead of failing.
+            self._db = sqlite3.connect(disk_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._db.commit()
+            self._disk_bytes = self._disk_total()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        return self._get(key, count=True)
+
+    def peek(self, key):
+        """
+        get() for secondary lookups (e.g. the key of a near-duplicate upload):
+        the value is promoted as usual, but hit and miss counters are left alone.
+        """
+        return self._get(key, count=False)
+
+    def _get(self, key, count):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += count
+                return json.loads(data)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    data = bytes(row[0])
+                    self._store_memory(key, data)
+                    self._counters["disk_hits"] += count
+                    return json.loads(data)
+
+            self._counters["misses"] += count
+            return None
+
+    def put(self, key, value):
+        data = json.dumps(value).encode('utf-8')
+        with self._lock:
+            self._store_memory(key, data)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, data, len(data), time.time())
+                )
+                # An estimate between resyncs (a replaced key is counted twice).
+                self._disk_bytes += len(data)
+                self._disk_puts += 1
+                if self._disk_bytes > self.disk_max_bytes or self._disk_puts % DISK_RESYNC_PUTS == 0:
+                    self._prune_disk()
+                self._db.commit()
+            self._counters["stores"] += 1
+
+    def discard(self, key):
+        with self._lock:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+            if self._db is not None:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._db.commit()
+
+    def _store_memory(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters["memory_evictions"] += 1
+
+    def _disk_total(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def _prune_disk(self):
+        total = self._disk_total()
+        if total > self.disk_max_bytes:
+            target = self.disk_max_bytes * DISK_PRUNE_TO
+            evicted = []
+            for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed"):
+                if total <= target:
+                    break
+                evicted.append((key,))
+                total -= size
+            self._db.executemany("DELETE FROM results WHERE key = ?", evicted)
+            self._counters["disk_evictions"] += len(evicted)
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **{name: self._counters[name] for name in
+                   ("memory_hits", "disk_hits", "misses", "stores", "memory_evictions", "disk_evictions")},
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
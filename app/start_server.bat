@@ -0,0 +1,16 @@
+@echo off
+setLOCAL
+TITLE API Server
+
+ECHO ==============================================
+ECHO == Starting Document Detector API (prod)... ==
+ECHO ==============================================
+ECHO.
+
+REM gunicorn does not run on Windows; waitress serves the same app factory.
+IF "%WEB_THREADS%"=="" SET WEB_THREADS=8
+
+cd /d "%~dp0"
+call ..\venv_app\Scripts\activate.bat
+waitress-serve --host=0.0.0.0 --port=5000 --threads=%WEB_THREADS% --call app:create_app
+endlocal
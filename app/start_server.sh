@@ -0,0 +1,25 @@
+#!/bin/bash
+# Production backend (no React dev server). Tune with WEB_WORKERS, WEB_THREADS,
+# TORCH_THREADS, OCR_WORKERS and MODEL_PRELOAD. With more than one worker, job
+# state is shared through JOB_STORE_PATH (app/cache/jobs.sqlite by default).
+
+echo "=============================================="
+echo "== Starting Document Detector API (prod)... =="
+echo "=============================================="
+echo
+
+cd "$(dirname "$0")"
+source ../venv_app/bin/activate
+
+if [ "${WEB_WORKERS:-2}" -gt 1 ] && [ "${JOB_STORE_PATH-unset}" == "" ]; then
+    echo "JOB_STORE_PATH is empty, so jobs stay in one process: set WEB_WORKERS=1 or a shared JOB_STORE_PATH."
+    exit 1
+fi
+
+if [ "$1" == "--async" ]; then
+    echo "-> Starting uvicorn (async front end) with ${WEB_WORKERS:-2} workers..."
+    exec uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers "${WEB_WORKERS:-2}"
+else
+    echo "-> Starting gunicorn..."
+    exec gunicorn -c gunicorn.conf.py "app:create_app()"
+fi
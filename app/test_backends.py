@@ -0,0 +1,33 @@
+import sys
+import os
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import compare_masks, model_path_for
+
+
+def test_model_paths():
+    print("Testing exported model paths...")
+    weights = os.path.join("models", "best.pt")
+    assert model_path_for(weights, 'pytorch') == weights
+    assert model_path_for(weights, 'onnx') == os.path.join("models", "best.onnx")
+    assert model_path_for(weights, 'openvino', int8=True) == os.path.join("models", "best_int8_openvino_model")
+
+
+def test_compare_masks():
+    print("\nTesting mask parity comparison...")
+    square = np.array([[10, 10], [50, 10], [50, 50], [10, 50]], dtype=np.float32)
+    shifted = square + 2
+    far = square + 100
+
+    ious = compare_masks([square, far], [far, shifted], (200, 200))
+    print(f"IoUs: {ious}")
+    assert ious[0] > 0.8 and ious[1] == 1.0
+    assert compare_masks([square], [], (200, 200)) == [0.0]
+
+
+if __name__ == "__main__":
+    test_model_paths()
+    test_compare_masks()
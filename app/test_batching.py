@@ -0,0 +1,79 @@
+import sys
+import os
+import threading
+import time
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from batching import BatchScheduler
+
+
+class RecordingModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, images, conf=0.5, verbose=False):
+        self.batch_sizes.append(len(images))
+        time.sleep(0.01)
+        return [int(image[0, 0]) for image in images]
+
+
+def test_concurrent_requests_share_batches():
+    print("Testing cross-request batching...")
+    model = RecordingModel()
+    scheduler = BatchScheduler(lambda: model, max_batch_size=8, max_wait_ms=50)
+
+    results = {}
+
+    def request(i):
+        results[i] = scheduler([np.full((4, 4), i, dtype=np.uint8)])[0]
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = scheduler.stats()
+    print(f"Batch sizes: {model.batch_sizes}, stats: {stats}")
+    assert results == {i: i for i in range(16)}
+    assert max(model.batch_sizes) <= 8
+    assert len(model.batch_sizes) < 16
+    assert stats["images"] == 16
+    assert stats["queue_depth"] == 0
+
+
+def test_model_failure_propagates():
+    print("\nTesting failing model...")
+    scheduler = BatchScheduler(lambda: None, max_wait_ms=1)
+    future = scheduler.submit(np.zeros((4, 4), dtype=np.uint8))
+    try:
+        future.result(timeout=5)
+        failed = False
+    except RuntimeError:
+        failed = True
+    print(f"Failure propagated: {failed}")
+    assert failed
+
+
+def test_close_finishes_queued_work():
+    print("\nTesting scheduler shutdown...")
+    model = RecordingModel()
+    scheduler = BatchScheduler(lambda: model, max_batch_size=2, max_wait_ms=1)
+    futures = [scheduler.submit(np.full((4, 4), i, dtype=np.uint8)) for i in range(5)]
+    thread = scheduler._thread
+    scheduler.close()
+    print(f"Results after close: {[f.result(timeout=0) for f in futures]}")
+    assert [f.result(timeout=0) for f in futures] == list(range(5))
+    assert not thread.is_alive()
+    # A closed scheduler starts again on the next submission.
+    assert scheduler([np.full((4, 4), 7, dtype=np.uint8)]) == [7]
+    scheduler.close()
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_batches()
+    test_model_failure_propagates()
+    test_close_finishes_queued_work()
@@ -0,0 +1,86 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document_pipeline
+from extract_all_documents import MANIFEST_NAME, extract_and_verify_documents, output_folders
+from test_refinement import FakeModel
+
+decode = document_pipeline.decode
+
+
+def locked_decode(data, max_side=0):
+    # d.jpg can't be opened during the first run, like a file still being copied.
+    if str(data).endswith("d.jpg"):
+        raise PermissionError(f"Permission denied: '{data}'")
+    return decode(data, max_side)
+
+
+def test_resumable_batch_extraction():
+    print("Testing batch extraction and resuming from the manifest...")
+    root = tempfile.mkdtemp()
+    try:
+        input_folder = os.path.join(root, "input")
+        output_folder = os.path.join(root, "output")
+        os.makedirs(os.path.join(input_folder, "sub"))
+        for name in ["a.jpg", "a.png", "b.png", "d.jpg", os.path.join("sub", "c.jpg")]:
+            cv2.imwrite(os.path.join(input_folder, name), np.full((50, 150, 3), 128, dtype=np.uint8))
+        with open(os.path.join(input_folder, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+
+        model = FakeModel()
+        document_pipeline.decode = locked_decode
+        try:
+            summary = extract_and_verify_documents(input_folder, output_folder, recursive=True, batch_size=2,
+                                                   model=model)
+        finally:
+            document_pipeline.decode = decode
+        print(f"First run: {summary}")
+        assert summary["processed"] == 4 and summary["unreadable"] == 1 and summary["failed"] == 1
+        # Every 150px image splits into two halves that need no further splitting.
+        assert summary["documents"] == 8
+        assert os.path.exists(os.path.join(output_folder, "sub", "c", "c_doc_2.jpg"))
+        # a.jpg and a.png were written concurrently; each keeps its own folder.
+        records = [json.loads(line) for line in open(os.path.join(output_folder, MANIFEST_NAME), encoding='utf-8')]
+        records = {record["image"]: record for record in records}
+        assert records["a.jpg"]["folder"] == "a" and records["a.png"]["folder"] == "a_png"
+        files = {image: record.get("files", []) for image, record in records.items()}
+        assert len(files["a.jpg"]) == len(files["a.png"]) == 2 and not set(files["a.jpg"]) & set(files["a.png"])
+        assert all(os.path.exists(os.path.join(output_folder, path)) for paths in files.values() for path in paths)
+
+        # Simulate a crash that lost the record of one image.
+        manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+        lines = open(manifest_path, encoding='utf-8').read().splitlines()
+        kept = [line for line in lines if json.loads(line)["image"] != "b.png"]
+        with open(manifest_path, "w", encoding='utf-8') as f:
+            f.write("\n".join(kept) + "\n" + '{"image": "b.pn')
+
+        summary = extract_and_verify_documents(input_folder, output_folder, recursive=True, batch_size=2,
+                                               model=model)
+        print(f"Second run: {summary}")
+        # b.png (lost record) and d.jpg (failed) are redone; broken.jpg stays unreadable.
+        assert summary["skipped"] == 4
+        assert summary["processed"] == 2 and summary["documents"] == 4
+    finally:
+        shutil.rmtree(root)
+
+
+def test_output_folders():
+    print("Testing output folder names...")
+    assert output_folders(["a.jpg", "a.png", "b.png", os.path.join("sub", "a.jpg")]) == {
+        "a.jpg": "a", "a.png": "a_png", "b.png": "b", os.path.join("sub", "a.jpg"): os.path.join("sub", "a")}
+    # An image added next to an extracted one doesn't take over its folder.
+    assert output_folders(["a.jpg", "a.png"], recorded={"a.png": "a"}) == {"a.png": "a", "a.jpg": "a_jpg"}
+
+
+if __name__ == "__main__":
+    test_resumable_batch_extraction()
+    test_output_folders()
@@ -0,0 +1,157 @@
+import sys
+import os
+import multiprocessing
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from jobs import JobQueue, QueueFullError
+
+
+def wait_for(job_queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_job_lifecycle():
+    print("Testing job lifecycle...")
+    job_queue = JobQueue(lambda x: ({"status": "success", "value": x * 2}, 200), num_workers=1)
+
+    job_id = job_queue.submit(21)
+    job = wait_for(job_queue, job_id)
+    print(f"Job: {job}")
+    assert job["status"] == "done"
+    assert job["result"]["value"] == 42
+    assert job_queue.get("missing") is None
+
+
+def test_job_failure():
+    print("\nTesting failing job...")
+
+    def handler():
+        raise ValueError("boom")
+
+    job_queue = JobQueue(handler, num_workers=1)
+    job = wait_for(job_queue, job_queue.submit())
+    print(f"Job: {job}")
+    assert job["status"] == "failed"
+    assert job["http_status"] == 500
+
+
+def test_backpressure():
+    print("\nTesting backpressure...")
+    release = threading.Event()
+
+    def handler():
+        release.wait()
+        return {"status": "success"}, 200
+
+    job_queue = JobQueue(handler, num_workers=1, max_pending=1)
+    first = job_queue.submit()
+    while job_queue.get(first)["status"] != "running":
+        time.sleep(0.01)
+    job_queue.submit()
+
+    try:
+        job_queue.submit()
+        rejected = False
+    except QueueFullError:
+        rejected = True
+    release.set()
+    print(f"Third submission rejected: {rejected}")
+    assert rejected
+
+
+def poll_job(store_path, job_id):
+    # Module level, so a spawned process (another server worker) can run it.
+    return wait_for(JobQueue(None, store_path=store_path), job_id)
+
+
+def test_shared_store():
+    print("\nTesting a job polled from another worker...")
+    release = threading.Event()
+
+    def handler(x):
+        release.wait()
+        return {"status": "success", "value": x * 2}, 200
+
+    with tempfile.TemporaryDirectory() as folder:
+        store_path = os.path.join(folder, "jobs.sqlite")
+        submitting = JobQueue(handler, num_workers=1, store_path=store_path)
+        polling = JobQueue(handler, num_workers=1, store_path=store_path)
+        job_id = submitting.submit(21)
+        while polling.get(job_id)["status"] != "running":
+            time.sleep(0.01)
+        release.set()
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            job = pool.apply(poll_job, (store_path, job_id))
+        print(f"Job seen by another process: {job}")
+        assert job["status"] == "done" and job["result"]["value"] == 42
+        assert polling.get("missing") is None
+
+
+def hang():
+    time.sleep(60)
+    return {"status": "success"}, 200
+
+
+def submit_and_hang(store_path, connection):
+    # A server worker that dies (is killed below) while its jobs are queued or running.
+    job_queue = JobQueue(hang, num_workers=1, store_path=store_path)
+    running, queued = job_queue.submit(), job_queue.submit()
+    while job_queue.get(running)["status"] != "running":
+        time.sleep(0.01)
+    connection.send((running, queued))
+    time.sleep(60)
+
+
+def test_jobs_of_dead_worker():
+    print("\nTesting jobs left behind by a dead worker...")
+    release = threading.Event()
+
+    def handler():
+        release.wait()
+        return {"status": "success"}, 200
+
+    with tempfile.TemporaryDirectory() as folder:
+        store_path = os.path.join(folder, "jobs.sqlite")
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(target=submit_and_hang, args=(store_path, sender))
+        worker.start()
+        orphans = receiver.recv()
+        worker.kill()
+        worker.join()
+
+        # A live job that runs longer than stale_after keeps its heartbeat.
+        job_queue = JobQueue(handler, num_workers=1, result_ttl=1, store_path=store_path,
+                             heartbeat_interval=0.05, stale_after=0.3)
+        live = job_queue.submit()
+        time.sleep(0.5)
+        jobs = [job_queue.get(job_id) for job_id in orphans]
+        print(f"Orphaned jobs: {jobs}")
+        assert [job["status"] for job in jobs] == ["failed", "failed"]
+        assert all(job["http_status"] == 500 for job in jobs)
+        assert job_queue.get(live)["status"] == "running"
+        release.set()
+        assert wait_for(job_queue, live)["status"] == "done"
+
+        # Once failed, they expire like any finished job.
+        time.sleep(1.1)
+        assert [job_queue.get(job_id) for job_id in orphans] == [None, None]
+
+
+if __name__ == "__main__":
+    test_job_lifecycle()
+    test_job_failure()
+    test_backpressure()
+    test_shared_store()
+    test_jobs_of_dead_worker()
@@ -0,0 +1,41 @@
+import sys
+import os
+from rapidfuzz import fuzz, process
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from matcher import FuzzyIndex
+from receipt_processor import ReceiptProcessor
+
+
+def test_index_matches_full_scan():
+    print("Testing trigram index against a full scan...")
+    processor = ReceiptProcessor()
+    items = processor.db['items']
+    # A tiny shortlist forces the trigram blocking path even on the mock DB.
+    index = FuzzyIndex(items, normalize=processor.clean_text, max_candidates=8)
+
+    queries = ["кока кола", "млеко битолско", "леб бел сечен", "пиво скопско", "xyz"]
+    matches = index.match_many(queries, score_cutoff=85)
+    for query, match in zip(queries, matches):
+        full = process.extractOne(query, index.normalized, scorer=fuzz.WRatio, score_cutoff=85)
+        print(f"'{query}' -> {match}")
+        assert (match is None) == (full is None)
+        if match:
+            assert match[1] == full[1]
+            assert match[0] in items
+
+
+def test_small_catalog_batch():
+    print("\nTesting batched scoring on a small catalog...")
+    index = FuzzyIndex(["КОКА КОЛА 1.5Л", "ПИВО СКОПСКО"], normalize=str.lower)
+    matches = index.match_many(["кока кола 1.5л", "нешто друго"], score_cutoff=85)
+    print(f"Matches: {matches}")
+    assert matches[0][0] == "КОКА КОЛА 1.5Л"
+    assert matches[1] is None
+
+
+if __name__ == "__main__":
+    test_index_matches_full_scan()
+    test_small_catalog_batch()
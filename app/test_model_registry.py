@@ -0,0 +1,58 @@
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model_registry import ModelRegistry
+
+
+def test_concurrent_get_loads_once():
+    print("Testing concurrent model loading...")
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "model"
+
+    warmed = []
+    registry = ModelRegistry()
+    registry.register("yolo", loader, warmup=warmed.append)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("yolo"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"Loader calls: {len(calls)}, status: {registry.status()}")
+    assert len(calls) == 1
+    assert warmed == ["model"]
+    assert results == ["model"] * 8
+    assert registry.ready
+
+
+def test_failed_load():
+    print("\nTesting failed model loading...")
+
+    def loader():
+        raise RuntimeError("weights not found")
+
+    registry = ModelRegistry()
+    registry.register("ocr", loader)
+    registry.load_all()
+
+    status = registry.status()
+    print(f"Status: {status}")
+    assert registry.get("ocr") is None
+    assert not status["ready"]
+    assert status["models"]["ocr"]["state"] == "failed"
+
+
+if __name__ == "__main__":
+    test_concurrent_get_loads_once()
+    test_failed_load()
@@ -0,0 +1,87 @@
+import sys
+import os
+import random
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+import numpy as np
+
+from near_duplicates import BKTree, NearDuplicateIndex, hamming, image_hash
+
+
+def receipt(lines, seed=0):
+    """
+    A white receipt on a dark table under uneven light, one text line per entry.
+    """
+    image = np.full((900, 700, 3), 40, dtype=np.uint8)
+    cv2.rectangle(image, (150, 60), (550, 840), (235, 235, 235), -1)
+    for i, line in enumerate(lines):
+        cv2.putText(image, line, (175, 120 + 45 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    y, x = np.mgrid[:900, :700]
+    light = 0.75 + 0.25 * np.cos((x - 250) / 500) * np.cos((y - 300) / 700)
+    noise = np.random.default_rng(seed).integers(-6, 7, image.shape)
+    return np.clip(image * light[..., None] + noise, 0, 255).astype(np.uint8)
+
+
+def rephotographed(image):
+    # Slightly shifted, rescaled, brighter and blurred, as from a second photo.
+    h, w = image.shape[:2]
+    shifted = cv2.warpAffine(image, np.float32([[1, 0, 3], [0, 1, -2]]), (w, h), borderMode=cv2.BORDER_REPLICATE)
+    resized = cv2.resize(shifted, (int(w * 0.8), int(h * 0.8)), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(cv2.convertScaleAbs(resized, alpha=1.05, beta=12), (3, 3), 0)
+
+
+def test_hashes():
+    print("Testing perceptual hashes...")
+    first = receipt(["MARKET", "Bread 1.20", "Milk 0.99", "TOTAL 2.19"])
+    other = receipt(["PHARMACY", "", "", "", "", "", "", "", "", "", "", "", "", "", "Cream 7.50", "TOTAL 7.50"])
+    first_hashes, second_hashes = image_hash(first), image_hash(rephotographed(first))
+    other_hashes = image_hash(other)
+    same = [hamming(a, b) for a, b in zip(first_hashes, second_hashes)]
+    different = [hamming(a, b) for a, b in zip(first_hashes, other_hashes)]
+    print(f"Distances (pHash, dHash): same receipt {same}, other receipt {different}")
+    assert max(same) <= 8
+    assert max(different) > 8
+
+
+def test_bk_tree():
+    print("\nTesting BK-tree lookups...")
+    rng = random.Random(1)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    # Near copies of a few values, so searches have something to find.
+    values += [v ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for v in values[:50]]
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, i)
+    for query in values[:50]:
+        found = sorted(tree.search(query, 3))
+        expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= 3)
+        assert found == expected
+    print(f"Searched {len(values)} hashes; results match a full scan")
+
+
+def test_index_eviction():
+    print("\nTesting index tags, LRU and TTL...")
+    index = NearDuplicateIndex(radius=4, max_entries=2, ttl_seconds=0.2)
+    a, b, c = (0, 0), (0xFFFF, 0xFFFF), (0xFFFF << 32, 0xFFFF << 32)
+    index.put(a, "a", tag="ocr")
+    index.put(b, "b", tag="ocr")
+    assert index.get((0b101, 0b1), tag="ocr") == ("a", 2)
+    assert index.get(a, tag="segment") is None
+    index.put(c, "c", tag="ocr")  # b is the least recently used
+    assert index.get(b, tag="ocr") is None
+    assert index.get(a, tag="ocr") == ("a", 0)
+    time.sleep(0.3)
+    assert index.get(c, tag="ocr") is None
+    stats = index.stats()
+    print(f"Stats: {stats}")
+    assert stats["evictions"] == 1 and stats["expired"] >= 1 and stats["hits"] == 2
+
+
+if __name__ == "__main__":
+    test_hashes()
+    test_bk_tree()
+    test_index_eviction()
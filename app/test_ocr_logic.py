@@ -1,12 +1,20 @@
 import sys
 import os
+import shutil
+import tempfile
 import cv2
 import numpy as np
+from multiprocessing import shared_memory
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from receipt_processor import ReceiptProcessor
+import receipt_processor
+import tracing
+from receipt_processor import (REC_BATCH_SIZE, ReceiptProcessor, estimate_text_height, ocr_bands,
+                               rec_batches)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "mock_db.json")
 
 def test_cleaning_logic():
     print("Testing Cleaning Logic...")
@@ -27,14 +35,17 @@ def test_cleaning_logic():
 
 def test_fuzzy_matching():
     print("\nTesting Fuzzy Matching...")
-    processor = ReceiptProcessor()
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "db.json")
+    shutil.copy(DB_PATH, db_path)
+    processor = ReceiptProcessor(db_path=db_path)
     
-    # Mock items in DB
-    processor.db['items'] = [
+    # Mock items in DB (edited through ProductDB, which rebuilds the indexes)
+    processor.products.update('items', remove=processor.db['items'], add=[
         "МЛЕКО БИТОЛСКО 3.2%",
         "КОКА КОЛА 1.5Л",
         "ЈОГУРТ БИТОЛСКИ"
-    ]
+    ])
     
     test_lines = [
         {"original": "Млеκо Битолсκо 3.2%", "cleaned": "млеко битолско"},
@@ -44,6 +55,8 @@ def test_fuzzy_matching():
     
     matches = processor.check_database(test_lines)
     print("Matches found:", matches)
+    shutil.rmtree(directory)
+    assert [item["name"] for item in matches["items_found"]] == ["МЛЕКО БИТОЛСКО 3.2%", "КОКА КОЛА 1.5Л"]
 
 def test_vertical_alignment():
     print("\nTesting Vertical Alignment Logic...")
@@ -63,8 +76,293 @@ def test_vertical_alignment():
     print("Grouped Lines:")
     for line in grouped:
         print(f"- {line}")
+    assert grouped == ["МЛЕКО БИТОЛСКО 75.00", "ЛЕБ 30,00"]
+
+def test_rotated_and_dense_lines():
+    print("\nTesting Rotated and Dense Lines...")
+    processor = ReceiptProcessor()
+
+    # A slightly rotated photo: the price sits 18px lower than the name (more
+    # than the old fixed 15px threshold) but their boxes still overlap.
+    boxes = [
+        {"box": [[400, 118], [500, 120], [500, 158], [400, 156]], "text": "75.00"},
+        {"box": [[10, 100], [100, 102], [100, 140], [10, 138]], "text": "МЛЕКО"},
+        {"box": [[400, 188], [500, 190], [500, 228], [400, 226]], "text": "30,00"},
+        {"box": [[10, 170], [100, 172], [100, 210], [10, 208]], "text": "ЛЕБ"},
+    ]
+    grouped = processor._group_lines_by_y(boxes)
+    print("Grouped Lines:", grouped)
+    assert grouped == ["МЛЕКО 75.00", "ЛЕБ 30,00"]
+
+    # A long roll: 2000 lines of 3 blocks each, shuffled
+    boxes = []
+    for row in range(2000):
+        for col in range(3):
+            y = 20 + row * 30 + (row * 7 + col) % 5
+            boxes.append({"box": [[col * 150, y], [col * 150 + 100, y], [col * 150 + 100, y + 20],
+                                  [col * 150, y + 20]], "text": f"{row}.{col}"})
+    boxes.reverse()
+    grouped = processor._group_lines_by_y(boxes)
+    assert len(grouped) == 2000
+    assert grouped[0] == "0.0 0.1 0.2" and grouped[-1] == "1999.0 1999.1 1999.2"
+
+class StripeOCR:
+    """
+    Reads a synthetic receipt whose text lines are horizontal stripes: every
+    row of a stripe holds the line number as its pixel value. Stripes cut off
+    at the image edge are still returned (as a real OCR would return half a
+    line), so tiling has to drop them.
+
+    A line that starts dark (its text is on the right) is upside down: the
+    classifier labels it '180', and without the classifier it is misread.
+    """
+
+    def __init__(self):
+        self.heights = []
+        self.rec_batches = []
+        self.rec_cls = []
+        self.cls_calls = 0
+
+    @staticmethod
+    def _upside_down(crop):
+        return crop[crop.shape[0] // 2, 0, 0] == 0
+
+    def text_classifier(self, crops):
+        # Angle classification only
+        self.cls_calls += 1
+        return crops, [['180' if self._upside_down(crop) else '0', 0.99] for crop in crops], 0.0
+
+    def ocr(self, image, det=True, rec=True, cls=True):
+        if not det:
+            crops = image[0]
+            upside_down = [self._upside_down(crop) for crop in crops]
+            # Recognition only, of a list of line crops
+            self.rec_batches.append(len(crops))
+            self.rec_cls.append(cls)
+            texts = [f"LINE {crop[crop.shape[0] // 2].max()}" for crop in crops]
+            return [[(text[::-1] if flipped and not cls else text, 0.9)
+                     for text, flipped in zip(texts, upside_down)]]
+        self.heights.append(image.shape[0])
+        values = image[:, :, 0].max(axis=1).astype(int)
+        entries = []
+        start = 0
+        for y in range(1, len(values) + 1):
+            if y == len(values) or values[y] != values[start]:
+                if values[start]:
+                    w = image.shape[1]
+                    box = [[0, start], [w, start], [w, y], [0, y]]
+                    entries.append([box, (f"LINE {values[start]}", 0.9)] if rec else box)
+                start = y
+        return [entries]
+
+def test_tiled_ocr():
+    print("\nTesting Tiled OCR on a Long Receipt...")
+    processor = ReceiptProcessor()
+    processor.ocr = StripeOCR()
+
+    # 200px wide, 250 lines of 12px text every 30px (7500px tall)
+    image = np.zeros((7520, 200, 3), dtype=np.uint8)
+    for line in range(1, 251):
+        top = 20 + (line - 1) * 30
+        image[top:top + 12] = line
+    bands = ocr_bands(*image.shape[:2])
+    print(f"{len(bands)} bands: {bands[:2]} ...")
+    assert len(bands) > 1 and bands[-1][1] == image.shape[0]
+
+    result = processor.process_image(image, debug_steps=False)
+    lines = result["raw_text"].splitlines()
+    assert lines == [f"LINE {line}" for line in range(1, 251)]
+    assert len(processor.ocr.heights) == len(bands) and max(processor.ocr.heights) == 300
+
+    # Short crops are read in one call.
+    assert ocr_bands(500, 400) == [(0, 500, 0, 500)]
+
+def test_batched_recognition():
+    print("\nTesting Cross-Document Line Batching...")
+    # A long receipt (read in bands) and a short one with lines 7 and 9
+    long_receipt = np.zeros((7520, 200, 3), dtype=np.uint8)
+    for line in range(1, 251):
+        top = 20 + (line - 1) * 30
+        long_receipt[top:top + 12] = line
+    short_receipt = np.zeros((100, 200, 3), dtype=np.uint8)
+    short_receipt[20:32] = 7
+    short_receipt[60:72] = 9
+    images = [long_receipt, short_receipt]
+
+    processor = ReceiptProcessor()
+    processor.ocr = StripeOCR()
+    expected = [result["raw_text"] for result in processor.process_images(images, debug_steps=False)]
+
+    processor = ReceiptProcessor(batch_lines=True)
+    processor.ocr = StripeOCR()
+    results = processor.process_images(images, debug_steps=False)
+    print(f"Recognition batches: {processor.ocr.rec_batches}")
+    assert [result["raw_text"] for result in results] == expected
+    assert results[1]["raw_text"] == "LINE 7\nLINE 9"
+    # 252 lines of both documents in full batches, one recognition call per batch
+    assert sum(processor.ocr.rec_batches) == 252 and max(processor.ocr.rec_batches) == REC_BATCH_SIZE
+    assert len(processor.ocr.rec_batches) == -(-252 // REC_BATCH_SIZE)
+
+    # Lines are bucketed by width: a batch never pads a line to more than twice its width.
+    ratios = [1.0, 10.0, 1.5, 30.0, 2.5, 9.0]
+    assert rec_batches(ratios, batch_size=4) == [[0, 2], [4], [5, 1], [3]]
+
+def test_document_orientation():
+    print("\nTesting Document Orientation...")
+    # Six lines with their text on the left, photographed upside down
+    upright = np.zeros((200, 200, 3), dtype=np.uint8)
+    for line in range(1, 7):
+        upright[10 + (line - 1) * 30:22 + (line - 1) * 30, :100] = line
+    upside_down = np.ascontiguousarray(np.rot90(upright, 2))
+    # Lines 3 and 4 mirrored: the sampled lines disagree
+    mixed = upright.copy()
+    mixed[70:112] = mixed[70:112, ::-1]
+    expected = "\n".join(f"LINE {line}" for line in range(1, 7))
+
+    processor = ReceiptProcessor(batch_lines=True, orient_documents=True)
+    processor.ocr = StripeOCR()
+    results = processor.process_images([upside_down, mixed], debug_steps=False)
+    print(f"Orientations: {[result['orientation'] for result in results]}")
+    assert [result["raw_text"] for result in results] == [expected, expected]
+    assert results[0]["orientation"]["angle"] == 180 and not results[0]["orientation"]["per_line_cls"]
+    # Only the uncertain document's lines are classified one by one.
+    assert results[1]["orientation"]["per_line_cls"]
+    # One classifier call for all samples, and no recognition pass over them.
+    assert processor.ocr.cls_calls == 1
+    assert sorted(zip(processor.ocr.rec_cls, processor.ocr.rec_batches)) == [(False, 6), (True, 6)]
+
+    # Without batching, each document is oriented on its own.
+    processor = ReceiptProcessor(orient_documents=True)
+    processor.ocr = StripeOCR()
+    assert processor.process_image(upside_down, debug_steps=False)["raw_text"] == expected
+
+class ShapeOCR:
+    """
+    Records the size of every image it reads and returns one line of text.
+    """
+
+    def __init__(self):
+        self.shapes = []
+
+    def ocr(self, image, cls=True):
+        self.shapes.append(image.shape[:2])
+        h, w = image.shape[:2]
+        return [[[[[0, 0], [w, 0], [w, h], [0, h]], ("МЛЕКО 75.00", 0.9)]]]
+
+def printed_receipt(font_scale, lines=12):
+    gap = int(45 * font_scale)
+    image = np.full((gap * (lines + 1), 600, 3), 255, dtype=np.uint8)
+    for line in range(lines):
+        cv2.putText(image, f"MLEKO BITOLSKO {line}0.00", (10, gap * (line + 1)), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, (0, 0, 0), max(1, int(2 * font_scale)))
+    return image
+
+def test_text_height_scaling():
+    print("\nTesting Text Height Scaling...")
+    processor = ReceiptProcessor(text_height=32)
+    processor.ocr = ShapeOCR()
+
+    small, large = printed_receipt(0.8), printed_receipt(3.0)
+    small_height = estimate_text_height(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+    large_height = estimate_text_height(cv2.cvtColor(large, cv2.COLOR_BGR2GRAY))
+    print(f"Estimated text heights: {small_height}, {large_height}")
+    # The digits and capitals are about 17px tall at font scale 0.8.
+    assert 14 <= small_height <= 20 and 3 <= large_height / small_height <= 4.5
+
+    results = processor.process_images([small, large, np.full((300, 300, 3), 255, dtype=np.uint8)],
+                                       debug_steps=False)
+    scalings = [result["scaling"] for result in results]
+    print(f"Scalings: {scalings}, OCR input sizes: {processor.ocr.shapes}")
+    assert scalings[0]["scale"] > 1.5 and scalings[1]["scale"] < 0.7
+    assert processor.ocr.shapes[0][1] == round(600 * scalings[0]["scale"])
+    # Without lines of text there is nothing to go by.
+    assert scalings[2] == {"text_height": None, "scale": 1.0, "ocr_ms": scalings[2]["ocr_ms"]}
+    assert processor.ocr.shapes[2] == (300, 300)
+    assert all(result["raw_text"] == "МЛЕКО 75.00" for result in results)
+
+# Imported as `paddleocr` by the spawned OCR pool workers. A stripe of value
+# 255 makes the worker fail.
+FAKE_PADDLEOCR = """
+from test_ocr_logic import StripeOCR
+
+class PaddleOCR(StripeOCR):
+    def __init__(self, **kwargs):
+        super().__init__()
+
+    def ocr(self, image, det=True, rec=True, cls=True):
+        if det and image.max() == 255:
+            raise RuntimeError("OCR failed")
+        return super().ocr(image, det, rec, cls)
+"""
+
+def test_ocr_pool():
+    print("\nTesting the OCR Worker Pool...")
+    # Five receipts with lines 10k+1 .. 10k+3, of different sizes
+    images = []
+    for k in range(1, 6):
+        image = np.zeros((40 * 4 + 20 * k, 150 + 10 * k, 3), dtype=np.uint8)
+        for line in range(1, 4):
+            image[line * 40:line * 40 + 12] = 10 * k + line
+        images.append(image)
+    failing = images[:2] + [np.full((60, 100, 3), 255, dtype=np.uint8)] + images[2:]
+
+    fake_dir = tempfile.mkdtemp()
+    with open(os.path.join(fake_dir, "paddleocr.py"), "w", encoding="utf-8") as f:
+        f.write(FAKE_PADDLEOCR)
+    # Spawned workers start with the parent's sys.path.
+    sys.path.insert(0, fake_dir)
+    created = []
+
+    class RecordingSharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+    receipt_processor.shared_memory.SharedMemory = RecordingSharedMemory
+    try:
+        for batch_lines in (False, True):
+            processor = ReceiptProcessor(batch_lines=batch_lines)
+            processor.ocr = StripeOCR()
+            expected = processor.process_images(images, debug_steps=False)
+
+            processor = ReceiptProcessor(ocr_workers=2, ocr_threads=1, batch_lines=batch_lines)
+            try:
+                with tracing.trace_request() as trace:
+                    results = processor.process_images(images, debug_steps=False)
+                print(f"batch_lines={batch_lines}: {[result['raw_text'] for result in results]}")
+                assert results == expected
+                assert results[4]["raw_text"] == "LINE 51\nLINE 52\nLINE 53"
+                # Every run in the workers is counted, not one per worker reply.
+                assert trace.stages["cleaning"][1] == len(images)
+
+                try:
+                    processor.process_images(failing, debug_steps=False)
+                    assert False, "the worker's error was not raised"
+                except RuntimeError as e:
+                    assert str(e) == "OCR failed"
+            finally:
+                processor.close()
+    finally:
+        receipt_processor.shared_memory.SharedMemory = shared_memory.SharedMemory
+        sys.path.remove(fake_dir)
+        shutil.rmtree(fake_dir)
+
+    # Every image went through shared memory, and every block is gone again.
+    assert len(created) == 2 * (len(images) + len(failing))
+    for name in created:
+        try:
+            shared_memory.SharedMemory(name=name).close()
+            assert False, f"shared memory block {name} was not unlinked"
+        except FileNotFoundError:
+            pass
 
 if __name__ == "__main__":
     test_cleaning_logic()
     test_fuzzy_matching()
     test_vertical_alignment()
+    test_rotated_and_dense_lines()
+    test_tiled_ocr()
+    test_batched_recognition()
+    test_document_orientation()
+    test_text_height_scaling()
+    test_ocr_pool()
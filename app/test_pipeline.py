@@ -0,0 +1,84 @@
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+from pipeline import Stage, run_pipeline
+
+
+def cube(n):
+    # Module level, so a process stage can pickle it.
+    return n ** 3
+
+
+def test_stages_and_failures():
+    print("Testing pipeline stages...")
+
+    def parse(text):
+        return int(text)
+
+    def slow_square(n):
+        time.sleep(0.01 * (n % 3))
+        return n * n
+
+    stages = [Stage("parse", parse, workers=2), Stage("square", slow_square, workers=3)]
+    items = [(f"item{i}", str(i)) for i in range(10)] + [("bad", "x")]
+    with tracing.trace_request() as trace:
+        results = {key: (value, error) for key, value, error in run_pipeline(items, stages, queue_size=2)}
+    print(f"Results: {results}")
+
+    assert len(results) == 11
+    assert all(results[f"item{i}"] == (i * i, None) for i in range(10))
+    value, error = results["bad"]
+    assert value == "x" and isinstance(error, ValueError)
+    # Stage timings land in the caller's trace, although they ran on other threads.
+    assert trace.stages["parse"][1] == 11 and trace.stages["square"][1] == 10
+
+
+def test_backpressure_and_early_close():
+    print("\nTesting bounded queues...")
+    fed = []
+    release = threading.Event()
+
+    def items():
+        for i in range(100):
+            fed.append(i)
+            yield i, i
+
+    def blocked(n):
+        release.wait()
+        return n
+
+    results = run_pipeline(items(), [Stage("blocked", blocked)], queue_size=2)
+    # Starting the generator starts the workers; nothing can come out yet.
+    consumer = threading.Thread(target=lambda: next(results))
+    consumer.start()
+    time.sleep(0.2)
+    print(f"Items read while the stage is blocked: {len(fed)}")
+    # One item in the worker, two in each queue, one waiting in the feeder.
+    assert len(fed) <= 6
+
+    release.set()
+    consumer.join()
+    results.close()
+    time.sleep(0.3)
+    assert len(fed) < 100
+    assert not any(t.name.startswith("pipeline-") and t.is_alive() for t in threading.enumerate())
+
+
+def test_process_stage():
+    print("\nTesting a stage on worker processes...")
+    stages = [Stage("parse", int), Stage("cube", cube, workers=2, processes=True)]
+    results = {key: (value, error) for key, value, error in run_pipeline([("a", "2"), ("b", "3")], stages)}
+    print(f"Results: {results}")
+    assert results == {"a": (8, None), "b": (27, None)}
+
+
+if __name__ == "__main__":
+    test_stages_and_failures()
+    test_backpressure_and_early_close()
+    test_process_stage()
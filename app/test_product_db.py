@@ -0,0 +1,97 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from matcher import FuzzyIndex
+from product_db import ProductDB
+from receipt_processor import ReceiptProcessor
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "mock_db.json")
+
+
+def copy_db():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "db.json")
+    shutil.copy(DB_PATH, path)
+    return path
+
+
+def test_incremental_index_matches_rebuild():
+    print("Testing incremental add/remove against a full rebuild...")
+    processor = ReceiptProcessor()
+    items = processor.db['items']
+    index = FuzzyIndex(items[:-5], normalize=processor.clean_text, max_candidates=8)
+    index = index.with_added(items[-5:]).without(items[:2])
+    rebuilt = FuzzyIndex(items[2:], normalize=processor.clean_text, max_candidates=8)
+
+    queries = [processor.clean_text(item) for item in items[:4] + items[-4:]]
+    incremental = [m and m[:2] for m in index.match_many(queries, score_cutoff=85)]
+    expected = [m and m[:2] for m in rebuilt.match_many(queries, score_cutoff=85)]
+    print(f"Incremental: {incremental}")
+    assert incremental == expected
+    assert len(index) == len(rebuilt)
+
+
+def test_reload_and_edits():
+    print("\nTesting hot reload and versioned edits...")
+    path = copy_db()
+    try:
+        db = ProductDB(path, normalize=str.lower, poll_interval=0.05)
+        before = db.snapshot
+        assert before.version == 1
+
+        version = db.add('items', ["ЧОКОЛАДО МИЛКА"])
+        assert version == 2 and "ЧОКОЛАДО МИЛКА" in db.snapshot.db['items']
+        # In-flight readers keep the snapshot they started with.
+        assert "ЧОКОЛАДО МИЛКА" not in before.db['items']
+        assert json.load(open(path, encoding='utf-8'))['version'] == 2
+
+        edited = db.snapshot
+        data = json.load(open(path, encoding='utf-8'))
+        data['vendors'].append("НОВ ВЕНДОР")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        for _ in range(100):
+            if db.snapshot is not edited:
+                break
+            time.sleep(0.05)
+        print(f"Version after file edit: {db.snapshot.cache_key}")
+        # The version comes from the file; the content hash tells the edit apart.
+        assert db.version == 2 and db.snapshot.cache_key != edited.cache_key
+        # A process started now reports the same version for the same file.
+        assert ProductDB(path).snapshot.cache_key == db.snapshot.cache_key
+        assert db.snapshot.indexes['vendors'].match_many(["нов вендор"], score_cutoff=85)[0][0] == "НОВ ВЕНДОР"
+        db.stop_watching()
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+
+def test_edits_from_two_processes():
+    print("\nTesting edits from two server processes...")
+    path = copy_db()
+    try:
+        # Neither watches the file, as if the other's write landed between polls.
+        first, second = ProductDB(path), ProductDB(path)
+        first.add('items', ["ЧОКОЛАДО МИЛКА"])
+        version = second.add('items', ["ЛИМОНАДА ДОМАШНА"])
+        items = json.load(open(path, encoding='utf-8'))['items']
+        print(f"Version after both edits: {version}")
+        assert "ЧОКОЛАДО МИЛКА" in items and "ЛИМОНАДА ДОМАШНА" in items
+        assert version == 3 and "ЧОКОЛАДО МИЛКА" in second.snapshot.db['items']
+        # Both report the same version for the same content.
+        first.reload()
+        assert first.snapshot.cache_key == second.snapshot.cache_key
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    test_incremental_index_matches_rebuild()
+    test_reload_and_edits()
+    test_edits_from_two_processes()
@@ -0,0 +1,141 @@
+import sys
+import os
+import cv2
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from refinement import (DocumentNode, EarlyExitPolicy, RefinementStats, collect_documents, collect_leaves,
+                        decode_for_detection, image_size, refine_nodes, scan_images)
+
+
+class FakeMasks:
+    def __init__(self, polygons):
+        self.xy = polygons
+
+    def __len__(self):
+        return len(self.xy)
+
+
+class FakeBoxes:
+    def __init__(self, confidences):
+        self.conf = np.array(confidences, dtype=np.float32)
+
+
+class FakeResult:
+    def __init__(self, polygons, conf=0.95):
+        self.masks = FakeMasks(polygons) if polygons else None
+        self.boxes = FakeBoxes([conf] * len(polygons))
+
+
+class FakeModel:
+    """
+    Splits any image wider than 100px into its left and right halves and
+    records the batch size of every forward pass.
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, images, conf=0.5, verbose=False):
+        self.batch_sizes.append(len(images))
+        results = []
+        for image in images:
+            h, w = image.shape[:2]
+            if w > 100:
+                half = w // 2
+                results.append(FakeResult([
+                    np.array([[0, 0], [half - 1, 0], [half - 1, h - 1], [0, h - 1]], dtype=np.float32),
+                    np.array([[half, 0], [w - 1, 0], [w - 1, h - 1], [half, h - 1]], dtype=np.float32),
+                ]))
+            else:
+                results.append(FakeResult([
+                    np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32),
+                ]))
+        return results
+
+
+def test_refinement_batches_each_level():
+    print("Testing breadth-first refinement...")
+    model = FakeModel()
+    image = np.zeros((50, 400, 3), dtype=np.uint8)
+
+    roots = refine_nodes([DocumentNode(image)], model, crop_buffer=0)
+    documents = collect_documents(roots)
+
+    print(f"Batch sizes: {model.batch_sizes}, documents: {[d.shape for d in documents]}")
+    # 400 -> 2 x 200 -> 4 x 100: one forward pass per depth.
+    assert model.batch_sizes == [1, 2, 4]
+    assert [d.shape[1] for d in documents] == [100, 100, 100, 100]
+
+
+def test_scan_images_shares_batches():
+    print("\nTesting initial scan across several images...")
+    model = FakeModel()
+    images = [np.zeros((50, 200, 3), dtype=np.uint8), np.zeros((50, 80, 3), dtype=np.uint8)]
+
+    per_image_roots = scan_images(images, model, crop_buffer=0)
+    counts = [len(collect_documents(roots)) for roots in per_image_roots]
+
+    print(f"Batch sizes: {model.batch_sizes}, documents per image: {counts}")
+    assert model.batch_sizes == [2, 3]
+    assert counts == [2, 1]
+
+
+def test_early_exit_policy():
+    print("\nTesting early exit policy...")
+    policy = EarlyExitPolicy(min_confidence=0.85, min_solidity=0.9, max_overlap=0.05)
+    square = np.array([[0, 0], [99, 0], [99, 99], [0, 99]], dtype=np.float32)
+    far_square = square + 500
+    near_square = square + 60
+    l_shape = np.array([[0, 0], [99, 0], [99, 20], [20, 20], [20, 99], [0, 99]], dtype=np.float32)
+
+    assert not policy.needs_refinement(0, [square, far_square], [0.95, 0.95])
+    assert policy.needs_refinement(0, [square, far_square], [0.6, 0.95])
+    assert policy.needs_refinement(0, [square, near_square], [0.95, 0.95])
+    assert policy.needs_refinement(0, [l_shape], [0.95])
+
+    model = FakeModel()
+    stats = RefinementStats()
+    per_image_roots = scan_images([np.zeros((50, 200, 3), dtype=np.uint8)], model,
+                                  crop_buffer=0, policy=policy, stats=stats)
+    print(f"Stats: {stats.to_dict()}")
+    assert len(collect_documents(per_image_roots[0])) == 2
+    assert stats.to_dict() == {"forward_passes": 1, "skipped_passes": 2}
+
+
+def test_downscaled_detection():
+    print("Testing downscaled detection with full-resolution crops...")
+    # Four vertical bands of different brightness, 1600x800.
+    image = np.zeros((800, 1600, 3), dtype=np.uint8)
+    for band in range(4):
+        image[:, band * 400:(band + 1) * 400] = 40 + band * 60
+    data = cv2.imencode('.jpg', image)[1].tobytes()
+    assert image_size(data) == (1600, 800)
+    assert image_size(cv2.imencode('.png', image)[1].tobytes()) == (1600, 800)
+
+    detection, source, factor = decode_for_detection(data, max_side=400)
+    print(f"Detection image: {detection.shape}, factor {factor}")
+    assert factor == 4 and detection.shape == (200, 400, 3)
+
+    roots = scan_images([detection], FakeModel(), crop_buffer=0)[0]
+    leaves = collect_leaves(roots)
+    assert [leaf.box for leaf in leaves] == [(0, 0, 100, 200), (100, 0, 200, 200),
+                                             (200, 0, 300, 200), (300, 0, 400, 200)]
+    for band, leaf in enumerate(leaves):
+        crop = source.crop(leaf.box, detection.shape)
+        assert crop.shape == (800, 400, 3)
+        assert abs(float(crop[50:-50, 50:-50].mean()) - (40 + band * 60)) < 3
+
+    # Without a target size the upload is scanned at full resolution.
+    detection, source, factor = decode_for_detection(data)
+    assert factor == 1 and detection.shape == (800, 1600, 3)
+    assert decode_for_detection(b"not an image", max_side=400)[0] is None
+
+
+if __name__ == "__main__":
+    test_refinement_batches_each_level()
+    test_scan_images_shares_batches()
+    test_early_exit_policy()
+    test_downscaled_detection()
@@ -0,0 +1,72 @@
+import sys
+import os
+import tempfile
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from result_cache import ResultCache
+
+
+def test_memory_lru_eviction():
+    print("Testing memory LRU eviction by size...")
+    cache = ResultCache(memory_max_bytes=100)
+    cache.put("a", {"v": "x" * 30})
+    cache.put("b", {"v": "y" * 30})
+    cache.get("a")  # "a" is now the most recently used
+    cache.put("c", {"v": "z" * 30})
+
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert stats["memory_evictions"] == 1
+    # Peeks don't count as hits or misses.
+    counted = cache.stats()
+    assert cache.peek("c") is not None and cache.peek("b") is None
+    assert cache.stats() == counted
+
+
+def test_disk_tier_survives_restart():
+    print("\nTesting disk tier persistence...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.sqlite")
+        ResultCache(disk_path=path).put("key", {"status": "success", "documents": []})
+
+        cache = ResultCache(disk_path=path)
+        value = cache.get("key")
+        stats = cache.stats()
+        print(f"Value: {value}, stats: {stats}")
+        assert value == {"status": "success", "documents": []}
+        assert stats["disk_hits"] == 1
+        assert cache.get("key") == value
+        assert cache.stats()["memory_hits"] == 1
+        cache._db.close()
+
+
+def test_disk_tier_pruned_to_budget():
+    print("\nTesting disk tier pruning...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.sqlite")
+        cache = ResultCache(memory_max_bytes=0, disk_path=path, disk_max_bytes=1000)
+        for i in range(30):
+            cache.put(f"key{i}", {"v": "x" * 90})  # 99 bytes each
+        stats = cache.stats()
+        print(f"Stats: {stats}")
+        # Pruned down to 90% whenever the budget is exceeded, oldest first.
+        assert cache._disk_total() <= 1000
+        assert stats["disk_evictions"] == 20  # two at a time, every other put
+        assert cache.get("key0") is None and cache.get("key29") is not None
+
+        # Another process sharing the file sees the same total.
+        other = ResultCache(memory_max_bytes=0, disk_path=path, disk_max_bytes=1000)
+        assert other._disk_bytes == cache._disk_total()
+        cache._db.close()
+        other._db.close()
+
+
+if __name__ == "__main__":
+    test_memory_lru_eviction()
+    test_disk_tier_survives_restart()
+    test_disk_tier_pruned_to_budget()
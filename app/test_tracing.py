@@ -0,0 +1,61 @@
+import sys
+import os
+import logging
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+from metrics import Counter, Histogram, Registry, STAGE_SECONDS
+
+
+def test_stage_timings():
+    print("Testing per-request stage timings...")
+    before = STAGE_SECONDS.count(stage="test_stage")
+    before_worker = STAGE_SECONDS.count(stage="ocr_in_worker")
+    with tracing.trace_request("req-1") as trace:
+        for _ in range(2):
+            with tracing.stage("test_stage"):
+                time.sleep(0.01)
+        tracing.record("ocr_in_worker", 0.5, 2)
+        assert tracing.current_request_id() == "req-1"
+    assert tracing.current_trace() is None
+
+    timings = trace.to_dict()
+    print(f"Timings: {timings}")
+    assert timings["stages"]["test_stage"]["count"] == 2
+    assert timings["stages"]["test_stage"]["ms"] >= 20
+    assert timings["stages"]["ocr_in_worker"] == {"ms": 500.0, "count": 2}
+    assert STAGE_SECONDS.count(stage="ocr_in_worker") == before_worker + 2
+    assert STAGE_SECONDS.count(stage="test_stage") == before + 2
+
+    record = logging.LogRecord("test", logging.INFO, __file__, 0, "message", None, None)
+    with tracing.trace_request("req-2"):
+        tracing.RequestIdFilter().filter(record)
+    assert record.request_id == "req-2"
+
+
+def test_prometheus_format():
+    print("\nTesting Prometheus text format...")
+    registry = Registry()
+    calls = registry.register(Counter("calls_total", "Calls.", ["kind"]))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0)))
+    calls.inc(kind="a")
+    calls.inc(2, kind="a")
+    latency.observe(0.05, stage="ocr")
+    latency.observe(0.5, stage="ocr")
+    latency.observe(5.0, stage="ocr")
+
+    text = registry.render()
+    print(text)
+    assert 'calls_total{kind="a"} 3' in text
+    assert 'latency_seconds_bucket{stage="ocr",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="ocr",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{stage="ocr",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{stage="ocr"} 3' in text
+
+
+if __name__ == "__main__":
+    test_stage_timings()
+    test_prometheus_format()
@@ -0,0 +1,139 @@
+# tracing.py
+"""
+Per-request tracing of the pipeline stages.
+
+A Trace is bound to the current request (through a context variable) and
+collects how long each stage took. stage() times a block, adds it to the
+current trace (if any) and to the pipeline_stage_seconds histogram. The
+request id of the current trace is added to every log record.
+"""
+import collections
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+import uuid
+
+from metrics import STAGE_SECONDS
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        # stage -> [total seconds, number of times it ran]
+        self.stages = collections.OrderedDict()
+        # Pipeline stages of one request record from several threads.
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += count
+
+    def to_dict(self):
+        """
+        Stage times in milliseconds. A stage that ran several times (e.g. OCR on
+        every document, possibly in parallel) reports the sum and the count.
+        """
+        with self._lock:
+            stages = {name: {"ms": round(1000 * seconds, 2), "count": count}
+                      for name, (seconds, count) in self.stages.items()}
+        return {
+            "request_id": self.request_id,
+            "total_ms": round(1000 * (time.perf_counter() - self.started), 2),
+            "stages": stages,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def start_trace(request_id=None):
+    """
+    Binds a new trace to the current context. Returns (trace, token); pass the
+    token to end_trace() when the request is done.
+    """
+    trace = Trace(request_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # The server finished the request in a different context than it started it.
+        _current_trace.set(None)
+
+
+@contextlib.contextmanager
+def trace_request(request_id=None):
+    trace, token = start_trace(request_id)
+    try:
+        yield trace
+    finally:
+        end_trace(token)
+
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """
+    Re-binds an existing trace, e.g. in a streamed response body that runs
+    after the view function has returned.
+    """
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        end_trace(token)
+
+
+def record(name, seconds, count=1):
+    """
+    Records a stage duration measured elsewhere (e.g. in an OCR worker process).
+    seconds is the total of `count` runs; the histogram observes each run at
+    their mean duration.
+    """
+    for _ in range(count):
+        STAGE_SECONDS.observe(seconds / count, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds, count)
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+# --- LOGGING ---
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = current_request_id() or "-"
+        return True
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Sets up the root logger so every line carries the current request id.
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT, force=True)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
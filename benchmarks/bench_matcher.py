@@ -0,0 +1,100 @@
+# bench_matcher.py
+"""
+Benchmark for the fuzzy product matcher on synthetic catalogs.
+
+Compares the old approach (process.extractOne per line over the whole catalog)
+with the trigram-indexed, batched FuzzyIndex, and reports how often the index
+returns the same best match as a full scan.
+
+Usage (from the repository root):
+    python benchmarks/bench_matcher.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from rapidfuzz import fuzz, process
+from matcher import FuzzyIndex
+from receipt_processor import ReceiptProcessor
+
+BRANDS = ["БИТОЛСКО", "ЗДЕНКА", "ПОДРАВКА", "АРГЕТА", "ТИКВЕШ", "СКОПСКО", "ЖИТО", "ВИТАМИНКА",
+          "ПЕЛИСТЕРКА", "ГОРСКА", "ИМЛЕК", "ПЕКАБЕСКО", "БРИЛИЈАНТ", "ГРАНД", "МЕДИТЕРАН", "ФРУКТАЛ"]
+PRODUCTS = ["МЛЕКО", "ЈОГУРТ", "СИРЕЊЕ", "КАШКАВАЛ", "ЛЕБ", "КАФЕ", "ВОДА", "СОК", "ПИВО", "ВИНО",
+            "ПАШТЕТА", "САЛАМА", "КОБАСИЦА", "ЧОКОЛАДО", "БОНБОНИ", "БИСКВИТ", "СУПА", "ТЕСТЕНИНИ",
+            "ОРИЗ", "ШЕЌЕР", "БРАШНО", "МАСЛО", "ПУТЕР", "ЈАЈЦА", "ДЕТЕРГЕНТ", "ШАМПОН", "САПУН"]
+VARIANTS = ["ЛАЈТ", "КЛАСИК", "ЕКСТРА", "ДОМАШНО", "БИО", "ЗА ДЕЦА", "ПОЛНОМАСНО", "ОВОШНО",
+            "ЈАГОДА", "ВАНИЛА", "КАКАО", "ЛИМОН", "ПРИРОДНО", "ГАЗИРАНА", "НЕГАЗИРАНА", "ЦРНО", "БЕЛО"]
+SIZES = ["0.5Л", "1Л", "1.5Л", "2Л", "100ГР", "200ГР", "250ГР", "500ГР", "1КГ", "5КГ"]
+CONFUSIONS = {"О": "0", "К": "κ", "Е": "Є", "А": "Д", "И": "Н", "Л": "Д", "С": "Є", "Т": "Г"}
+
+
+def synthetic_catalog(size, seed=0):
+    rng = random.Random(seed)
+    catalog = set()
+    while len(catalog) < size:
+        catalog.add(" ".join([rng.choice(PRODUCTS), rng.choice(BRANDS), rng.choice(VARIANTS),
+                              rng.choice(SIZES), str(rng.randint(1, 9999))]))
+    return sorted(catalog)
+
+
+def noisy(text, rng, rate=0.08):
+    return "".join(CONFUSIONS.get(c, c) if rng.random() < rate else c for c in text)
+
+
+def synthetic_receipt(catalog, lines, seed=1):
+    rng = random.Random(seed)
+    receipt = [noisy(rng.choice(catalog), rng) + f" {rng.randint(10, 999)}.00" for _ in range(lines)]
+    receipt += ["ВКУПНО ЗА ПЛАЌАЊЕ", "ДДВ 18%", "БЛАГОДАРИМЕ"]
+    return receipt
+
+
+# Same normalization the ReceiptProcessor applies to OCR lines and catalog entries.
+clean = ReceiptProcessor.clean_text
+
+
+def bench(size, lines, threshold, full_scan_limit):
+    catalog = synthetic_catalog(size)
+    queries = [clean(line) for line in synthetic_receipt(catalog, lines)]
+
+    start = time.perf_counter()
+    index = FuzzyIndex(catalog, normalize=clean)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = index.match_many(queries, score_cutoff=threshold)
+    indexed_time = time.perf_counter() - start
+
+    row = {"catalog": size, "lines": len(queries), "index_build_s": round(build, 2),
+           "indexed_ms": round(1000 * indexed_time, 1)}
+
+    if size <= full_scan_limit:
+        start = time.perf_counter()
+        for q in queries:
+            process.extractOne(q, catalog, scorer=fuzz.WRatio)
+        row["extractOne_raw_ms"] = round(1000 * (time.perf_counter() - start), 1)
+
+        start = time.perf_counter()
+        full = [process.extractOne(q, index.normalized, scorer=fuzz.WRatio, score_cutoff=threshold) for q in queries]
+        row["extractOne_normalized_ms"] = round(1000 * (time.perf_counter() - start), 1)
+
+        agree = sum((f is None and i is None) or (f is not None and i is not None and i[1] >= f[1])
+                    for f, i in zip(full, indexed))
+        row["agreement_with_full_scan"] = round(agree / len(queries), 3)
+    return row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the indexed fuzzy matcher.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lines', type=int, default=30, help="Item lines per synthetic receipt")
+    parser.add_argument('--threshold', type=float, default=85)
+    parser.add_argument('--full-scan-limit', type=int, default=100000,
+                        help="Skip the slow extractOne baseline above this catalog size")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        print(bench(size, args.lines, args.threshold, args.full_scan_limit))
@@ -0,0 +1,67 @@
+# bench_receipt.py
+"""
+Micro-benchmarks for the text side of ReceiptProcessor on synthetic OCR output:
+line grouping, cleaning, database matching and highlight segments.
+
+No OCR model is needed. --catalog-size swaps the mock database for a synthetic
+catalog of that many items to see how matching scales.
+
+Usage (from the repository root):
+    python benchmarks/bench_receipt.py
+    python benchmarks/bench_receipt.py --items 80 --catalog-size 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+
+# harness puts app/ on the import path.
+from harness import measure, print_table, save_results, summarize
+from stubs import synthetic_boxes
+from receipt_processor import ReceiptProcessor
+
+
+def run(items=30, repeat=200, catalog_size=0):
+    processor = ReceiptProcessor()
+    if catalog_size:
+        from bench_matcher import synthetic_catalog
+        # A copy of the mock database with the synthetic catalog; ProductDB
+        # builds its match indexes when loading it.
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "db.json")
+            with open(db_path, 'w', encoding='utf-8') as f:
+                json.dump({**processor.db, 'items': synthetic_catalog(catalog_size)}, f, ensure_ascii=False)
+            processor = ReceiptProcessor(db_path=db_path)
+
+    boxes = synthetic_boxes(items)
+    grouped = processor._group_lines_by_y(list(boxes))
+    processed = [{"original": line, "cleaned": processor.clean_text(line)} for line in grouped]
+    matches = processor.check_database(processed)
+    raw_text = "\n".join(grouped)
+    print(f"{len(boxes)} OCR blocks -> {len(grouped)} lines, "
+          f"{len(matches['items_found'])} items matched{', vendor found' if matches['vendor'] else ''}.")
+
+    cases = {
+        "group_lines_by_y": (lambda: processor._group_lines_by_y(list(boxes)), len(boxes)),
+        "clean_text": (lambda: [processor.clean_text(line) for line in grouped], len(grouped)),
+        "check_database": (lambda: processor.check_database(processed), len(processed)),
+        "generate_segments": (lambda: processor._generate_segments(raw_text, matches), len(grouped)),
+    }
+    results = {}
+    for name, (fn, work_items) in cases.items():
+        # Throughput is per OCR block / line, the unit each function scales with.
+        results[name] = summarize(measure(fn, repeat=repeat), items_per_sample=work_items)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for receipt text processing.")
+    parser.add_argument('--items', type=int, default=30, help="Item lines in the synthetic receipt")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--catalog-size', type=int, default=0, help="Synthetic item catalog size (0 = mock DB)")
+    parser.add_argument('--output', help="JSON file for the results (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    results = run(args.items, args.repeat, args.catalog_size)
+    print_table(results)
+    save_results("receipt", results, config=vars(args), output=args.output)
@@ -0,0 +1,113 @@
+# bench_stages.py
+"""
+Stage benchmarks for the models on test_images: the YOLO scan (initial pass and
+every refinement level) and PaddleOCR on each detected document (OCR, line
+grouping, cleaning, matching).
+
+Stage times come from the same tracing hooks that feed /metrics. With --stub,
+YOLO and PaddleOCR are replaced by stubs.py (optionally with simulated latency)
+so the harness runs in CI without weights. --batch-lines reads the documents
+of each image together (see OCR_BATCH_LINES) and times them as `ocr_image`.
+
+Usage (from the repository root):
+    python benchmarks/bench_stages.py --repeat 3
+    python benchmarks/bench_stages.py --stub --stub-yolo-ms 40 --stub-ocr-ms 150
+"""
+import argparse
+import collections
+import os
+import time
+
+import cv2
+
+# harness puts app/ on the import path.
+from harness import APP_DIR, TEST_IMAGES, print_table, save_results, summarize
+import tracing
+from refinement import collect_documents, scan_images
+from stubs import StubOCR, StubYOLO
+
+CONFIDENCE_THRESHOLD = 0.5
+CROP_BUFFER = 10
+
+
+def load_images(folder):
+    images = {}
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(('.png', '.jpg', '.jpeg')):
+            image = cv2.imread(os.path.join(folder, name))
+            if image is not None:
+                images[name] = image
+    return images
+
+
+def load_models(stub, backend, stub_yolo_ms, stub_ocr_ms, batch_lines=False):
+    from receipt_processor import ReceiptProcessor
+    processor = ReceiptProcessor(batch_lines=batch_lines)
+    if stub:
+        processor.ocr = StubOCR(latency_ms=stub_ocr_ms)
+        return StubYOLO(per_image_ms=stub_yolo_ms), processor
+    from backends import load_model
+    model = load_model(os.path.join(APP_DIR, "models", "best.pt"), backend=backend)
+    return model, processor
+
+
+def run(images_dir=TEST_IMAGES, repeat=3, stub=False, backend='pytorch', stub_yolo_ms=0.0, stub_ocr_ms=0.0,
+        skip_ocr=False, batch_lines=False):
+    images = load_images(images_dir)
+    if not images:
+        raise SystemExit(f"No images found in {images_dir}")
+    model, processor = load_models(stub, backend, stub_yolo_ms, stub_ocr_ms, batch_lines)
+
+    # Warm-up: first inferences pay for lazy initialization.
+    first = next(iter(images.values()))
+    model([first], conf=CONFIDENCE_THRESHOLD, verbose=False)
+    if not skip_ocr:
+        processor.process_image(first, debug_steps=False)
+
+    samples = collections.defaultdict(list)
+    documents_seen = 0
+    for _ in range(repeat):
+        for name, image in images.items():
+            with tracing.trace_request() as trace:
+                start = time.perf_counter()
+                roots = scan_images([image], model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER)[0]
+                samples["yolo_scan"].append(time.perf_counter() - start)
+                documents = collect_documents(roots) if roots else []
+                documents_seen += len(documents)
+
+                if not skip_ocr and batch_lines:
+                    if documents:
+                        start = time.perf_counter()
+                        processor.process_images(documents, debug_steps=False)
+                        samples["ocr_image"].append(time.perf_counter() - start)
+                elif not skip_ocr:
+                    for document in documents:
+                        start = time.perf_counter()
+                        processor.process_image(document, debug_steps=False)
+                        samples["ocr_document"].append(time.perf_counter() - start)
+
+            for stage, (seconds, count) in trace.stages.items():
+                # Per-call average, so a stage that ran for several documents is comparable.
+                samples[f"stage:{stage}"].extend([seconds / count] * count)
+
+    print(f"{len(images)} images x {repeat} runs, {documents_seen / repeat:.0f} documents per run.")
+    return {name: summarize(values) for name, values in sorted(samples.items())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the YOLO and OCR stages on test images.")
+    parser.add_argument('--images', default=TEST_IMAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', choices=['pytorch', 'onnx', 'openvino'], default='pytorch')
+    parser.add_argument('--stub', action='store_true', help="Use stub models (no weights needed)")
+    parser.add_argument('--stub-yolo-ms', type=float, default=0.0, help="Simulated YOLO latency per image")
+    parser.add_argument('--stub-ocr-ms', type=float, default=0.0, help="Simulated OCR latency per document")
+    parser.add_argument('--skip-ocr', action='store_true')
+    parser.add_argument('--batch-lines', action='store_true', help="Recognize the lines of all documents together")
+    parser.add_argument('--output', help="JSON file for the results (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    results = run(args.images, args.repeat, args.stub, args.backend, args.stub_yolo_ms, args.stub_ocr_ms,
+                  args.skip_ocr, args.batch_lines)
+    print_table(results)
+    save_results("stages", results, config=vars(args), output=args.output)
@@ -0,0 +1,60 @@
+# compare.py
+"""
+Compares two benchmark result files (e.g. from two commits) case by case.
+
+Usage (from the repository root):
+    python benchmarks/compare.py benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(old, new):
+    if old is None or new is None:
+        return "-"
+    if not old:
+        return "n/a"
+    return f"{100 * (new - old) / old:+.1f}%"
+
+
+def compare(old, new, metrics=METRICS):
+    """
+    Returns rows of (case, metric, old value, new value, relative change) for
+    every case present in either file.
+    """
+    rows = []
+    cases = list(old["results"]) + [case for case in new["results"] if case not in old["results"]]
+    for case in cases:
+        before = old["results"].get(case, {})
+        after = new["results"].get(case, {})
+        for metric in metrics:
+            a, b = before.get(metric), after.get(metric)
+            if a is not None or b is not None:
+                rows.append((case, metric, a, b, change(a, b)))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    if old.get("benchmark") != new.get("benchmark"):
+        print(f"Warning: comparing '{old.get('benchmark')}' with '{new.get('benchmark')}' results.")
+    print(f"old: {old['environment'].get('commit')}  new: {new['environment'].get('commit')}\n")
+
+    rows = compare(old, new)
+    width = max([len(case) for case, *_ in rows] + [10])
+    print(f"{'case':<{width}}  {'metric':<16}  {'old':>12}  {'new':>12}  {'change':>8}")
+    for case, metric, a, b, delta in rows:
+        print(f"{case:<{width}}  {metric:<16}  {str(a if a is not None else '-'):>12}  "
+              f"{str(b if b is not None else '-'):>12}  {delta:>8}")
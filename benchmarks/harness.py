@@ -0,0 +1,119 @@
+# harness.py
+"""
+Shared helpers for the benchmarks: timing loops, latency percentiles and JSON
+result files.
+
+Every benchmark saves its results (with the git commit and machine details) to
+benchmarks/results/, so runs on different commits can be compared with
+`python benchmarks/compare.py OLD.json NEW.json`.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_DIR = os.path.join(REPO_DIR, "app")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+TEST_IMAGES = os.path.join(REPO_DIR, "test_images")
+
+if APP_DIR not in sys.path:
+    sys.path.append(APP_DIR)
+
+
+def measure(fn, repeat=100, warmup=5):
+    """
+    Calls fn() warmup + repeat times and returns the durations (seconds) of the
+    timed calls.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples, items_per_sample=1, wall_seconds=None):
+    """
+    Latency percentiles (milliseconds) and throughput for a list of durations.
+
+    Args:
+        samples (list): Durations in seconds.
+        items_per_sample (int): Work items per sample (e.g. lines per call),
+            used for the throughput.
+        wall_seconds (float, optional): Elapsed wall time when the samples ran
+            concurrently; throughput is computed against it instead of their sum.
+    """
+    if not samples:
+        return {"runs": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    elapsed = wall_seconds if wall_seconds is not None else float(np.sum(samples))
+    return {
+        "runs": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(samples) * items_per_sample / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(name, results, config=None, output=None):
+    """
+    Writes a benchmark's results to JSON and returns the file path.
+
+    Args:
+        name (str): Benchmark name, used in the default file name.
+        results (dict): Benchmark case -> summary dict.
+        config (dict, optional): Parameters the benchmark ran with.
+        output (str, optional): File path; defaults to
+            benchmarks/results/<name>-<commit>-<timestamp>.json.
+    """
+    env = environment()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}-{env['commit'] or 'nogit'}-{stamp}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": name, "environment": env, "config": config or {}, "results": results},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {output}")
+    return output
+
+
+def print_table(results):
+    columns = ("runs", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "throughput_per_s")
+    width = max([len(name) for name in results] + [10])
+    print(f"{'case':<{width}}  " + "  ".join(f"{c:>16}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{row.get(c, '-'):>16}" for c in columns))
@@ -0,0 +1,149 @@
+# load_test.py
+"""
+HTTP load generator for /segment.
+
+Sends --requests uploads with --concurrency in flight and reports throughput,
+latency percentiles and status codes. With --stream the response is read as
+NDJSON and the time to the first byte (the scan progress event) is reported
+as well.
+
+Every upload gets a unique nonce appended after the image data unless
+--allow-cache is set, so the result cache doesn't answer repeated uploads.
+
+--stub-server starts the app in this process with stub models (stubs.py) on a
+free port, so the HTTP, batching and OCR plumbing can be load-tested in CI.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --url http://localhost:5000 --concurrency 8 --requests 200
+    python benchmarks/load_test.py --stub-server --stub-yolo-ms 40 --stub-ocr-ms 150 --mode ocr
+"""
+import argparse
+import collections
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# harness puts app/ on the import path.
+from harness import TEST_IMAGES, print_table, save_results, summarize
+from stubs import StubOCR, StubYOLO
+
+
+def load_payloads(images_dir):
+    payloads = []
+    for name in sorted(os.listdir(images_dir)):
+        if name.lower().endswith(('.png', '.jpg', '.jpeg')):
+            with open(os.path.join(images_dir, name), "rb") as f:
+                payloads.append((name, f.read()))
+    if not payloads:
+        raise SystemExit(f"No images found in {images_dir}")
+    return payloads
+
+
+def with_nonce(data):
+    # Decoders ignore bytes after the end of the image, but the content hash changes.
+    return data + b"\0nonce:" + uuid.uuid4().bytes
+
+
+def send(session, url, name, data, form, stream):
+    """
+    Uploads one image. Returns (status, seconds, seconds to first byte or None).
+    """
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        response = session.post(url, files={"file": (name, data)}, data=form, stream=stream, timeout=600)
+        if stream:
+            # Raw chunks: iter_lines() is quadratic on the multi-megabyte crop events.
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if chunk and first_byte is None:
+                    first_byte = time.perf_counter() - start
+        else:
+            response.content
+        status = str(response.status_code)
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start, first_byte
+
+
+def run(url, concurrency=4, total=50, mode='segment', response_mode='inline', stream=False,
+        allow_cache=False, images_dir=TEST_IMAGES):
+    payloads = load_payloads(images_dir)
+    form = {"mode": mode, "response": response_mode}
+    if stream:
+        form["stream"] = "ndjson"
+    endpoint = url.rstrip("/") + "/segment"
+
+    local = threading.local()
+
+    def one(i):
+        # requests.Session is not thread-safe; each load thread keeps its own connection.
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        name, data = payloads[i % len(payloads)]
+        return send(local.session, endpoint, name, data if allow_cache else with_nonce(data), form, stream)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    statuses = collections.Counter(status for status, _, _ in outcomes)
+    ok = [seconds for status, seconds, _ in outcomes if status == "200"]
+    results = {"requests": summarize(ok, wall_seconds=wall)}
+    if stream:
+        results["first_byte"] = summarize([first for status, _, first in outcomes
+                                           if status == "200" and first is not None], wall_seconds=wall)
+    print(f"{total} requests, concurrency {concurrency}, {wall:.2f}s wall, statuses: {dict(statuses)}")
+    return results, dict(statuses)
+
+
+# --- STUB SERVER ---
+
+def start_stub_server(stub_yolo_ms=0.0, stub_ocr_ms=0.0, port=0):
+    """
+    Serves the app from a background thread with stub models. Returns the base URL.
+    """
+    # Keep the benchmark from reading or filling the on-disk result cache.
+    os.environ.setdefault("RESULT_CACHE_DISK_PATH", "")
+    from werkzeug.serving import make_server
+    import app as api
+    from receipt_processor import ReceiptProcessor
+
+    def load_processor():
+        # In-process OCR: the stub can't be sent to the worker pool.
+        processor = ReceiptProcessor(lang='mk', ocr_workers=1, db_poll_interval=0)
+        processor.ocr = StubOCR(latency_ms=stub_ocr_ms)
+        return processor
+
+    api.models.register("yolo", lambda: StubYOLO(per_image_ms=stub_yolo_ms))
+    api.models.register("ocr", load_processor)
+    server = make_server("127.0.0.1", port, api.create_app(preload='blocking'), threaded=True)
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the /segment endpoint.")
+    parser.add_argument('--url', default="http://localhost:5000")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--mode', choices=['segment', 'ocr'], default='segment')
+    parser.add_argument('--response', choices=['inline', 'url'], default='inline')
+    parser.add_argument('--stream', action='store_true', help="Request NDJSON and time the first byte")
+    parser.add_argument('--allow-cache', action='store_true', help="Send identical uploads (cache hits)")
+    parser.add_argument('--images', default=TEST_IMAGES)
+    parser.add_argument('--stub-server', action='store_true', help="Start the app in-process with stub models")
+    parser.add_argument('--stub-yolo-ms', type=float, default=0.0, help="Simulated YOLO latency per image")
+    parser.add_argument('--stub-ocr-ms', type=float, default=0.0, help="Simulated OCR latency per document")
+    parser.add_argument('--output', help="JSON file for the results (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    url = start_stub_server(args.stub_yolo_ms, args.stub_ocr_ms) if args.stub_server else args.url
+    results, statuses = run(url, args.concurrency, args.requests, args.mode, args.response, args.stream,
+                            args.allow_cache, args.images)
+    print_table(results)
+    save_results("load", results, config=dict(vars(args), statuses=statuses), output=args.output)
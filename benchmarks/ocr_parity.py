@@ -0,0 +1,106 @@
+# ocr_parity.py
+"""
+Accuracy parity check for OCR settings on test_images.
+
+Every document YOLO finds in the test images is read twice: by a baseline
+ReceiptProcessor and by one with the settings under test (--text-height,
+--batch-lines, --orient-documents). Per document it prints how similar the
+two texts are, whether the vendor and items matched agree, and the candidate's
+scale factor; OCR latency of both runs is summarized as in the other
+benchmarks. Exits with status 1 if the mean text similarity is below
+--min-similarity.
+
+With --stub the OCR output doesn't depend on the pixels, so only the plumbing
+is exercised; run it with the real models to validate a setting.
+
+Usage (from the repository root):
+    python benchmarks/ocr_parity.py --text-height 32
+    python benchmarks/ocr_parity.py --text-height 32 --batch-lines --orient-documents
+"""
+import argparse
+import sys
+import time
+
+from rapidfuzz import fuzz
+
+# harness puts app/ on the import path.
+from harness import TEST_IMAGES, print_table, save_results, summarize
+from bench_stages import CONFIDENCE_THRESHOLD, CROP_BUFFER, load_images, load_models
+from receipt_processor import ReceiptProcessor
+from refinement import collect_documents, scan_images
+from stubs import StubOCR
+
+
+def load_documents(images_dir, model):
+    documents = []
+    for name, image in load_images(images_dir).items():
+        roots = scan_images([image], model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER)[0]
+        for index, document in enumerate(collect_documents(roots) if roots else [], start=1):
+            documents.append((f"{name}#{index}", document))
+    return documents
+
+
+def matched_names(result):
+    matches = result.get("matches") or {}
+    vendor = (matches.get("vendor") or {}).get("name")
+    return vendor, sorted(item["name"] for item in matches.get("items_found", []))
+
+
+def run(images_dir=TEST_IMAGES, stub=False, backend='pytorch', text_height=0, batch_lines=False,
+        orient_documents=False):
+    model, baseline = load_models(stub, backend, 0.0, 0.0)
+    candidate = ReceiptProcessor(text_height=text_height, batch_lines=batch_lines,
+                                 orient_documents=orient_documents)
+    if stub:
+        candidate.ocr = StubOCR()
+    documents = load_documents(images_dir, model)
+    if not documents:
+        raise SystemExit(f"No documents found in {images_dir}")
+
+    # Warm-up: first inferences pay for lazy initialization.
+    for processor in (baseline, candidate):
+        processor.process_image(documents[0][1], debug_steps=False)
+
+    samples = {"ocr:baseline": [], "ocr:candidate": []}
+    rows = []
+    for name, document in documents:
+        outputs = {}
+        for label, processor in (("baseline", baseline), ("candidate", candidate)):
+            start = time.perf_counter()
+            outputs[label] = processor.process_image(document, debug_steps=False)
+            samples[f"ocr:{label}"].append(time.perf_counter() - start)
+        similarity = fuzz.ratio(outputs["baseline"]["raw_text"], outputs["candidate"]["raw_text"])
+        same_matches = matched_names(outputs["baseline"]) == matched_names(outputs["candidate"])
+        scale = outputs["candidate"].get("scaling", {}).get("scale")
+        print(f"{name:<20} similarity {similarity:6.1f}  matches {'same' if same_matches else 'DIFFER':<6}  "
+              f"scale {scale}")
+        rows.append({"document": name, "similarity": round(similarity, 1), "same_matches": same_matches,
+                     "scale": scale})
+
+    mean_similarity = sum(row["similarity"] for row in rows) / len(rows)
+    same = sum(row["same_matches"] for row in rows)
+    print(f"\n{len(rows)} documents: mean text similarity {mean_similarity:.1f}, "
+          f"same matches on {same}/{len(rows)}.")
+    results = {name: summarize(values) for name, values in samples.items()}
+    return results, rows, mean_similarity
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare OCR output with and without new OCR settings.")
+    parser.add_argument('--images', default=TEST_IMAGES)
+    parser.add_argument('--backend', choices=['pytorch', 'onnx', 'openvino'], default='pytorch')
+    parser.add_argument('--stub', action='store_true', help="Use stub models (no weights needed)")
+    parser.add_argument('--text-height', type=int, default=0, help="Target text height for the candidate")
+    parser.add_argument('--batch-lines', action='store_true')
+    parser.add_argument('--orient-documents', action='store_true')
+    parser.add_argument('--min-similarity', type=float, default=95.0)
+    parser.add_argument('--output', help="JSON file for the results (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    results, rows, mean_similarity = run(args.images, args.stub, args.backend, args.text_height,
+                                         args.batch_lines, args.orient_documents)
+    print_table(results)
+    save_results("ocr_parity", results, config=dict(vars(args), documents=rows, mean_similarity=mean_similarity),
+                 output=args.output)
+    if mean_similarity < args.min_similarity:
+        sys.exit(1)
@@ -0,0 +1,136 @@
+# stubs.py
+"""
+Stand-ins for YOLO and PaddleOCR so the benchmarks (and the load test server)
+run in CI without model weights or the heavy ML packages.
+
+They return results shaped like the real libraries' and can sleep to simulate
+inference latency, so the pipeline code around them is exercised as usual.
+"""
+import random
+import time
+
+import numpy as np
+
+PRODUCT_LINES = [
+    ("МЛЕКО БИТОЛСКО 3.2%", "75.00"), ("ЈОГУРТ БИТОЛСКИ 500гр", "45.00"), ("ЛЕБ БЕЛ СЕЧЕН", "30,00"),
+    ("КАШКАВАЛ АЈДАМЕР", "289.00"), ("КОКА КОЛА 1.5Л", "89.00"), ("ПИВО СКОПСКО 0.5Л", "65.00"),
+    ("КАФЕ ГРАНД 200гр", "155.00"), ("ЧОКОЛАДО МИЛКА", "99.00"), ("ВОДА ГОРСКА 1.5Л", "29.00"),
+    ("ПАШТЕТА ЗДЕНКА", "55.00"), ("ТЕСТЕНИНИ ПОДРАВКА", "72.00"), ("ДЕТЕРГЕНТ АРИЕЛ", "499.00"),
+]
+HEADER_LINES = ["КАМ МАРКЕТ", "ДДВ БРОЈ 4030000000000", "СКОПЈЕ"]
+FOOTER_LINES = ["ВКУПНО ЗА ПЛАЌАЊЕ", "ДДВ 18%", "БЛАГОДАРИМЕ"]
+
+
+def synthetic_ocr_lines(num_items=30, width=600, line_height=22, seed=0):
+    """
+    Builds PaddleOCR-style output for a receipt: one [box, (text, conf)] entry per
+    word group, with product names on the left, prices on the right and a few
+    pixels of vertical jitter between blocks of the same line.
+    """
+    rng = random.Random(seed)
+    rows = [[(text, None)] for text in HEADER_LINES]
+    rows += [[(name, None), (price, None)] for name, price in (rng.choice(PRODUCT_LINES) for _ in range(num_items))]
+    rows += [[(text, None)] for text in FOOTER_LINES]
+
+    entries = []
+    for row, blocks in enumerate(rows):
+        y = 20 + row * (line_height + 8)
+        for col, (text, _) in enumerate(blocks):
+            x1 = 10 if col == 0 else width - 110
+            x2 = x1 + min(width - 20, 12 * len(text)) if col == 0 else width - 10
+            dy = rng.randint(-3, 3)
+            box = [[x1, y + dy], [x2, y + dy], [x2, y + dy + line_height], [x1, y + dy + line_height]]
+            entries.append([box, (text, round(rng.uniform(0.85, 0.99), 3))])
+    rng.shuffle(entries)
+    return entries
+
+
+def synthetic_boxes(num_items=30, seed=0):
+    """
+    The same synthetic receipt as ReceiptProcessor's intermediate OCR blocks.
+    """
+    return [{"box": box, "text": text, "conf": conf}
+            for box, (text, conf) in synthetic_ocr_lines(num_items, seed=seed)]
+
+
+class StubOCR:
+    """
+    Mimics PaddleOCR.ocr(): returns a synthetic receipt sized to the image, its
+    boxes only (det=True, rec=False), or per line crop (det=False, image is
+    [[crops]]) a product name. text_classifier() labels every crop upright.
+    """
+
+    def __init__(self, latency_ms=0.0, num_items=20):
+        self.latency = latency_ms / 1000.0
+        self.num_items = num_items
+
+    def ocr(self, image, det=True, rec=True, cls=True):
+        if self.latency:
+            time.sleep(self.latency)
+        if not det:
+            return [[(random.Random(crop.shape[1]).choice(PRODUCT_LINES)[0], 0.95) for crop in image[0]]]
+        entries = synthetic_ocr_lines(self.num_items, width=max(200, image.shape[1]), seed=int(image.shape[0]))
+        return [entries if rec else [box for box, _ in entries]]
+
+    def text_classifier(self, crops):
+        if self.latency:
+            time.sleep(self.latency)
+        return crops, [['0', 0.99] for _ in crops], self.latency
+
+
+# --- YOLO ---
+
+class _Masks:
+    def __init__(self, polygons):
+        self.xy = polygons
+
+    def __len__(self):
+        return len(self.xy)
+
+
+class _Boxes:
+    def __init__(self, confidences):
+        self.conf = np.array(confidences, dtype=np.float32)
+
+
+class _Result:
+    def __init__(self, polygons, conf):
+        self.masks = _Masks(polygons) if polygons else None
+        self.boxes = _Boxes([conf] * len(polygons))
+
+
+class StubYOLO:
+    """
+    Mimics an ultralytics segmentation model. Images wider than `split_width`
+    contain two side-by-side documents; anything narrower is one document.
+    Each call sleeps `latency_ms` plus `per_image_ms` for every image.
+    """
+
+    def __init__(self, latency_ms=0.0, per_image_ms=0.0, split_width=800, conf=0.95):
+        self.latency = latency_ms / 1000.0
+        self.per_image = per_image_ms / 1000.0
+        self.split_width = split_width
+        self.conf = conf
+
+    def __call__(self, images, conf=0.5, verbose=False, **kwargs):
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        if self.latency or self.per_image:
+            time.sleep(self.latency + self.per_image * len(images))
+        results = []
+        for image in images:
+            h, w = image.shape[:2]
+            margin = max(1, min(h, w) // 50)
+            if w > self.split_width:
+                half = w // 2
+                polygons = [
+                    np.array([[margin, margin], [half - margin, margin], [half - margin, h - margin],
+                              [margin, h - margin]], dtype=np.float32),
+                    np.array([[half + margin, margin], [w - margin, margin], [w - margin, h - margin],
+                              [half + margin, h - margin]], dtype=np.float32),
+                ]
+            else:
+                polygons = [np.array([[margin, margin], [w - margin, margin], [w - margin, h - margin],
+                                      [margin, h - margin]], dtype=np.float32)]
+            results.append(_Result(polygons, self.conf))
+        return results
@@ -2,12 +2,35 @@ import React, { useState, useCallback, useRef } from 'react';
 import './App.css';
 import { ReactComponent as UploadIcon } from './upload-icon.svg'; // We'll create this icon file next
 
+const API_BASE = 'http://127.0.0.1:5000';
+
+// Crops come back either inline (base64) or as a URL into the server's blob store.
+const imageSrc = (item) => item.url ? `${API_BASE}${item.url}` : `data:image/jpeg;base64,${item.data || item.image}`;
+
+// Reads an NDJSON response body and calls onEvent for every line as it arrives.
+const readEvents = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // keep the incomplete last line for the next chunk
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+};
+
 function App() {
     const [documents, setDocuments] = useState([]);
     const [isLoading, setIsLoading] = useState(false);
     const [error, setError] = useState(null);
     const [isDragActive, setIsDragActive] = useState(false);
     const [processMode, setProcessMode] = useState('segment'); // 'segment' or 'ocr'
+    const [debugSteps, setDebugSteps] = useState(false); // request OCR processing step images
+    const [progress, setProgress] = useState(null); // { total, read } while a stream is running
     const fileInputRef = useRef(null); // Create a ref for the file input
 
     // This function handles the API call
@@ -20,13 +43,56 @@ function App() {
         setIsLoading(true);
         setError(null);
         setDocuments([]);
+        setProgress(null);
 
         const formData = new FormData();
         formData.append('file', file);
         formData.append('mode', processMode);
+        formData.append('response', 'url');
+        formData.append('debug_steps', debugSteps ? 'true' : 'false');
+        formData.append('stream', 'ndjson');
+
+        const withOcr = processMode === 'ocr';
+
+        // Documents are shown as soon as their crop arrives; OCR results fill them in later.
+        const handleEvent = (event) => {
+            switch (event.event) {
+                case 'progress':
+                    setProgress({ total: event.documents, read: 0 });
+                    if (event.documents === 0) {
+                        setError("No documents were detected in the uploaded image.");
+                    }
+                    break;
+                case 'document':
+                    setDocuments(prev => {
+                        const next = [...prev];
+                        next[event.index] = { ...event.document, pending: withOcr };
+                        return next;
+                    });
+                    break;
+                case 'ocr':
+                    setDocuments(prev => {
+                        const next = [...prev];
+                        next[event.index] = {
+                            ...next[event.index],
+                            receipt_data: event.receipt_data,
+                            extracted_text: event.extracted_text,
+                            matches: event.matches,
+                            pending: false,
+                        };
+                        return next;
+                    });
+                    setProgress(prev => prev && { ...prev, read: prev.read + 1 });
+                    break;
+                case 'error':
+                    throw new Error(event.message || 'An unknown error occurred during processing.');
+                default:
+                    break;
+            }
+        };
 
         try {
-            const response = await fetch('http://127.0.0.1:5000/segment', {
+            const response = await fetch(`${API_BASE}/segment`, {
                 method: 'POST',
                 body: formData,
             });
@@ -36,22 +102,14 @@ function App() {
                 throw new Error(errorData.message);
             }
 
-            const result = await response.json();
-
-            if (result.status === 'success') {
-                setDocuments(result.documents || []);
-                if (result.documents.length === 0) {
-                    setError("No documents were detected in the uploaded image.");
-                }
-            } else {
-                throw new Error(result.message || 'An unknown error occurred during processing.');
-            }
+            await readEvents(response, handleEvent);
 
         } catch (err) {
             console.error("Processing error:", err);
             setError(err.message);
         } finally {
             setIsLoading(false);
+            setProgress(null);
         }
     };
 
@@ -59,6 +117,7 @@ function App() {
     const handleClear = () => {
         setDocuments([]);
         setError(null);
+        setProgress(null);
         // Also reset the file input so the same file can be re-uploaded
         if (fileInputRef.current) {
             fileInputRef.current.value = "";
@@ -140,6 +199,16 @@ function App() {
                         <option value="segment">Only Segment (Fast)</option>
                         <option value="ocr">Segment + OCR (PaddleOCR)</option>
                     </select>
+                    {processMode === 'ocr' && (
+                        <label className="debug-toggle">
+                            <input
+                                type="checkbox"
+                                checked={debugSteps}
+                                onChange={(e) => setDebugSteps(e.target.checked)}
+                            />
+                            Include processing steps
+                        </label>
+                    )}
                 </div>
 
                 {showResultsArea && (
@@ -154,11 +223,17 @@ function App() {
                         </div>
 
                         {isLoading && <div className="loader"></div>}
+                        {isLoading && progress && progress.total > 0 && (
+                            <p className="progress-message">
+                                Found {progress.total} document{progress.total === 1 ? '' : 's'}
+                                {processMode === 'ocr' && ` — read ${progress.read} of ${progress.total}`}
+                            </p>
+                        )}
                         {error && !isLoading && <p className="error-message">{error}</p>}
 
                         <div className="results-grid">
-                            {documents.map((doc, index) => (
-                                <ResultItem key={index} doc={doc} />
+                            {documents.filter(Boolean).map((doc, index) => (
+                                <ResultItem key={doc.filename || index} doc={doc} />
                             ))}
                         </div>
                     </div>
@@ -176,13 +251,13 @@ function ResultItem({ doc }) {
             <div className="result-column">
                 <div className="result-image-container">
                     <img
-                        src={`data:image/jpeg;base64,${doc.data}`}
+                        src={imageSrc(doc)}
                         alt={doc.filename}
                     />
                     <span className="filename-tag">{doc.filename}</span>
                 </div>
 
-                {doc.receipt_data && doc.receipt_data.processing_steps && (
+                {doc.receipt_data && doc.receipt_data.processing_steps && doc.receipt_data.processing_steps.length > 0 && (
                     <div className="debug-section">
                         <button
                             className="toggle-debug-btn"
@@ -197,7 +272,7 @@ function ResultItem({ doc }) {
                                     <div key={sIdx} className="step-item">
                                         <span className="step-name">{step.name}</span>
                                         <img
-                                            src={`data:image/jpeg;base64,${step.image}`}
+                                            src={imageSrc(step)}
                                             alt={step.name}
                                         />
                                     </div>
@@ -219,7 +294,9 @@ function ResultItem({ doc }) {
                 <div className="text-content">
                     <h4>Extracted Text</h4>
                     <div className="raw-text">
-                        {doc.receipt_data && doc.receipt_data.text_segments ? (
+                        {doc.pending ? (
+                            <span className="pending-text">Reading text...</span>
+                        ) : doc.receipt_data && doc.receipt_data.text_segments ? (
                             doc.receipt_data.text_segments.map((seg, sIdx) => (
                                 <span
                                     key={sIdx}
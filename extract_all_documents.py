@@ -1,154 +1,339 @@
-import cv2
+"""
+Batch extraction of every document found in a folder of images.
+
+Images go through the same staged document pipeline as the API's batch
+endpoint (app/document_pipeline.py): decode threads read images ahead of the
+model, detect threads share YOLO forward passes (several images at a time), and
+write threads save the crops as JPEGs, all at once. A JSONL manifest in
+the output folder records the outcome of every image, so an interrupted run can
+simply be started again: images already completed (and unchanged since) are
+skipped.
+
+Usage:
+    python extract_all_documents.py --input test_images --output extracted_documents_verified
+    python extract_all_documents.py --input scans --recursive --batch-size 16
+    python extract_all_documents.py --overwrite   # start from scratch
+"""
+import argparse
+import collections
+import json
 import os
-import numpy as np
-from ultralytics import YOLO
+import sys
 import shutil
+import time
+
+import cv2
+
+# The refinement engine lives next to the API so both entry points share it.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from backends import BACKENDS, load_model
+from document_pipeline import DocumentPipeline, UndecodableImage
+from tracing import trace_request
 
 # --- CONFIGURATION ---
 # IMPORTANT: Update this path to point to your best trained model weights.
 MODEL_PATH = "Document_Segmentation_Results/run_1_fixed/weights/best.pt"
 
+# Inference backend: 'pytorch', 'onnx' or 'openvino' (exported next to MODEL_PATH on first use).
+MODEL_BACKEND = "pytorch"
+
 # Folder containing the images you want to process.
 IMAGE_FOLDER = "test_images"
 
 # Main folder where subfolders for each processed image will be created.
 OUTPUT_FOLDER = "extracted_documents_verified"
 
+# Per-image status, kept in the output folder so reruns resume where they stopped.
+MANIFEST_NAME = "manifest.jsonl"
+
 # --- ADVANCED CONFIGURATION ---
 # Confidence threshold for the model. Detections below this will be ignored.
-CONFIDENCE_THRESHOLD = 0.5 
+CONFIDENCE_THRESHOLD = 0.5
 
 # Add a small pixel buffer around the cropped documents to prevent cutting off edges.
 CROP_BUFFER = 10 # Increased buffer slightly for better cropping
 
+# Images scanned together in one YOLO batch (their crops are refined together too).
+BATCH_SIZE = 8
+
+# Threads decoding images ahead of the model, and threads writing JPEGs.
+# (The pipeline's queues hold at most a few images between the stages.)
+DECODE_WORKERS = 4
+WRITE_WORKERS = 4
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Manifest statuses that count as finished; 'failed' images are retried.
+COMPLETED_STATUSES = ('done', 'empty', 'unreadable')
+
 # --- CORE FUNCTIONS ---
 
-def refine_and_save(image_crop, model, output_path_prefix, doc_counter):
+def name_documents(node, output_path_prefix, doc_counter, documents):
     """
-    Recursively analyzes an image crop. If the crop contains more than one document,
-    it splits them and refines each piece. If it contains only one, it saves it.
+    Walks a refinement tree depth-first and names every final document.
 
     Args:
-        image_crop (np.ndarray): The cropped image segment to analyze.
-        model (YOLO): The loaded YOLO segmentation model.
+        node (DocumentNode): A refined crop, as produced by the refinement engine.
         output_path_prefix (str): The base path and name for saving files (e.g., "output/image1/image1").
         doc_counter (int): The current document number for unique naming.
+        documents (list): Receives a (save_path, image) pair per final document.
 
     Returns:
-        int: The updated document counter after processing.
+        int: The updated document counter.
     """
-    if image_crop.size == 0:
+    if node.image.size == 0:
         print("  - Warning: Received an empty image crop for refinement.")
         return doc_counter
 
-    print(f"  - Refining potential document...")
-    
-    # Run the model on the specific crop
-    results = model(image_crop, conf=CONFIDENCE_THRESHOLD)
-    
-    # Check for detected masks within the crop
-    masks = results[0].masks
-    
-    # CASE 1: Composite Document Found (more than 1 mask)
-    # This is the core of the multi-check. The crop is not a single document.
-    if masks and len(masks) > 1:
-        print(f"    - Composite document detected. Found {len(masks)} sub-documents. Splitting...")
-        
-        # For each new mask found inside the crop, create a new, smaller crop
-        sub_doc_index = 1
-        for polygon in masks.xy:
-            x, y, w, h = cv2.boundingRect(np.array(polygon, dtype=np.int32))
-            
-            # Crop the sub-document from the *current* image_crop
-            sub_crop = image_crop[
-                max(0, y - CROP_BUFFER): y + h + CROP_BUFFER,
-                max(0, x - CROP_BUFFER): x + w + CROP_BUFFER
-            ]
-            
-            # Recursively call the refinement function on the new, smaller piece
-            # Pass the original doc_counter to be used as a base for naming
+    # CASE 1: Composite Document Found - name each sub-document under its own prefix
+    if not node.is_leaf:
+        for sub_doc_index, child in enumerate(node.children, start=1):
             new_prefix = f"{output_path_prefix}_doc_{doc_counter}_sub_{sub_doc_index}"
-            doc_counter = refine_and_save(sub_crop, model, new_prefix, doc_counter)
-            sub_doc_index += 1
-            
-    # CASE 2: Single or No Document Found
-    # This is the base case. The crop is considered final and should be saved.
+            doc_counter = name_documents(child, new_prefix, doc_counter, documents)
+
+    # CASE 2: Single or No Document Found - the crop is final and should be saved.
     else:
-        print(f"    - Verified as a single document. Saving.")
-        final_save_path = f"{output_path_prefix}_doc_{doc_counter}.jpg"
-        cv2.imwrite(final_save_path, image_crop)
-        print(f"      ✔ Saved final document to: {final_save_path}")
+        documents.append((f"{output_path_prefix}_doc_{doc_counter}.jpg", node.image))
         doc_counter += 1
-        
+
     return doc_counter
 
 
-def extract_and_verify_documents():
+def write_document(save_path, image):
+    if not cv2.imwrite(save_path, image):
+        raise IOError(f"Could not write '{save_path}'")
+    return save_path
+
+
+# --- BATCH PIPELINE ---
+
+def find_images(image_folder, recursive=False):
+    """
+    Returns the paths of all images in the folder (relative to it), sorted.
+    """
+    if not recursive:
+        names = [name for name in os.listdir(image_folder) if os.path.isfile(os.path.join(image_folder, name))]
+    else:
+        names = []
+        for root, dirs, files in os.walk(image_folder):
+            dirs.sort()
+            rel_root = os.path.relpath(root, image_folder)
+            names.extend(os.path.normpath(os.path.join(rel_root, name)) for name in files)
+    return sorted(name for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_folders(names, recorded=None):
     """
-    Main function to load the model and process all images. It performs an
-    initial scan and then passes each finding to a recursive refinement process.
+    Picks the output subfolder of every image: its name without the
+    extension. Images that would share one (a.jpg and a.png) get their
+    extension as a suffix, except the first in sorted order (a/, a_png/).
+
+    Args:
+        recorded (dict, optional): Folders of already extracted images (from
+            the manifest); they keep them and no other image gets them.
+
+    Returns:
+        dict: image name -> folder, relative to the output folder.
     """
-    # Clean and create the main output directory
-    if os.path.exists(OUTPUT_FOLDER):
-        shutil.rmtree(OUTPUT_FOLDER)
-    os.makedirs(OUTPUT_FOLDER)
-
-    # Check for model and image folder
-    if not os.path.exists(MODEL_PATH):
-        print(f"ERROR: Model file not found at '{MODEL_PATH}'")
-        return
-    if not os.path.exists(IMAGE_FOLDER):
-        print(f"Error: The folder '{IMAGE_FOLDER}' does not exist.")
-        return
-        
-    print(f"Loading model from: {MODEL_PATH}")
-    model = YOLO(MODEL_PATH)
-
-    # Process each image in the source folder
-    for image_name in os.listdir(IMAGE_FOLDER):
-        image_path = os.path.join(IMAGE_FOLDER, image_name)
-        
-        if os.path.isfile(image_path) and image_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-            print(f"\n{'='*20}\nProcessing image: {image_name}\n{'='*20}")
-
-            # Create a dedicated folder for this image's results
-            base_name, _ = os.path.splitext(image_name)
-            image_specific_folder = os.path.join(OUTPUT_FOLDER, base_name)
-            os.makedirs(image_specific_folder, exist_ok=True)
-            print(f"  - Created output folder: {image_specific_folder}")
-
-            original_image = cv2.imread(image_path)
-            if original_image is None:
-                print("  - Could not read image.")
-                continue
-
-            # --- 1. INITIAL SCAN ---
-            # Perform the first pass on the entire image
-            print("  - Performing initial scan on the full image...")
-            initial_results = model(original_image, conf=CONFIDENCE_THRESHOLD)
-            
-            if initial_results[0].masks is None:
-                print("  - No documents detected in the initial scan.")
-                continue
-                
-            initial_masks = initial_results[0].masks
-            print(f"  - Initial scan found {len(initial_masks)} potential document(s).")
-
-            # --- 2. REFINE EACH INITIAL FINDING ---
-            doc_counter = 1
-            for polygon in initial_masks.xy:
-                # Crop each potential document from the original image
-                x, y, w, h = cv2.boundingRect(np.array(polygon, dtype=np.int32))
-                initial_crop = original_image[
-                    max(0, y - CROP_BUFFER): y + h + CROP_BUFFER,
-                    max(0, x - CROP_BUFFER): x + w + CROP_BUFFER
-                ]
-                
-                # Define the base name for any files that result from this crop
-                output_prefix = os.path.join(image_specific_folder, base_name)
-                
-                # Kick off the recursive refinement process for this crop
-                doc_counter = refine_and_save(initial_crop, model, output_prefix, doc_counter)
+    folders = dict(recorded or {})
+    taken = {os.path.normcase(folder) for folder in folders.values()}
+    for name in sorted(set(names) - set(folders)):
+        rel_dir, image_name = os.path.split(name)
+        base_name, extension = os.path.splitext(image_name)
+        folder = plain = os.path.join(rel_dir, base_name)
+        suffix = 1
+        while os.path.normcase(folder) in taken:
+            # a.png next to a.jpg, then A.png on a case-insensitive file system
+            folder = f"{plain}_{extension.lstrip('.').lower()}" + (f"_{suffix}" if suffix > 1 else "")
+            suffix += 1
+        taken.add(os.path.normcase(folder))
+        folders[name] = folder
+    return folders
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+class Manifest:
+    """
+    Append-only JSONL log of per-image results. The last record of an image wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        text = ""
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            for line in text.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash; that image is simply redone.
+                    continue
+                self.records[record["image"]] = record
+        self._file = open(path, 'a', encoding='utf-8')
+        if text and not text.endswith("\n"):
+            self._file.write("\n")
+
+    def is_complete(self, image, signature):
+        record = self.records.get(image)
+        return (record is not None and record["status"] in COMPLETED_STATUSES
+                and record.get("size") == signature["size"] and record.get("mtime") == signature["mtime"])
+
+    def record(self, image, status, **fields):
+        record = {"image": image, "status": status, **fields}
+        self.records[image] = record
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def extract_and_verify_documents(image_folder=IMAGE_FOLDER, output_folder=OUTPUT_FOLDER, model_path=MODEL_PATH,
+                                 backend=MODEL_BACKEND, recursive=False, batch_size=BATCH_SIZE,
+                                 decode_workers=DECODE_WORKERS, write_workers=WRITE_WORKERS,
+                                 overwrite=False, model=None):
+    """
+    Extracts the documents of every image in image_folder into output_folder,
+    one subfolder per image, named after the image file (mirroring subfolders
+    when recursive, see output_folders()).
+
+    Images the manifest marks as completed are skipped, so an interrupted run
+    can be restarted. overwrite=True clears the output folder first.
+
+    Args:
+        model (optional): An already loaded model; model_path/backend are
+            used to load one otherwise.
+
+    Returns:
+        dict: Counts and throughput of this run, or None if it could not start.
+    """
+    if not os.path.exists(image_folder):
+        print(f"Error: The folder '{image_folder}' does not exist.")
+        return None
+    if model is None:
+        if backend == 'pytorch' and not os.path.exists(model_path):
+            print(f"ERROR: Model file not found at '{model_path}'")
+            return None
+        model = load_model(model_path, backend=backend)
+
+    if overwrite and os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = Manifest(os.path.join(output_folder, MANIFEST_NAME))
+
+    names = find_images(image_folder, recursive)
+    todo = []
+    signatures = {}
+    recorded = {}
+    for name in names:
+        signatures[name] = file_signature(os.path.join(image_folder, name))
+        if not manifest.is_complete(name, signatures[name]):
+            todo.append(name)
+        elif "folder" in manifest.records[name]:
+            recorded[name] = manifest.records[name]["folder"]
+    skipped = len(names) - len(todo)
+    folders = output_folders(names, recorded)
+    print(f"Found {len(names)} images, {skipped} already done, {len(todo)} to process.")
+
+    def save(item):
+        """
+        Writes the documents of one image (on the pipeline's write threads).
+        Returns the saved paths, relative to output_folder.
+        """
+        name = item["key"]
+        if item["roots"] is None:
+            return []
+
+        # Create a dedicated (clean) folder for this image's results
+        base_name = os.path.splitext(os.path.basename(name))[0]
+        image_specific_folder = os.path.join(output_folder, folders[name])
+        if os.path.exists(image_specific_folder):
+            shutil.rmtree(image_specific_folder)
+        os.makedirs(image_specific_folder)
+
+        output_prefix = os.path.join(image_specific_folder, base_name)
+        documents = []
+        doc_counter = 1
+        for root in item["roots"]:
+            doc_counter = name_documents(root, output_prefix, doc_counter, documents)
+        print(f"  - {name}: {len(item['roots'])} initial detection(s), {len(documents)} document(s).")
+        return [os.path.relpath(write_document(path, image), output_folder) for path, image in documents]
+
+    pipeline = DocumentPipeline(model, conf=CONFIDENCE_THRESHOLD, crop_buffer=CROP_BUFFER, sink=save,
+                                workers={"decode": decode_workers, "detect": batch_size, "sink": write_workers},
+                                queue_size=2 * batch_size)
+    counts = collections.Counter()
+    started = time.perf_counter()
+    # An image is recorded once it has left the pipeline, i.e. once all of its
+    # files are on disk.
+    try:
+        with trace_request() as trace:
+            for name, item, error in pipeline.run((name, os.path.join(image_folder, name)) for name in todo):
+                if isinstance(error, UndecodableImage):
+                    print(f"  - Could not decode image: {name}")
+                    manifest.record(name, "unreadable", **signatures[name])
+                    counts["unreadable"] += 1
+                elif error is not None:
+                    print(f"  - Failed to process {name}: {error}")
+                    manifest.record(name, "failed", error=str(error), **signatures[name])
+                    counts["failed"] += 1
+                elif item["roots"] is None:
+                    print(f"  - {name}: no documents detected in the initial scan.")
+                    manifest.record(name, "empty", documents=0, **signatures[name])
+                    counts["empty"] += 1
+                else:
+                    files = item["output"]
+                    manifest.record(name, "done", folder=folders[name], documents=len(files), files=files,
+                                    **signatures[name])
+                    counts["done"] += 1
+                    counts["documents"] += len(files)
+    finally:
+        manifest.close()
+
+    elapsed = time.perf_counter() - started
+    processed = counts["done"] + counts["empty"]
+    summary = {
+        "images": len(names),
+        "skipped": skipped,
+        "processed": processed,
+        "empty": counts["empty"],
+        "unreadable": counts["unreadable"],
+        "failed": counts["failed"],
+        "documents": counts["documents"],
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(processed / elapsed, 2) if elapsed else 0.0,
+        "documents_per_second": round(counts["documents"] / elapsed, 2) if elapsed else 0.0,
+        # Busy time per stage, summed over its threads.
+        "stage_seconds": {name: round(seconds, 2) for name, (seconds, _) in trace.stages.items()},
+    }
+    print(f"\n{'='*20}\nProcessed {processed} images ({skipped} skipped, {counts['failed']} failed, "
+          f"{counts['unreadable']} unreadable) into {counts['documents']} documents in {elapsed:.1f}s: "
+          f"{summary['images_per_second']} images/s, {summary['documents_per_second']} docs/s.")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract every document found in a folder of images.")
+    parser.add_argument('--input', default=IMAGE_FOLDER, help="Folder with the source images")
+    parser.add_argument('--output', default=OUTPUT_FOLDER, help="Folder for the extracted documents and manifest")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path to the .pt weights")
+    parser.add_argument('--backend', choices=BACKENDS, default=MODEL_BACKEND)
+    parser.add_argument('--recursive', action='store_true', help="Also process images in subfolders")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Images per YOLO batch")
+    parser.add_argument('--decode-workers', type=int, default=DECODE_WORKERS)
+    parser.add_argument('--write-workers', type=int, default=WRITE_WORKERS)
+    parser.add_argument('--overwrite', action='store_true', help="Clear the output folder instead of resuming")
+    return parser.parse_args(argv)
+
 
 if __name__ == '__main__':
-    extract_and_verify_documents()
\ No newline at end of file
+    args = parse_args()
+    extract_and_verify_documents(args.input, args.output, args.model, args.backend, recursive=args.recursive,
+                                 batch_size=args.batch_size, decode_workers=args.decode_workers,
+                                 write_workers=args.write_workers, overwrite=args.overwrite)